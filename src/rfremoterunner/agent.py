@@ -21,7 +21,8 @@ def run_agent():
     Run the Robot Framework Agent
     """
     args = parse_args()
-    rfc = RobotFrameworkServer(args.address, args.port, args.debug)
+    rfc = RobotFrameworkServer(args.address, args.port, args.debug, args.blob_store, args.workers,
+                               args.workspace_store, args.preload, args.max_queued)
     rfc.serve()
 
 
@@ -40,6 +41,24 @@ def parse_args():
     parser.add_argument('-d', '--debug', help='Enables debug logging and will not delete the temporary directory after '
                                               'a robot run',
                         action='store_true')
+    parser.add_argument('-b', '--blob-store', help='Directory to cache files uploaded by clients in, so that unchanged '
+                                                   'files are not sent again on the next run. Default is a directory '
+                                                   'in the system temp directory')
+    parser.add_argument('-w', '--workers', help='Number of robot runs that can execute concurrently, each in its own '
+                                                'worker process. By default runs are executed one at a time inside '
+                                                'the agent process', type=int)
+    parser.add_argument('-s', '--workspace-store', help='Directory to keep the persistent workspaces that clients '
+                                                        'name with --workspace in. Default is a directory in the '
+                                                        'system temp directory')
+    parser.add_argument('--preload', help='Python module to import once when the agent starts rather than in every '
+                                          'robot run, e.g. a heavy test library such as SeleniumLibrary. With '
+                                          '--workers, each worker process starts with it already imported. Can be '
+                                          'given multiple times',
+                        action='append', default=[])
+    parser.add_argument('-q', '--max-queued', help='Maximum number of robot runs that can be waiting for a worker. '
+                                                   'Further runs are rejected straight away and the client retries '
+                                                   'once a place is likely to be free, rather than waiting on the '
+                                                   'agent. Unlimited by default', type=int)
     return parser.parse_args()
 
 
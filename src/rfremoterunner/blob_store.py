@@ -0,0 +1,114 @@
+import os
+import re
+import shutil
+import tempfile
+import logging
+
+from rfremoterunner.utils import calculate_digest
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_BLOB_STORE_DIR = os.path.join(tempfile.gettempdir(), 'rfremoterunner_blobs')
+DIGEST_REGEX = re.compile('^[0-9a-f]{64}$')
+
+
+class BlobStore:
+
+    def __init__(self, root_dir=None):
+        """
+        Constructor for BlobStore. The store holds file contents on disk addressed by their SHA-256 digest so that
+        files the agent has already received do not need to be sent again.
+
+        :param root_dir: Directory to keep the blobs in. Defaults to a directory in the system temp directory
+        :type root_dir: str
+        """
+        # Absolute, as in-process robot runs change the CWD of the agent while other requests are being handled
+        self._root_dir = os.path.abspath(root_dir or DEFAULT_BLOB_STORE_DIR)
+        if not os.path.exists(self._root_dir):
+            os.makedirs(self._root_dir)
+
+    def _blob_path(self, digest):
+        """
+        Determine where a blob is kept on disk. Blobs are fanned out into sub-directories based on the first two
+        characters of the digest to keep the directory sizes sensible.
+
+        :param digest: Hex encoded SHA-256 digest of the blob
+        :type digest: str
+
+        :return: Path of the blob on disk
+        :rtype: str
+        """
+        if not DIGEST_REGEX.match(digest):
+            raise ValueError('Invalid blob digest: {}'.format(digest))
+        return os.path.join(self._root_dir, digest[:2], digest)
+
+    def contains(self, digest):
+        """
+        :param digest: Digest of the blob
+        :type digest: str
+
+        :return: Whether the blob is held in the store
+        :rtype: bool
+        """
+        return os.path.exists(self._blob_path(digest))
+
+    def missing(self, digests):
+        """
+        Filter a list of digests down to the ones that aren't held in the store
+
+        :param digests: Digests to check
+        :type digests: list
+
+        :return: Digests of the blobs that need to be uploaded
+        :rtype: list
+        """
+        return [digest for digest in digests if not self.contains(digest)]
+
+    def put(self, digest, data):
+        """
+        Add a blob to the store. The data is verified against the digest and written via a temporary file so that a
+        partially written blob is never visible.
+
+        :param digest: Digest the client calculated for the data
+        :type digest: str
+        :param data: Blob contents
+        :type data: bytes
+        """
+        blob_path = self._blob_path(digest)
+        if calculate_digest(data) != digest:
+            raise ValueError('Blob contents do not match digest: {}'.format(digest))
+        if os.path.exists(blob_path):
+            return
+
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.exists(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError:
+                # Another request may have created it in the meantime
+                if not os.path.isdir(blob_dir):
+                    raise
+
+        file_handle, tmp_path = tempfile.mkstemp(dir=blob_dir)
+        with os.fdopen(file_handle, 'wb') as tmp_file:
+            tmp_file.write(data)
+        try:
+            os.rename(tmp_path, blob_path)
+        except OSError:
+            # The blob has been stored by another request (os.rename won't overwrite on Windows)
+            os.remove(tmp_path)
+        logger.debug('Stored blob: %s', digest)
+
+    def copy_to(self, digest, dest_path):
+        """
+        Copy a blob out of the store to a destination file
+
+        :param digest: Digest of the blob to copy
+        :type digest: str
+        :param dest_path: Path to write the blob to
+        :type dest_path: str
+        """
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            raise KeyError('Blob not held in the store: {}'.format(digest))
+        shutil.copyfile(blob_path, dest_path)
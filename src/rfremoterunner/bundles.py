@@ -0,0 +1,147 @@
+import gzip
+import io
+import logging
+import os
+from collections import OrderedDict
+import shutil
+import tarfile
+import time
+
+from rfremoterunner.compression import GZIP_LEVEL
+from rfremoterunner.utils import resolve_workspace_path
+
+logger = logging.getLogger(__file__)
+
+# Permissions of the files and directories extracted from a bundle. Anything the client sets is ignored other than
+# whether a file is executable
+FILE_MODE = 0o644
+EXECUTABLE_FILE_MODE = 0o755
+DIR_MODE = 0o755
+# Codec of bundle files written by write_bundle_file(). They can be sent to the agent without being decompressed
+BUNDLE_FILE_CODEC = 'gzip'
+# Prefix of the keys of the metadata stored in the archive's global header, which the agent ignores
+METADATA_PREFIX = 'RFREMOTERUNNER.'
+
+
+def write_bundle(fileobj, files, attachments=None, metadata=None):
+    """
+    Write files to a stream as an uncompressed tar archive. The archive is written a file at a time, so that it can be
+    sent while it is being generated
+
+    :param fileobj: File-like object to write the archive to
+    :type fileobj: file
+    :param files: Dictionary of workspace relative paths, using unix style slashes, to file contents
+    :type files: dict
+    :param attachments: Dictionary of workspace relative paths to the path of a file on disk to read the contents from.
+    The file is copied as it is, so may be binary
+    :type attachments: dict
+    :param metadata: Dictionary of strings to store with the files
+    :type metadata: dict
+    """
+    mtime = time.time()
+    pax_headers = dict((METADATA_PREFIX + key, value) for key, value in (metadata or {}).items())
+    # Follow symbolic links so that only regular files are sent
+    with tarfile.open(fileobj=fileobj, mode='w|', dereference=True, format=tarfile.PAX_FORMAT,
+                      pax_headers=pax_headers) as tar:
+        for rel_path, data in files.items():
+            info = tarfile.TarInfo(rel_path)
+            info.size = len(data)
+            info.mtime = mtime
+            info.mode = FILE_MODE
+            tar.addfile(info, io.BytesIO(data))
+        for rel_path, path in (attachments or {}).items():
+            info = tar.gettarinfo(path, rel_path)
+            with open(path, 'rb') as file_handle:
+                tar.addfile(info, file_handle)
+
+
+def write_bundle_file(path, files, attachments=None, metadata=None):
+    """
+    Write files to a compressed bundle file that can be sent to an agent later
+
+    :param path: Path of the bundle file
+    :type path: str
+    :param files: Dictionary of workspace relative paths, using unix style slashes, to file contents
+    :type files: dict
+    :param attachments: Dictionary of workspace relative paths to the path of a file on disk to read the contents from
+    :type attachments: dict
+    :param metadata: Dictionary of strings to store with the files
+    :type metadata: dict
+    """
+    with open(path, 'wb') as file_handle:
+        with gzip.GzipFile(fileobj=file_handle, mode='wb', compresslevel=GZIP_LEVEL) as compressed:
+            write_bundle(compressed, files, attachments, metadata)
+
+
+def read_bundle_file(path, include_files=True):
+    """
+    Read a bundle file written by write_bundle_file()
+
+    :param path: Path of the bundle file
+    :type path: str
+    :param include_files: Whether to read the files in the bundle, or only its metadata
+    :type include_files: bool
+
+    :return: Dictionary of workspace relative paths to file contents (empty if include_files is False), and the
+    dictionary of metadata stored with the files
+    :rtype: tuple
+    """
+    files = OrderedDict()
+    with tarfile.open(path, 'r:gz') as tar:
+        metadata = dict((key[len(METADATA_PREFIX):], value) for key, value in tar.pax_headers.items()
+                        if key.startswith(METADATA_PREFIX))
+        if include_files:
+            for member in tar:
+                if member.isfile():
+                    files[member.name] = tar.extractfile(member).read()
+    return files, metadata
+
+
+def extract_bundle(stream, workspace_dir):
+    """
+    Extract a tar archive written by write_bundle() into a workspace as it is read from a stream. Only regular files
+    and directories are extracted, and only inside the workspace
+
+    :param stream: File-like object to read the archive from
+    :type stream: file
+    :param workspace_dir: Directory to extract the archive into
+    :type workspace_dir: str
+
+    :return: Number of files extracted
+    :rtype: int
+
+    :raises ValueError: If the archive contains anything other than files and directories, or a path outside of the
+    workspace
+    """
+    count = 0
+    # Directories already created, so that each one is only checked once
+    created_dirs = set([os.path.abspath(workspace_dir)])
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            full_path = resolve_workspace_path(workspace_dir, member.name)
+            if member.isdir():
+                _make_dirs(full_path, created_dirs)
+            elif member.isfile():
+                _make_dirs(os.path.dirname(full_path), created_dirs)
+                with open(full_path, 'wb') as file_handle:
+                    shutil.copyfileobj(tar.extractfile(member), file_handle)
+                os.chmod(full_path, EXECUTABLE_FILE_MODE if member.mode & 0o100 else FILE_MODE)
+                count += 1
+            else:
+                raise ValueError('Bundle may only contain files and directories: {}'.format(member.name))
+    logger.debug('Extracted %d files into: %s', count, workspace_dir)
+    return count
+
+
+def _make_dirs(path, created_dirs):
+    """
+    :param path: Directory to create, along with any missing parents
+    :type path: str
+    :param created_dirs: Directories that have already been created, which is updated
+    :type created_dirs: set
+    """
+    if path in created_dirs:
+        return
+    if not os.path.isdir(path):
+        os.makedirs(path, DIR_MODE)
+    created_dirs.add(path)
@@ -0,0 +1,200 @@
+import zlib
+import six
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, install with the zstd extra
+    zstandard = None
+
+# Compression level of each codec, trading ratio against the CPU cost of compressing on the fly
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Prefix of the capabilities an agent advertises for the codecs it supports
+CODEC_CAPABILITY_PREFIX = 'compression_'
+DECOMPRESSION_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard is not None else (zlib.error,)
+
+
+class _GzipCodec:
+    """
+    Codec from the standard library that every agent and client supports
+    """
+    name = 'gzip'
+
+    @staticmethod
+    def compressor():
+        """
+        :return: Object with compress(data) and flush() methods that produce gzip formatted data
+        """
+        # wbits of 16 + MAX_WBITS selects the gzip container
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    @staticmethod
+    def decompressor():
+        """
+        :return: Object with decompress(data) and flush() methods that read gzip formatted data
+        """
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class _ZstdCodec:
+    """
+    Codec that compresses several times faster than gzip at a similar ratio, if zstandard is installed
+    """
+    name = 'zstd'
+
+    @staticmethod
+    def compressor():
+        """
+        :return: Object with compress(data) and flush() methods that produce zstd frames
+        """
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    @staticmethod
+    def decompressor():
+        """
+        :return: Object with decompress(data) and flush() methods that read zstd frames
+        """
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+def available_codecs():
+    """
+    :return: Names of the codecs that can be used on this machine, fastest first
+    :rtype: list
+    """
+    return [codec.name for codec in _codecs()]
+
+
+def _codecs():
+    """
+    :return: The codecs that can be used on this machine, fastest first
+    :rtype: list
+    """
+    codecs = []
+    if zstandard is not None:
+        codecs.append(_ZstdCodec)
+    codecs.append(_GzipCodec)
+    return codecs
+
+
+def get_codec(name):
+    """
+    :param name: Name of the codec, as used in the Content-Encoding header
+    :type name: str
+
+    :return: The codec
+    :rtype: class
+
+    :raises ValueError: If the codec isn't available on this machine
+    """
+    for codec in _codecs():
+        if codec.name == name:
+            return codec
+    raise ValueError('Unsupported compression codec: {}'.format(name))
+
+
+def negotiate_codec(supported, preferred):
+    """
+    Choose the codec to use between two machines
+
+    :param supported: Names of the codecs the other machine supports
+    :type supported: list
+    :param preferred: Names of the codecs this machine supports in order of preference
+    :type preferred: list
+
+    :return: Name of the first preferred codec that is supported, or None to send the data uncompressed
+    :rtype: str
+    """
+    for name in preferred:
+        if name in supported:
+            return name
+    return None
+
+
+def compress(name, data):
+    """
+    :param name: Name of the codec
+    :type name: str
+    :param data: Data to compress
+    :type data: bytes
+
+    :return: The compressed data
+    :rtype: bytes
+    """
+    compressor = get_codec(name).compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(name, data):
+    """
+    :param name: Name of the codec
+    :type name: str
+    :param data: Data to decompress
+    :type data: bytes
+
+    :return: The decompressed data
+    :rtype: bytes
+
+    :raises ValueError: If the data is not valid for the codec
+    """
+    decompressor = get_codec(name).decompressor()
+    try:
+        data = decompressor.decompress(data) + decompressor.flush()
+    except DECOMPRESSION_ERRORS as err:
+        six.raise_from(ValueError('Invalid {} data: {}'.format(name, err)), err)
+    return data
+
+
+class DecompressingReader:
+
+    def __init__(self, stream, name, chunk_size=64 * 1024, max_size=None):
+        """
+        Constructor for DecompressingReader. File-like object that decompresses a stream as it is read
+
+        :param stream: File-like object of compressed data
+        :type stream: file
+        :param name: Name of the codec the data is compressed with
+        :type name: str
+        :param chunk_size: Amount of compressed data to read from the stream at a time
+        :type chunk_size: int
+        :param max_size: Number of bytes the data may decompress to, or None for no limit
+        :type max_size: int
+        """
+        self._stream = stream
+        self._name = name
+        self._decompressor = get_codec(name).decompressor()
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._buffer = b''
+        self._decompressed = 0
+        self._finished = False
+
+    def read(self, size=-1):
+        """
+        :param size: Maximum number of bytes to read. Reads to the end of the stream if negative
+        :type size: int
+
+        :return: The decompressed bytes read, or empty at the end of the stream
+        :rtype: bytes
+
+        :raises ValueError: If the data is not valid for the codec or decompresses to more than max_size bytes
+        """
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            data = self._stream.read(self._chunk_size)
+            try:
+                if data:
+                    output = self._decompressor.decompress(data)
+                else:
+                    output = self._decompressor.flush()
+                    self._finished = True
+            except DECOMPRESSION_ERRORS as err:
+                six.raise_from(ValueError('Invalid {} data: {}'.format(self._name, err)), err)
+            self._decompressed += len(output)
+            if self._max_size is not None and self._decompressed > self._max_size:
+                raise ValueError('{} data decompresses to more than {} bytes'.format(self._name, self._max_size))
+            self._buffer += output
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
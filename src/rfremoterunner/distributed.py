@@ -0,0 +1,549 @@
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import six.moves.queue as queue
+
+from rfremoterunner.metrics import PhaseTimings
+from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.results import merge_results
+from rfremoterunner.utils import collect_test_suites
+
+logger = logging.getLogger(__file__)
+
+# Ways of distributing the suites across the agents
+STATIC_DISPATCH = 'static'
+DYNAMIC_DISPATCH = 'dynamic'
+# A shard is a straggler once it has run this many times longer than expected
+STRAGGLER_FACTOR = 1.5
+# Shards that have run for less than this are never treated as stragglers
+STRAGGLER_MIN_SECONDS = 10.0
+# Interval between checks for stragglers while waiting for the shards to finish
+STRAGGLER_CHECK_INTERVAL = 1.0
+
+
+def split_into_shards(suites, shard_count, estimate_duration=None):
+    """
+    Split a list of test suites into shards of roughly equal duration. The suites are placed longest first, each into
+    the shard with the least work so far (longest-processing-time-first bin packing).
+
+    :param suites: Test suites containing test cases
+    :type suites: list
+    :param shard_count: Maximum number of shards to split into
+    :type shard_count: int
+    :param estimate_duration: Callable that is passed a suite and returns its estimated duration. Defaults to weighting
+    each suite by its number of test cases
+    :type estimate_duration: callable
+
+    :return: List of shards, each a list of suites in the order robot would execute them. Empty shards are dropped
+    :rtype: list
+    """
+    estimate_duration = estimate_duration or (lambda suite: len(suite.tests))
+    estimates = [estimate_duration(suite) for suite in suites]
+    shards = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+    # sorted() is stable so suites with the same estimate keep their relative order
+    for index in sorted(range(len(suites)), key=lambda i: estimates[i], reverse=True):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(index)
+        loads[lightest] += estimates[index]
+    return [[suites[index] for index in sorted(shard)] for shard in shards if shard]
+
+
+class Shard:
+
+    def __init__(self, index, host, suites):
+        """
+        Constructor for Shard
+
+        :param index: Position of the shard in the run
+        :type index: int
+        :param host: Hostname/IP of the agent with optional :Port to execute the shard on
+        :type host: str
+        :param suites: Test suites in the shard
+        :type suites: list
+        """
+        self.index = index
+        self.host = host
+        self.suites = suites
+        self.result = None
+        self.error = None
+        self.output = []
+        self.predicted_duration = None
+        self.actual_duration = None
+        self.start_time = None
+        self.finished = False
+        self.cancelled = False
+        self.client = None
+
+    def cancel(self):
+        """
+        Cancel the shard's run on its agent, e.g. because a duplicate of the shard has finished first
+        """
+        self.cancelled = True
+        if self.client:
+            self.client.cancel()
+
+
+class WorkQueue:
+
+    def __init__(self, units):
+        """
+        Constructor for WorkQueue. Hands out units of work to the agents. A unit that fails is put back at the front of
+        the queue, so agents wait for the units still being executed before deciding there is no work left.
+
+        :param units: Units of work in the order they should be executed
+        :type units: list
+        """
+        self._pending = list(units)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def get(self):
+        """
+        Take the next unit of work, waiting if the queue is empty but units are still being executed
+
+        :return: The next unit, or None if there is no work left
+        :rtype: Shard
+        """
+        with self._condition:
+            while not self._pending and self._in_flight:
+                self._condition.wait()
+            if not self._pending:
+                return None
+            self._in_flight += 1
+            return self._pending.pop(0)
+
+    def task_done(self, unit, requeue=False):
+        """
+        Report that a unit taken with get() is no longer being executed
+
+        :param unit: The unit
+        :type unit: Shard
+        :param requeue: Whether to return the unit to the queue for another agent to execute
+        :type requeue: bool
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if requeue:
+                self._pending.insert(0, unit)
+            self._condition.notify_all()
+
+    def remaining(self):
+        """
+        :return: Number of units that haven't been executed
+        :rtype: int
+        """
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+
+class DistributedRun:
+
+    def __init__(self, hosts, debug=False, timing_history=None, dispatch=STATIC_DISPATCH, speculative=False,
+                 packaging_cache=None, attachments=None, priority=None):
+        """
+        Constructor for DistributedRun
+
+        :param hosts: Hostnames/IPs of the agents with optional :Port to spread the run across
+        :type hosts: list
+        :param debug: Run in debug mode. Enables extra logging and instructs the agents not to cleanup their
+        workspaces after test execution
+        :type debug: bool
+        :param timing_history: Durations of previous runs used to balance the shards. Without it the shards are
+        balanced by number of test cases
+        :type timing_history: rfremoterunner.timing.TimingHistory
+        :param dispatch: How to distribute the suites. STATIC_DISPATCH splits them into one shard per agent up front,
+        DYNAMIC_DISPATCH has each agent pull the next suite from a queue as soon as it has finished the last one
+        :type dispatch: str
+        :param speculative: With STATIC_DISPATCH, start a duplicate of a shard that is taking much longer than
+        expected on an idle agent, take the result from whichever finishes first and cancel the other
+        :type speculative: bool
+        :param packaging_cache: Cache of the robot files scanned by previous runs, shared by all of the shards
+        :type packaging_cache: rfremoterunner.packaging_cache.PackagingCache
+        :param attachments: Paths of extra files, or directories of files, to copy into the root of every agent's
+        workspace
+        :type attachments: list
+        :param priority: Lane to queue each shard in on its agent
+        :type priority: str
+        """
+        self._hosts = hosts
+        self._debug = debug
+        self._timing_history = timing_history
+        self._dispatch = dispatch
+        self._speculative = speculative
+        self._packaging_cache = packaging_cache
+        self._attachments = attachments
+        self._priority = priority
+        self._output_lock = threading.Lock()
+        # Time spent in each phase on this machine and on the agents, added up across the shards that completed
+        self.timings = PhaseTimings()
+        self.agent_timings = PhaseTimings()
+        # Index of each shard to the first attempt at it that succeeded
+        self._completed_shards = {}
+        self._results_dir = None
+        # Gives every shard execution, including duplicates, its own output xml path
+        self._attempt_ids = itertools.count()
+
+    def execute_run(self, suite_list, extensions, include_suites, robot_arg_dict, output_callback=None):
+        """
+        Sources a series of test suites and distributes the suites containing test cases across the agents, which
+        execute them concurrently. Each shard is packaged with only the dependencies its own suites need.
+
+        :param suite_list: List of paths to test suites or directories containing test suites
+        :type suite_list: list
+        :param extensions: String that filters the accepted file extensions for the test suites
+        :type extensions: str
+        :param include_suites: List of strings that filter suites to include
+        :type include_suites: list
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote hosts
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed each shard's robot stdout/stderr once the shard has finished
+        :type output_callback: callable
+
+        :return: The results of all shards merged into one
+        :rtype: robot.result.Result
+        """
+        self.timings = PhaseTimings()
+        self.agent_timings = PhaseTimings()
+        with self.timings.phase('build'):
+            suite = RemoteFrameworkClient.build_test_suite(suite_list, extensions, include_suites)
+            RemoteFrameworkClient.prune_test_suite(suite, robot_arg_dict)
+            suites = collect_test_suites(suite)
+        self._completed_shards = {}
+        # The output xml of each shard is downloaded into here
+        self._results_dir = tempfile.mkdtemp()
+        try:
+            if self._dispatch == DYNAMIC_DISPATCH:
+                shards = self._execute_dynamic(suites, robot_arg_dict, output_callback)
+            else:
+                shards = self._execute_static(suites, robot_arg_dict, output_callback)
+
+            for shard in shards:
+                self.timings.add(shard.client.timings.as_dict())
+                # Agents that pre-date the timings don't report them
+                if shard.client.agent_timings:
+                    self.agent_timings.add(shard.client.agent_timings)
+            with self.timings.phase('merge'):
+                result = self._merge_shard_results(shards)
+        finally:
+            if self._debug:
+                logger.debug('Shard outputs kept in: %s', self._results_dir)
+            else:
+                shutil.rmtree(self._results_dir, ignore_errors=True)
+
+        if self._timing_history:
+            self._timing_history.record_result(result)
+        return result
+
+    def _execute_static(self, suites, robot_arg_dict, output_callback):
+        """
+        Split the suites into one shard per agent up front and execute the shards concurrently
+
+        :param suites: Test suites containing test cases
+        :type suites: list
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote hosts
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed each shard's robot stdout/stderr once the shard has finished
+        :type output_callback: callable
+
+        :return: The executed shards
+        :rtype: list
+        """
+        estimate_duration = self._timing_history.estimate if self._timing_history else None
+        suite_shards = split_into_shards(suites, len(self._hosts), estimate_duration)
+        shards = [Shard(index, host, suites) for index, (host, suites) in enumerate(zip(self._hosts, suite_shards))]
+        if estimate_duration:
+            for shard in shards:
+                shard.predicted_duration = sum(estimate_duration(shard_suite) for shard_suite in shard.suites)
+        logger.info('Splitting %d test suites across %d agents', sum(len(shard.suites) for shard in shards),
+                    len(shards))
+
+        attempts = []
+        finished = queue.Queue()
+        for shard in shards:
+            self._start_attempt(shard, attempts, finished, robot_arg_dict, output_callback)
+
+        completed_shards = self._get_completed_shards()
+        while any(not attempt.finished for attempt in attempts if attempt.index not in completed_shards):
+            try:
+                attempt = finished.get(timeout=STRAGGLER_CHECK_INTERVAL)
+            except queue.Empty:
+                attempt = None
+            completed_shards = self._get_completed_shards()
+            if attempt is not None and completed_shards.get(attempt.index) is attempt:
+                # Stop any duplicates of the shard that are still running
+                for other in attempts:
+                    if other.index == attempt.index and not other.finished:
+                        logger.info('Cancelling shard %d on %s', other.index, other.host)
+                        other.cancel()
+            if self._speculative:
+                self._start_speculative_attempts(shards, attempts, finished, robot_arg_dict, output_callback,
+                                                 completed_shards)
+
+        completed_shards = self._get_completed_shards()
+        failed_attempts = [attempt for attempt in attempts if attempt.index not in completed_shards]
+        if failed_attempts:
+            raise RuntimeError('Execution failed on: {}'.format(
+                ', '.join('{} ({})'.format(attempt.host, attempt.error) for attempt in failed_attempts)))
+
+        completed = [completed_shards[shard.index] for shard in shards]
+        self._report_shard_durations(completed)
+        return completed
+
+    def _get_completed_shards(self):
+        """
+        :return: Copy of the dictionary of each shard's index to the first attempt at it that succeeded, which the shard
+        threads add to while the run is in progress
+        :rtype: dict
+        """
+        with self._output_lock:
+            return dict(self._completed_shards)
+
+    def _start_attempt(self, shard, attempts, finished, robot_arg_dict, output_callback):
+        """
+        Start executing a shard on its agent in a new thread
+
+        :param shard: Shard to execute
+        :type shard: Shard
+        :param attempts: List of every shard execution started, which the shard is added to
+        :type attempts: list
+        :param finished: Queue the shard is put on once it has finished executing
+        :type finished: queue.Queue
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the shard's robot stdout/stderr once it has finished
+        :type output_callback: callable
+        """
+        def execute():
+            try:
+                self._execute_shard(shard, robot_arg_dict, output_callback)
+            finally:
+                shard.finished = True
+                finished.put(shard)
+
+        shard.start_time = time.time()
+        attempts.append(shard)
+        thread = threading.Thread(target=execute)
+        # A duplicate on an agent that can't cancel runs shouldn't stop the executor exiting once the run is complete
+        thread.daemon = True
+        thread.start()
+
+    def _start_speculative_attempts(self, shards, attempts, finished, robot_arg_dict, output_callback,
+                                    completed_shards):
+        """
+        Start a duplicate of each shard that is taking much longer than expected on an agent that is idle. A shard is
+        expected to take as long as its predicted duration or, if longer, the median duration of the shards that have
+        finished. Each shard is only duplicated once.
+
+        :param shards: Shards in the run
+        :type shards: list
+        :param attempts: List of every shard execution started
+        :type attempts: list
+        :param finished: Queue that shards are put on once they have finished executing
+        :type finished: queue.Queue
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote hosts
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed each shard's robot stdout/stderr once the shard has finished
+        :type output_callback: callable
+        :param completed_shards: Dictionary of each shard's index to the first attempt at it that succeeded
+        :type completed_shards: dict
+        """
+        unusable_hosts = set(attempt.host for attempt in attempts
+                             if not attempt.finished or (attempt.error is not None and not attempt.cancelled))
+        idle_hosts = [host for host in self._hosts if host not in unusable_hosts]
+        finished_durations = sorted(shard.actual_duration for shard in completed_shards.values())
+        median_duration = finished_durations[len(finished_durations) // 2] if finished_durations else 0
+
+        for shard in shards:
+            if not idle_hosts:
+                return
+            shard_attempts = [attempt for attempt in attempts if attempt.index == shard.index]
+            if shard.index in completed_shards or len(shard_attempts) > 1 or shard.finished:
+                continue
+            expected_duration = max(shard.predicted_duration or 0, median_duration)
+            elapsed = time.time() - shard.start_time
+            if not expected_duration or elapsed < max(expected_duration * STRAGGLER_FACTOR, STRAGGLER_MIN_SECONDS):
+                continue
+
+            duplicate = Shard(shard.index, idle_hosts.pop(0), shard.suites)
+            duplicate.predicted_duration = shard.predicted_duration
+            logger.info('Shard %d on %s has run for %.1fs (expected %.1fs), starting a duplicate on %s', shard.index,
+                        shard.host, elapsed, expected_duration, duplicate.host)
+            self._start_attempt(duplicate, attempts, finished, robot_arg_dict, output_callback)
+
+    def _execute_dynamic(self, suites, robot_arg_dict, output_callback):
+        """
+        Queue each suite as its own unit of work and have every agent pull the next unit as soon as it has finished the
+        last one, so faster agents end up executing more suites. The longest suites are queued first. If an agent
+        fails, the unit it was executing is returned to the queue for the remaining agents.
+
+        :param suites: Test suites containing test cases
+        :type suites: list
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote hosts
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed each unit's robot stdout/stderr once the unit has finished
+        :type output_callback: callable
+
+        :return: The executed units, one per suite
+        :rtype: list
+        """
+        estimate_duration = self._timing_history.estimate if self._timing_history else (lambda s: len(s.tests))
+        work_queue = WorkQueue([Shard(index, None, [unit_suite]) for index, unit_suite in
+                                enumerate(sorted(suites, key=estimate_duration, reverse=True))])
+        logger.info('Queueing %d test suites for %d agents', len(suites), len(self._hosts))
+
+        completed = []
+        failed_hosts = []
+        threads = []
+        for host in self._hosts:
+            thread = threading.Thread(target=self._pull_work,
+                                      args=(host, work_queue, completed, failed_hosts, robot_arg_dict, output_callback))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if work_queue.remaining():
+            raise RuntimeError('Execution failed on: {}'.format(
+                ', '.join('{} ({})'.format(host, err) for host, err in failed_hosts)))
+
+        self._report_agent_durations(completed)
+        return completed
+
+    def _pull_work(self, host, work_queue, completed, failed_hosts, robot_arg_dict, output_callback):
+        """
+        Thread target that executes units from the queue on an agent until the queue is empty or the agent fails
+
+        :param host: Hostname/IP of the agent with optional :Port
+        :type host: str
+        :param work_queue: Queue of units that are yet to be executed
+        :type work_queue: WorkQueue
+        :param completed: List to add the executed units to
+        :type completed: list
+        :param failed_hosts: List to add the agent and its error to if it fails
+        :type failed_hosts: list
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed each unit's robot stdout/stderr once the unit has finished
+        :type output_callback: callable
+        """
+        while True:
+            unit = work_queue.get()
+            if unit is None:
+                return
+
+            unit.host = host
+            self._execute_shard(unit, robot_arg_dict, output_callback)
+            if unit.error is not None:
+                # Stop using the agent and let another one pick the unit up
+                failed_hosts.append((host, unit.error))
+                work_queue.task_done(Shard(unit.index, None, unit.suites), requeue=True)
+                return
+            completed.append(unit)
+            work_queue.task_done(unit)
+
+    def _execute_shard(self, shard, robot_arg_dict, output_callback):
+        """
+        Thread target that packages a shard and executes it on its agent. The console output is buffered so that the
+        output of concurrent shards isn't interleaved.
+
+        :param shard: Shard to execute
+        :type shard: Shard
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the shard's robot stdout/stderr once it has finished
+        :type output_callback: callable
+        """
+        logger.debug('Shard %d: %s', shard.index, ', '.join(suite.name for suite in shard.suites))
+        start_time = time.time()
+        try:
+            shard.client = RemoteFrameworkClient(shard.host, self._debug, packaging_cache=self._packaging_cache,
+                                                 attachments=self._attachments, priority=self._priority)
+            if shard.cancelled:
+                shard.client.cancel()
+            output_xml_path = os.path.join(self._results_dir,
+                                           'shard_{}_{}_output.xml'.format(shard.index, next(self._attempt_ids)))
+            shard.result = shard.client.execute_suites(shard.suites, robot_arg_dict, shard.output.append,
+                                                       {'output_xml': output_xml_path})
+            if shard.result.get('std_out_err'):
+                shard.output.append(shard.result['std_out_err'].data.decode('utf-8'))
+        except Exception as err:  # pylint: disable=broad-except
+            if shard.cancelled:
+                logger.debug('Shard %d cancelled on %s', shard.index, shard.host)
+            else:
+                logger.error('Shard %d failed on %s: %s', shard.index, shard.host, err)
+            shard.error = err
+            return
+        finally:
+            shard.actual_duration = time.time() - start_time
+
+        with self._output_lock:
+            if shard.index in self._completed_shards:
+                # A duplicate of the shard finished first
+                return
+            self._completed_shards[shard.index] = shard
+            logger.info('\nShard %d finished on %s with return code %s', shard.index, shard.host,
+                        shard.result.get('ret_code'))
+            if output_callback:
+                output_callback(''.join(shard.output))
+
+    @staticmethod
+    def _report_shard_durations(shards):
+        """
+        Log how long each shard was predicted to take against how long it actually took
+
+        :param shards: Executed shards
+        :type shards: list
+        """
+        logger.info('\nShard durations:')
+        for shard in shards:
+            predicted = '{:.1f}s'.format(shard.predicted_duration) if shard.predicted_duration is not None else 'n/a'
+            logger.info('Shard %d on %s: %d suites, predicted %s, actual %.1fs', shard.index, shard.host,
+                        len(shard.suites), predicted, shard.actual_duration)
+        predicted_durations = [shard.predicted_duration for shard in shards if shard.predicted_duration is not None]
+        predicted_makespan = '{:.1f}s'.format(max(predicted_durations)) if predicted_durations else 'n/a'
+        logger.info('Makespan: predicted %s, actual %.1fs', predicted_makespan,
+                    max(shard.actual_duration for shard in shards))
+
+    @staticmethod
+    def _report_agent_durations(units):
+        """
+        Log how many suites each agent executed and how long it was busy for
+
+        :param units: Executed units
+        :type units: list
+        """
+        logger.info('\nAgent durations:')
+        busy_durations = {}
+        for host in sorted(set(unit.host for unit in units)):
+            host_units = [unit for unit in units if unit.host == host]
+            busy_durations[host] = sum(unit.actual_duration for unit in host_units)
+            logger.info('%s: %d suites, busy %.1fs', host, len(host_units), busy_durations[host])
+        if busy_durations:
+            logger.info('Makespan: %.1fs', max(busy_durations.values()))
+
+    @staticmethod
+    def _merge_shard_results(shards):
+        """
+        Merge the output xml downloaded from each shard into a single result
+
+        :param shards: Executed shards
+        :type shards: list
+
+        :return: The merged result
+        :rtype: robot.result.Result
+        """
+        output_paths = []
+        for shard in shards:
+            output_xml_path = shard.result['artifact_paths'].get('output_xml')
+            if not output_xml_path:
+                # e.g. none of the shard's tests were selected by --test/--include/--exclude
+                logger.warning('Shard %d on %s did not produce an output xml', shard.index, shard.host)
+                continue
+            output_paths.append(output_xml_path)
+
+        return merge_results(output_paths)
@@ -2,14 +2,38 @@ import sys
 import os
 import logging
 
-from rfremoterunner.utils import write_file_to_disk
-from rfremoterunner.executor_argparser import ExecutorArgumentParser
+from rfremoterunner.distributed import DistributedRun
+from rfremoterunner.executor_argparser import ExecutorArgumentParser, PACK_COMMAND, SEND_COMMAND
+from rfremoterunner.metrics import PhaseTimings, CLIENT_PHASES, AGENT_PHASES
+from rfremoterunner.packaging_cache import PackagingCache
+from rfremoterunner.results import write_results, generate_log_and_report, OUTPUT_ONLY_ROBOT_ARGS
 from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.timing import TimingHistory
 
 logging.basicConfig(format='%(message)s', level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__file__)
 
 
+class RobotOutputPrinter:
+    """
+    Prints the robot stdout/stderr received from the agent, preceded by a header the first time output is received
+    """
+
+    def __init__(self):
+        self._header_printed = False
+
+    def __call__(self, text):
+        """
+        :param text: Robot stdout/stderr to print
+        :type text: str
+        """
+        if not self._header_printed:
+            logger.info('\nRobot execution response:')
+            self._header_printed = True
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
 def run_executor():
     """
     Initialise and run the executor
@@ -20,35 +44,153 @@ def run_executor():
     level = logging.DEBUG if arg_parser.debug else logging.INFO
     logger.setLevel(level)
 
-    # Initialise and execute the remote robot run
-    rfs = RemoteFrameworkClient(arg_parser.host, arg_parser.debug)
-    result = rfs.execute_run(arg_parser.suites, arg_parser.extension, arg_parser.suite, arg_parser.robot_run_args)
+    packaging_cache = None
+    if arg_parser.command != SEND_COMMAND and arg_parser.packaging_cache:
+        packaging_cache = PackagingCache(arg_parser.packaging_cache)
+
+    if arg_parser.command == PACK_COMMAND:
+        ret_code = _pack(arg_parser, packaging_cache)
+    else:
+        output_dir = arg_parser.outputdir or '.'
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        print_robot_output = RobotOutputPrinter()
+        if len(arg_parser.hosts) > 1:
+            ret_code = _execute_distributed_run(arg_parser, print_robot_output, packaging_cache)
+        else:
+            ret_code = _execute_single_run(arg_parser, print_robot_output, packaging_cache)
+
+    if packaging_cache:
+        logger.debug('Packaging cache: %d hits, %d misses', packaging_cache.hits, packaging_cache.misses)
+        packaging_cache.save()
+
+    sys.exit(ret_code)
+
+
+def _pack(arg_parser, packaging_cache=None):
+    """
+    Package the test suites into a bundle file
+
+    :param arg_parser: Parsed input arguments
+    :type arg_parser: ExecutorArgumentParser
+    :param packaging_cache: Cache of the robot files scanned by previous runs
+    :type packaging_cache: rfremoterunner.packaging_cache.PackagingCache
+
+    :return: Exit code
+    :rtype: int
+    """
+    rfs = RemoteFrameworkClient(None, arg_parser.debug, packaging_cache=packaging_cache, attachments=arg_parser.attach)
+    file_count = rfs.pack(arg_parser.suites, arg_parser.extension, arg_parser.suite, arg_parser.robot_run_args,
+                          arg_parser.bundle)
+    logger.info('Bundle:        %s (%d files, %d bytes)', arg_parser.bundle, file_count,
+                os.path.getsize(arg_parser.bundle))
+    logger.info(PhaseTimings.format_summary('\nTimings on this machine:', rfs.timings.as_dict(), CLIENT_PHASES))
+    return 0
+
 
-    # Print the robot stdout/stderr
-    logger.info('\nRobot execution response:')
-    logger.info(result.get('std_out_err'))
+def _execute_single_run(arg_parser, print_robot_output, packaging_cache=None):
+    """
+    Execute the robot run on a single agent, or send it a bundle file, and save the test artifacts it returns
+
+    :param arg_parser: Parsed input arguments
+    :type arg_parser: ExecutorArgumentParser
+    :param print_robot_output: Callable that prints the robot stdout/stderr
+    :type print_robot_output: callable
+    :param packaging_cache: Cache of the robot files scanned by previous runs
+    :type packaging_cache: rfremoterunner.packaging_cache.PackagingCache
+
+    :return: Robot return code
+    :rtype: int
+    """
+    robot_run_args = arg_parser.robot_run_args
+    artifact_paths = {'output_xml': arg_parser.get_output_xml_output_location()}
+    if arg_parser.local_log_report:
+        robot_run_args = dict(robot_run_args, **OUTPUT_ONLY_ROBOT_ARGS)
+    else:
+        artifact_paths['log_html'] = arg_parser.get_log_html_output_location()
+        artifact_paths['report_html'] = arg_parser.get_report_html_output_location()
+
+    # Initialise and execute the remote robot run, printing the robot stdout/stderr as it arrives. The log html,
+    # report html and output xml are saved straight to disk
+    if arg_parser.command == SEND_COMMAND:
+        rfs = RemoteFrameworkClient(arg_parser.hosts[0], arg_parser.debug, arg_parser.workspace,
+                                    priority=arg_parser.priority)
+        result = rfs.execute_bundle(arg_parser.bundle, robot_run_args, print_robot_output, artifact_paths)
+    else:
+        rfs = RemoteFrameworkClient(arg_parser.hosts[0], arg_parser.debug, arg_parser.workspace, packaging_cache,
+                                    arg_parser.attach, arg_parser.priority)
+        result = rfs.execute_run(arg_parser.suites, arg_parser.extension, arg_parser.suite, robot_run_args,
+                                 print_robot_output, artifact_paths)
+
+    # Agents that can't stream the robot stdout/stderr return it once the run has finished
+    if result.get('std_out_err'):
+        print_robot_output(result['std_out_err'].data.decode('utf-8'))
+
+    saved_paths = result['artifact_paths']
+    if arg_parser.local_log_report and 'output_xml' in saved_paths:
+        saved_paths['log_html'] = arg_parser.get_log_html_output_location()
+        saved_paths['report_html'] = arg_parser.get_report_html_output_location()
+        generate_log_and_report(saved_paths['output_xml'], saved_paths['log_html'], saved_paths['report_html'])
+
+    if 'output_xml' in saved_paths:
+        logger.info('Local Output:  %s', saved_paths['output_xml'])
+    if 'log_html' in saved_paths:
+        logger.info('Local Log:     %s', saved_paths['log_html'])
+    if 'report_html' in saved_paths:
+        logger.info('Local Report:  %s', saved_paths['report_html'])
+
+    logger.info(PhaseTimings.format_summary('\nTimings on this machine:', rfs.timings.as_dict(), CLIENT_PHASES))
+    # Agents that pre-date the timings don't report them
+    if rfs.agent_timings:
+        logger.info(PhaseTimings.format_summary('Timings on the agent:', rfs.agent_timings, AGENT_PHASES))
+
+    return result.get('ret_code', 1)
+
+
+def _execute_distributed_run(arg_parser, print_robot_output, packaging_cache=None):
+    """
+    Split the robot run across multiple agents, then merge the results and generate the log and report locally
+
+    :param arg_parser: Parsed input arguments
+    :type arg_parser: ExecutorArgumentParser
+    :param print_robot_output: Callable that prints the robot stdout/stderr
+    :type print_robot_output: callable
+    :param packaging_cache: Cache of the robot files scanned by previous runs
+    :type packaging_cache: rfremoterunner.packaging_cache.PackagingCache
+
+    :return: Robot return code of the merged result
+    :rtype: int
+    """
+    output_xml_path = arg_parser.get_output_xml_output_location()
 
-    output_dir = arg_parser.outputdir or '.'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    # Balance the shards using the timings of previous runs, including the output xml left by the last one
+    timing_history = TimingHistory(arg_parser.get_timing_history_location())
+    if os.path.exists(output_xml_path):
+        timing_history.record_output_xml(output_xml_path)
 
-    # Write the log html, report html, output xml
-    if result.get('output_xml'):
-        output_xml_path = arg_parser.get_output_xml_output_location()
-        write_file_to_disk(output_xml_path, result['output_xml'].data.decode('utf-8'))
-        logger.info('Local Output:  %s', output_xml_path)
+    distributed_run = DistributedRun(arg_parser.hosts, arg_parser.debug, timing_history, arg_parser.dispatch,
+                                     arg_parser.speculative, packaging_cache, arg_parser.attach, arg_parser.priority)
+    # The log and report are generated from the merged result so the agents don't need to generate them
+    result = distributed_run.execute_run(arg_parser.suites, arg_parser.extension, arg_parser.suite,
+                                         dict(arg_parser.robot_run_args, **OUTPUT_ONLY_ROBOT_ARGS), print_robot_output)
+    timing_history.save()
 
-    if result.get('log_html'):
-        log_html_path = arg_parser.get_log_html_output_location()
-        write_file_to_disk(log_html_path, result['log_html'].data.decode('utf-8'))
-        logger.info('Local Log:     %s', log_html_path)
+    log_html_path = arg_parser.get_log_html_output_location()
+    report_html_path = arg_parser.get_report_html_output_location()
+    ret_code = write_results(result, output_xml_path, log_html_path, report_html_path)
+    logger.info('Local Output:  %s', output_xml_path)
+    logger.info('Local Log:     %s', log_html_path)
+    logger.info('Local Report:  %s', report_html_path)
 
-    if result.get('report_html'):
-        report_html_path = arg_parser.get_report_html_output_location()
-        write_file_to_disk(report_html_path, result['report_html'].data.decode('utf-8'))
-        logger.info('Local Report:  %s', report_html_path)
+    # The shards execute concurrently, so their timings add up to more than the time the run took
+    logger.info(PhaseTimings.format_summary('\nTimings on this machine, added up across the shards:',
+                                            distributed_run.timings.as_dict(), CLIENT_PHASES))
+    if distributed_run.agent_timings.durations:
+        logger.info(PhaseTimings.format_summary('Timings on the agents, added up across the shards:',
+                                                distributed_run.agent_timings.as_dict(), AGENT_PHASES))
 
-    sys.exit(result.get('ret_code', 1))
+    return ret_code
 
 
 if __name__ == '__main__':
@@ -1,7 +1,13 @@
 import argparse
 import os
 
+from rfremoterunner.jobs import PRIORITIES
+
 ROBOT_RUN_ARGS = ['loglevel', 'include', 'test', 'exclude', 'suite', 'extension']
+# Commands that can be given as the first argument. Without one, the suites are packaged and run in one go
+RUN_COMMAND = 'run'
+PACK_COMMAND = 'pack'
+SEND_COMMAND = 'send'
 
 
 class ExecutorArgumentParser:
@@ -12,7 +18,12 @@ class ExecutorArgumentParser:
         :param args: Arguments to process (probably stdin)
         :type args: list
         """
-        self._parser = self._init_parser()
+        # The first argument can name a command, otherwise the suites are packaged and run in one go
+        self.command = RUN_COMMAND
+        if args and args[0] in (PACK_COMMAND, SEND_COMMAND):
+            self.command = args[0]
+            args = args[1:]
+        self._parser = self._init_parser(self.command)
         parsed_args = self._parser.parse_args(args)
 
         # Because of some limitations in argparse and not being able to specify multiple arguments of the same name,
@@ -29,25 +40,117 @@ class ExecutorArgumentParser:
                     self.robot_run_args[arg_name] = arg_val
             setattr(self, arg_name, arg_val)
 
+        # Multiple hosts can be given to shard the run across several agents
+        host = getattr(parsed_args, 'host', '')
+        self.hosts = [host.strip() for host in host.split(',') if host.strip()]
+        if self.command == SEND_COMMAND and len(self.hosts) > 1:
+            self._parser.error('a bundle can only be sent to a single host')
+
     @staticmethod
-    def _init_parser():
+    def _init_parser(command=RUN_COMMAND):
         """
-        Initialise the ArgumentParser instance with the supported arguments
+        Initialise the ArgumentParser instance with the arguments supported by a command
+
+        :param command: RUN_COMMAND, PACK_COMMAND or SEND_COMMAND
+        :type command: str
 
         :return: Argument parser instance
         :rtype: ArgumentParser
         """
-        parser = argparse.ArgumentParser(description='Script to initiate a remote robot framework test execution')
+        if command == PACK_COMMAND:
+            return ExecutorArgumentParser._init_pack_parser()
+        if command == SEND_COMMAND:
+            return ExecutorArgumentParser._init_send_parser()
+        parser = argparse.ArgumentParser(description='Script to initiate a remote robot framework test execution',
+                                         epilog='Test suites can also be packaged once with "rfremoterun pack" and '
+                                                'then executed with "rfremoterun send"')
         parser.add_argument('host',
                             help='IP or Hostname of the server to execute the robot run on. You can optionally specify '
                                  'the port the server is listening on by adding ":<port>". If not specified the port '
-                                 'will be defaulted to 1471')
+                                 'will be defaulted to 1471. To split the run across multiple agents, specify each '
+                                 'host separated by a comma, e.g. host1,host2:1472')
         parser.add_argument('suites', nargs='+',
                             help='One or more paths to test suites or directories containing test suites')
+        ExecutorArgumentParser._add_debug_arg(parser)
+        ExecutorArgumentParser._add_output_args(parser)
+        parser.add_argument('--dispatch', choices=['static', 'dynamic'], default='static',
+                            help='How to distribute the test suites when the run is split across multiple agents. '
+                                 '"static" splits them into one shard per agent before the run starts. "dynamic" '
+                                 'queues the suites and each agent executes the next one as soon as it is free, which '
+                                 'copes better with agents of different speeds. Default: static')
+        parser.add_argument('--speculative', action='store_true',
+                            help='When the run is split across multiple agents with --dispatch static, start a '
+                                 'duplicate of a shard that is taking much longer than expected on an agent that has '
+                                 'finished its own shard. The result of whichever finishes first is used and the other '
+                                 'is cancelled')
+        parser.add_argument('--timing-history',
+                            help='JSON file on this machine that records how long each test suite took in previous '
+                                 'runs. When the run is split across multiple agents it is used to give each agent a '
+                                 'similar amount of work, and is updated with the timings from the previous output '
+                                 'xml and the new run. Default: rfremoterunner_timings.json',
+                            default='rfremoterunner_timings.json')
+        ExecutorArgumentParser._add_packaging_args(parser)
+        ExecutorArgumentParser._add_selection_args(parser)
+        ExecutorArgumentParser._add_robot_args(parser)
+        return parser
+
+    @staticmethod
+    def _init_pack_parser():
+        """
+        :return: Argument parser instance for the pack command
+        :rtype: ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog='rfremoterun pack',
+                                         description='Package test suites and their dependencies into a bundle file '
+                                                     'that can be executed on a remote host with "rfremoterun send" '
+                                                     'without parsing them again')
+        parser.add_argument('bundle', help='Path of the bundle file to write')
+        parser.add_argument('suites', nargs='+',
+                            help='One or more paths to test suites or directories containing test suites')
+        parser.add_argument('--debug', help='Enable debug logging', action='store_true')
+        ExecutorArgumentParser._add_packaging_args(parser)
+        ExecutorArgumentParser._add_selection_args(parser)
+        return parser
+
+    @staticmethod
+    def _init_send_parser():
+        """
+        :return: Argument parser instance for the send command
+        :rtype: ArgumentParser
+        """
+        parser = argparse.ArgumentParser(prog='rfremoterun send',
+                                         description='Execute the test suites in a bundle file written by '
+                                                     '"rfremoterun pack" on a remote host')
+        parser.add_argument('bundle', help='Path of the bundle file to send')
+        parser.add_argument('host',
+                            help='IP or Hostname of the server to execute the robot run on. You can optionally specify '
+                                 'the port the server is listening on by adding ":<port>". If not specified the port '
+                                 'will be defaulted to 1471')
+        ExecutorArgumentParser._add_debug_arg(parser)
+        ExecutorArgumentParser._add_output_args(parser)
+        ExecutorArgumentParser._add_selection_args(parser)
+        ExecutorArgumentParser._add_robot_args(parser)
+        return parser
+
+    @staticmethod
+    def _add_debug_arg(parser):
+        """
+        :param parser: Argument parser instance
+        :type parser: ArgumentParser
+        """
         parser.add_argument('--debug',
                             help='Run in debug mode. This will enable debug logging and does not cleanup the workspace '
                                  'directory on the remote machine after test execution', action='store_true')
 
+    @staticmethod
+    def _add_output_args(parser):
+        """
+        Add the arguments that control where the test artifacts are saved, and the workspace and queue the run is
+        executed in
+
+        :param parser: Argument parser instance
+        :type parser: ArgumentParser
+        """
         # Although these arguments are ones that robot accepts, they won't be passed into the remote robot execution.
         # The output artifacts will be placed in the workspace directory on the remote host and when pulled back they
         # are saved to the local machine as per configured by the arguments below
@@ -69,6 +172,46 @@ class ExecutorArgumentParser:
                             help='Where to save the HTML Report file on this machine once its been retrieved. Default: '
                                  'remote_report.html',
                             default='remote_report.html')
+        parser.add_argument('--local-log-report', action='store_true',
+                            help='Only retrieve the XML output file from the remote machine and generate the HTML Log '
+                                 'and Report files on this machine. Both embed the whole test result again, so this '
+                                 'cuts the amount of data transferred by around two thirds')
+        parser.add_argument('--workspace',
+                            help='Name of a persistent workspace on the remote machine to run in. The workspace is '
+                                 'kept between runs, so only the files that have been added, changed or removed since '
+                                 'the last run with the same name are sent. Only applies when the run is executed on a '
+                                 'single agent')
+        parser.add_argument('--priority', choices=PRIORITIES,
+                            help='Priority to queue the run with on the remote machine. Queued "high" runs, e.g. '
+                                 'release gating runs, start before "normal" runs, which start before "low" runs, e.g. '
+                                 'nightly runs. Default: normal')
+
+    @staticmethod
+    def _add_packaging_args(parser):
+        """
+        Add the arguments that control how the test suites are packaged
+
+        :param parser: Argument parser instance
+        :type parser: ArgumentParser
+        """
+        parser.add_argument('--attach', action='append',
+                            help='Extra file, or directory of files, to copy into the root of the workspace on the '
+                                 'remote machine as it is, e.g. test data or binary files that the test suites read '
+                                 'at run time. Can be given multiple times')
+        parser.add_argument('--packaging-cache',
+                            help='JSON file on this machine to cache the scanned contents and resolved imports of '
+                                 'each test suite and resource file in. Files that haven\'t changed since the last run '
+                                 'are then not parsed again. Disabled by default')
+
+    @staticmethod
+    def _add_selection_args(parser):
+        """
+        Add the arguments that select the test suites and test cases to package, which are also passed into robot.run
+        on the remote host
+
+        :param parser: Argument parser instance
+        :type parser: ArgumentParser
+        """
         parser.add_argument('-F', '--extension',
                             help='Parse only files with this extension when executing a directory. Has no effect when '
                                  'running individual files or when using resource files. If more than one extension is '
@@ -80,8 +223,6 @@ class ExecutorArgumentParser:
                                  'can contain parent name separated with a dot. You can specify multiple filters by '
                                  'concatenating with a colon. For example `-s X.Y` selects suite `Y` '
                                  'only if its parent is `X`. -s X:Y:Z selects X, Y & Z')
-
-        # Arguments passed into robot.run on the remote host:
         parser.add_argument('-t', '--test',
                             help='Select test cases to run by name or long name. Name is case insensitive and'
                                  ' it can also be a simple pattern where `*` matches anything and `?` matches any '
@@ -95,11 +236,18 @@ class ExecutorArgumentParser:
                             help='Select test cases not to run by tag. These tests are not run even if included with '
                                  '--include. Tags are matched using the rules explained with --include.')
 
+    @staticmethod
+    def _add_robot_args(parser):
+        """
+        Add the arguments that are only passed into robot.run on the remote host
+
+        :param parser: Argument parser instance
+        :type parser: ArgumentParser
+        """
         parser.add_argument('-L', '--loglevel',
                             help=' Threshold level for logging. Available levels: TRACE, DEBUG, INFO (default), WARN, '
                                  'NONE (no logging). Use syntax `LOGLEVEL:DEFAULT` to define the default visible log '
                                  'level in log files. Examples: --loglevel DEBUG --loglevel DEBUG:INFO')
-        return parser
 
     def get_log_html_output_location(self):
         """
@@ -128,6 +276,15 @@ class ExecutorArgumentParser:
         """
         return self._resolve_output_path(self.report)
 
+    def get_timing_history_location(self):
+        """
+        Determine the local location of the timing history file based on the input arguments
+
+        :return: Path to the timing history file
+        :rtype: str
+        """
+        return self._resolve_output_path(self.timing_history)
+
     def _resolve_output_path(self, filename):
         """
         Determine a path to output a file artifact based on whether the user specified the specific path
@@ -0,0 +1,378 @@
+import collections
+import itertools
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import six.moves.queue as queue
+
+logger = logging.getLogger(__file__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# How long the result of a finished job is kept for if the client never collects it
+DEFAULT_RETENTION_SECONDS = 60 * 60
+# Priority lanes, in the order queued jobs are executed. Jobs in the same lane are executed in submission order
+HIGH_PRIORITY = 'high'
+NORMAL_PRIORITY = 'normal'
+LOW_PRIORITY = 'low'
+PRIORITIES = [HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY]
+# Time a rejected client is told to wait before submitting again, before any job has finished to estimate it from
+DEFAULT_RETRY_AFTER_SECONDS = 10
+# Number of the most recent jobs whose durations the retry time is estimated from
+RETRY_ESTIMATE_JOBS = 20
+# XML-RPC fault code a job rejected because the queue is full is returned to the client with, as in HTTP's Too Many
+# Requests. The fault string ends with the retry time
+QUEUE_FULL_FAULT_CODE = 429
+RETRY_AFTER_REGEX = re.compile(r'Retry after (\d+) seconds$')
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the maximum number of jobs are already queued
+    """
+
+    def __init__(self, queued, retry_after):
+        """
+        :param queued: Number of jobs queued
+        :type queued: int
+        :param retry_after: Estimated number of seconds until there is room in the queue
+        :type retry_after: int
+        """
+        Exception.__init__(self, 'The agent already has {} runs queued. Retry after {} seconds'.format(queued,
+                                                                                                       retry_after))
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+def parse_retry_after(message):
+    """
+    :param message: Message of a QueueFullError
+    :type message: str
+
+    :return: The number of seconds the message says to retry after, or None if it doesn't say
+    :rtype: int
+    """
+    match = RETRY_AFTER_REGEX.search(message)
+    return int(match.group(1)) if match else None
+
+
+class Job:
+
+    def __init__(self, target, jobs_dir, priority=NORMAL_PRIORITY, cleanup=None):
+        """
+        Constructor for Job
+
+        :param target: Callable that is passed the job, executes the robot run and returns the result dictionary
+        :type target: callable
+        :param jobs_dir: Directory to keep the job's console output and test artifacts in
+        :type jobs_dir: str
+        :param priority: Lane the job is queued in
+        :type priority: str
+        :param cleanup: Callable that frees what is held for the job until its target takes it over, called instead of
+        the target if the job is cancelled while queued
+        :type cleanup: callable
+        """
+        self.job_id = uuid.uuid4().hex
+        self.priority = priority
+        self.console_path = os.path.join(jobs_dir, self.job_id + '.log')
+        self.artifact_dir = os.path.join(jobs_dir, self.job_id)
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_time = time.time()
+        self.started_time = None
+        self.finished_time = None
+        self._target = target
+        self._cleanup = cleanup
+        self._done = threading.Event()
+        self._cancel_lock = threading.Lock()
+        self._cancel_requested = False
+        self._cancel_handler = None
+
+    def execute(self):
+        """
+        Execute the job, recording the result or the error raised. A job cancelled while it was queued is not executed
+        """
+        with self._cancel_lock:
+            if self.is_done():
+                return
+            self.state = RUNNING
+            self.started_time = time.time()
+        try:
+            self.result = self._target(self)
+            self.state = FINISHED
+        except Exception as err:  # pylint: disable=broad-except
+            self.error = err
+            self.state = FAILED
+        finally:
+            if self._cancel_requested:
+                self.result = None
+                self.state = CANCELLED
+            self.finished_time = time.time()
+            self._done.set()
+
+    def cancel(self):
+        """
+        Request that the job stops. A queued job is cancelled straight away and will not be executed, a running job is
+        stopped by its cancel handler
+
+        :return: Whether the job was still to finish when it was cancelled
+        :rtype: bool
+        """
+        with self._cancel_lock:
+            if self.is_done():
+                return False
+            self._cancel_requested = True
+            if self.state == QUEUED:
+                if self._cleanup:
+                    self._cleanup()
+                self.state = CANCELLED
+                self.finished_time = time.time()
+                self._done.set()
+            elif self._cancel_handler:
+                self._cancel_handler()
+        return True
+
+    def set_cancel_handler(self, handler):
+        """
+        Register the callable that stops the job while it is running. The handler is called straight away if the job
+        has already been cancelled.
+
+        :param handler: Callable that stops the job, or None to remove the handler once it no longer applies
+        :type handler: callable
+        """
+        with self._cancel_lock:
+            self._cancel_handler = handler
+            if handler and self._cancel_requested:
+                handler()
+
+    def is_done(self):
+        """
+        :return: Whether the job has finished executing (successfully or not)
+        :rtype: bool
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the job has finished executing
+
+        :param timeout: Maximum number of seconds to wait for
+        :type timeout: float
+
+        :return: Whether the job has finished
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def discard(self):
+        """
+        Delete the files held for the job
+        """
+        if os.path.exists(self.console_path):
+            os.remove(self.console_path)
+        if os.path.exists(self.artifact_dir):
+            shutil.rmtree(self.artifact_dir)
+
+    def get_status(self):
+        """
+        :return: Dictionary describing the state of the job that can be serialized
+        :rtype: dict
+        """
+        status = {'job_id': self.job_id, 'state': self.state}
+        if self.error is not None:
+            status['error'] = str(self.error)
+        return status
+
+
+class JobManager:
+
+    def __init__(self, concurrency=1, retention_seconds=DEFAULT_RETENTION_SECONDS, on_job_done=None, max_queued=None):
+        """
+        Constructor for JobManager. Jobs are queued by priority and executed in submission order within each priority
+        by a fixed number of dispatcher threads.
+
+        :param concurrency: Number of jobs that can execute at the same time
+        :type concurrency: int
+        :param retention_seconds: How long to keep finished jobs that haven't been collected
+        :type retention_seconds: float
+        :param on_job_done: Callable that is passed each job once it has finished executing
+        :type on_job_done: callable
+        :param max_queued: Maximum number of jobs that can be waiting to execute. Further jobs are rejected until one
+        of them starts. Unlimited by default
+        :type max_queued: int
+        """
+        self._concurrency = concurrency
+        self._retention_seconds = retention_seconds
+        self._on_job_done = on_job_done
+        self._max_queued = max_queued
+        self._jobs_dir = tempfile.mkdtemp(prefix='rfremoterunner_jobs_')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Entries are (priority rank, submission number, job), so that the queue is ordered by priority and then by
+        # submission
+        self._queue = queue.PriorityQueue()
+        self._submission_numbers = itertools.count()
+        self._queued = []
+        self._recent_durations = collections.deque(maxlen=RETRY_ESTIMATE_JOBS)
+        for index in range(concurrency):
+            dispatcher = threading.Thread(target=self._dispatch, name='JobDispatcher-{}'.format(index))
+            dispatcher.daemon = True
+            dispatcher.start()
+
+    def _dispatch(self):
+        """
+        Dispatcher thread loop. Pulls the next job off the queue and executes it
+        """
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                # A job cancelled while queued has already given up its place
+                if job in self._queued:
+                    self._queued.remove(job)
+            logger.debug('Executing job: %s', job.job_id)
+            job.execute()
+            logger.debug('Job %s %s', job.job_id, job.state)
+            # Cancelled jobs would make the estimate of how long a job takes too short
+            if job.state in (FINISHED, FAILED):
+                with self._lock:
+                    self._recent_durations.append(job.finished_time - job.started_time)
+            if self._on_job_done:
+                try:
+                    self._on_job_done(job)
+                except Exception:  # pylint: disable=broad-except
+                    # Don't let a failing callback stop the dispatcher executing jobs
+                    logger.exception('Job done callback failed for job: %s', job.job_id)
+
+    def submit(self, target, priority=NORMAL_PRIORITY, cleanup=None):
+        """
+        Queue a new job
+
+        :param target: Callable that is passed the job, executes the robot run and returns the result dictionary
+        :type target: callable
+        :param priority: Lane to queue the job in, one of PRIORITIES
+        :type priority: str
+        :param cleanup: Callable that frees what is held for the job until its target takes it over, called instead of
+        the target if the job is cancelled while queued
+        :type cleanup: callable
+
+        :return: The queued job
+        :rtype: Job
+
+        :raises ValueError: If the priority is unknown
+        :raises QueueFullError: If the maximum number of jobs are already queued
+        """
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority: {}. Expected one of: {}'.format(priority, ', '.join(PRIORITIES)))
+        job = Job(target, self._jobs_dir, priority, cleanup)
+        with self._lock:
+            if self._max_queued is not None and len(self._queued) >= self._max_queued:
+                raise QueueFullError(len(self._queued), self._estimate_retry_after())
+            self._prune_expired_jobs()
+            self._jobs[job.job_id] = job
+            self._queued.append(job)
+            self._queue.put((PRIORITIES.index(priority), next(self._submission_numbers), job))
+        return job
+
+    def get_queue_position(self, job):
+        """
+        :param job: The job
+        :type job: Job
+
+        :return: Number of queued jobs that will start before the job, or None if it isn't queued
+        :rtype: int
+        """
+        with self._lock:
+            if job not in self._queued:
+                return None
+            # The queued jobs are listed in submission order, so are ordered the same way as the queue by their
+            # priority rank and position in the list
+            order = (PRIORITIES.index(job.priority), self._queued.index(job))
+            return sum(1 for index, other in enumerate(self._queued)
+                       if (PRIORITIES.index(other.priority), index) < order)
+
+    def _estimate_retry_after(self):
+        """
+        Estimate how long until a place in the queue becomes free, which is when one of the running jobs finishes and
+        the next queued job starts. Must be called with the lock held
+
+        :return: Number of seconds
+        :rtype: int
+        """
+        if not self._recent_durations:
+            return DEFAULT_RETRY_AFTER_SECONDS
+        average_duration = sum(self._recent_durations) / len(self._recent_durations)
+        return max(1, int(math.ceil(average_duration / self._concurrency)))
+
+    def get(self, job_id):
+        """
+        Look up a job by its ID
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: The job
+        :rtype: Job
+        """
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError('Unknown job: {}'.format(job_id))
+            return self._jobs[job_id]
+
+    def cancel(self, job_id):
+        """
+        Request that a job stops
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: Whether the job was still to finish when it was cancelled
+        :rtype: bool
+        """
+        job = self.get(job_id)
+        cancelled = job.cancel()
+        with self._lock:
+            # The job won't be executed, so make room in the queue for another
+            if job in self._queued:
+                self._queued.remove(job)
+        return cancelled
+
+    def remove(self, job_id):
+        """
+        Stop tracking a job, releasing its result, console output and test artifacts
+
+        :param job_id: ID of the job
+        :type job_id: str
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job:
+            job.discard()
+
+    def close(self):
+        """
+        Delete the files held for all jobs
+        """
+        shutil.rmtree(self._jobs_dir, ignore_errors=True)
+
+    def _prune_expired_jobs(self):
+        """
+        Remove finished jobs whose results were never collected. Must be called with the lock held
+        """
+        cutoff = time.time() - self._retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.is_done() and job.finished_time < cutoff:
+                logger.debug('Discarding uncollected job: %s', job_id)
+                del self._jobs[job_id]
+                job.discard()
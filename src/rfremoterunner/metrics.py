@@ -0,0 +1,260 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the buckets that run durations are counted in
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+# Phases of a run timed by the client and by the agent, in the order they happen
+CLIENT_PHASES = ['build', 'package', 'upload', 'execute', 'download', 'merge']
+AGENT_PHASES = ['queue', 'workspace', 'robot', 'artifacts']
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class PhaseTimings:
+
+    def __init__(self):
+        """
+        Constructor for PhaseTimings. Records how long each phase of a run took and how many bytes it transferred, in
+        the order the phases happened
+        """
+        self.durations = OrderedDict()
+        self.byte_counts = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the time spent inside it to a phase
+
+        :param name: Name of the phase
+        :type name: str
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start_time)
+
+    def record(self, name, seconds):
+        """
+        :param name: Name of the phase
+        :type name: str
+        :param seconds: Time to add to the phase
+        :type seconds: float
+        """
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add_bytes(self, name, count):
+        """
+        :param name: Name of the phase
+        :type name: str
+        :param count: Number of bytes the phase transferred
+        :type count: int
+        """
+        self.byte_counts[name] = self.byte_counts.get(name, 0) + count
+
+    def add(self, timings):
+        """
+        Add the timings of another run to these, e.g. to total the shards of a distributed run
+
+        :param timings: Dictionary of 'durations' and 'bytes' returned by as_dict()
+        :type timings: dict
+        """
+        for name, seconds in timings.get('durations', {}).items():
+            self.record(name, seconds)
+        for name, count in timings.get('bytes', {}).items():
+            self.add_bytes(name, count)
+
+    def as_dict(self):
+        """
+        :return: Dictionary of the 'durations' and 'bytes' of each phase that can be serialized
+        :rtype: dict
+        """
+        return {'durations': dict(self.durations), 'bytes': dict(self.byte_counts)}
+
+    @staticmethod
+    def format_summary(title, timings, phase_order=None):
+        """
+        Format the timings of a run as a table with a line per phase
+
+        :param title: Heading of the table
+        :type title: str
+        :param timings: Dictionary of 'durations' and 'bytes' returned by as_dict()
+        :type timings: dict
+        :param phase_order: Names of the phases in the order to list them. Other phases are listed after them
+        :type phase_order: list
+
+        :return: The table
+        :rtype: str
+        """
+        durations = timings.get('durations', {})
+        byte_counts = timings.get('bytes', {})
+        names = [name for name in phase_order or [] if name in durations]
+        names.extend(sorted(name for name in durations if name not in names))
+        lines = [title]
+        for name in names:
+            line = '  {:<12} {:>9.3f}s'.format(name, durations[name])
+            if name in byte_counts:
+                line += ' {:>14,} bytes'.format(byte_counts[name])
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class Counter:
+
+    def __init__(self, name, description, label_name=None):
+        """
+        Constructor for Counter. A cumulative count, optionally split by the value of a label
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Help text of the metric
+        :type description: str
+        :param label_name: Name of the label that the count is split by
+        :type label_name: str
+        """
+        self.name = name
+        self.description = description
+        self._label_name = label_name
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        """
+        :param amount: Amount to increase the count by
+        :type amount: float
+        :param label: Value of the label to increase the count of
+        :type label: str
+        """
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def get(self, label=None):
+        """
+        :param label: Value of the label to get the count of
+        :type label: str
+
+        :return: The count
+        :rtype: float
+        """
+        with self._lock:
+            return self._values.get(label, 0)
+
+    def render(self):
+        """
+        :return: Lines of the metric in the Prometheus text format
+        :rtype: list
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            if not self._values and not self._label_name:
+                lines.append('{} 0'.format(self.name))
+            for label, value in self._values.items():
+                if self._label_name:
+                    lines.append('{}{{{}="{}"}} {}'.format(self.name, self._label_name, label, value))
+                else:
+                    lines.append('{} {}'.format(self.name, value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        """
+        Constructor for Histogram. Counts observations in cumulative buckets
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Help text of the metric
+        :type description: str
+        :param buckets: Upper bounds of the buckets in ascending order
+        :type buckets: tuple
+        """
+        self.name = name
+        self.description = description
+        self._buckets = buckets
+        self._bucket_counts = [0] * len(buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        :param value: Value to count
+        :type value: float
+        """
+        with self._lock:
+            for index, upper_bound in enumerate(self._buckets):
+                if value <= upper_bound:
+                    self._bucket_counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    def render(self):
+        """
+        :return: Lines of the metric in the Prometheus text format
+        :rtype: list
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for upper_bound, count in zip(self._buckets, self._bucket_counts):
+                lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, float(upper_bound), count))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self._count))
+            lines.append('{}_sum {}'.format(self.name, self._sum))
+            lines.append('{}_count {}'.format(self.name, self._count))
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        """
+        Constructor for MetricsRegistry. Holds the metrics an agent exposes and renders them for scraping
+        """
+        self._metrics = []
+
+    def counter(self, name, description, label_name=None):
+        """
+        Create and register a counter
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Help text of the metric
+        :type description: str
+        :param label_name: Name of the label that the count is split by
+        :type label_name: str
+
+        :return: The counter
+        :rtype: Counter
+        """
+        metric = Counter(name, description, label_name)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        """
+        Create and register a histogram
+
+        :param name: Name of the metric
+        :type name: str
+        :param description: Help text of the metric
+        :type description: str
+        :param buckets: Upper bounds of the buckets in ascending order
+        :type buckets: tuple
+
+        :return: The histogram
+        :rtype: Histogram
+        """
+        metric = Histogram(name, description, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: All of the metrics in the Prometheus text format
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,93 @@
+import io
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__file__)
+
+# Bump when the layout of an entry changes so that caches written by older versions are ignored
+CACHE_VERSION = 2
+
+
+class PackagingCache:
+
+    def __init__(self, path):
+        """
+        Constructor for PackagingCache. The cache records the result of scanning each robot file for its imports, the
+        rewritten file contents and the resolved path of each import, so that files that haven't changed since the last
+        run don't need to be parsed again. Entries are keyed by path and invalidated when the file's modification time
+        or size changes. It is kept on disk as JSON and can be shared between threads.
+
+        :param path: Path of the JSON file to load the cache from and save it to
+        :type path: str
+        """
+        self._path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            try:
+                with io.open(path, 'r', encoding='utf-8') as file_handle:
+                    data = json.load(file_handle)
+                if data.get('version') == CACHE_VERSION:
+                    self._entries = data['entries']
+            except (ValueError, KeyError, AttributeError):
+                logger.warning('Ignoring invalid packaging cache: %s', path)
+        logger.debug('Loaded packaging cache for %d files from: %s', len(self._entries), path)
+
+    def get(self, file_path):
+        """
+        Look up the scan of a robot file
+
+        :param file_path: Path to the robot file
+        :type file_path: str
+
+        :return: The rewritten file contents and list of resolved imports recorded by put(), or None if the file has
+        changed or was never recorded
+        :rtype: tuple
+        """
+        key = os.path.abspath(file_path)
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size and \
+                    all(os.path.exists(imp[3]) for imp in entry['imports'] if imp[3]):
+                self.hits += 1
+                return entry['data'], [tuple(imp) for imp in entry['imports']]
+            self.misses += 1
+        return None
+
+    def put(self, file_path, data, imports):
+        """
+        Record the scan of a robot file
+
+        :param file_path: Path to the robot file
+        :type file_path: str
+        :param data: Contents of the file with the import paths rewritten
+        :type data: str
+        :param imports: List of (import type, import path, filename, resolved path) tuples. The resolved path is None
+        for imports that aren't packaged, e.g. robot's standard libraries
+        :type imports: list
+        """
+        key = os.path.abspath(file_path)
+        stat = os.stat(key)
+        with self._lock:
+            self._entries[key] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'data': data,
+                'imports': [list(imp) for imp in imports]
+            }
+
+    def save(self):
+        """
+        Write the cache to disk, dropping the entries for files that no longer exist
+        """
+        with self._lock:
+            self._entries = dict((key, entry) for key, entry in self._entries.items() if os.path.exists(key))
+            data = json.dumps({'version': CACHE_VERSION, 'entries': self._entries}, sort_keys=True)
+        with io.open(self._path, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(data if isinstance(data, type(u'')) else data.decode('utf-8'))
+        logger.debug('Saved packaging cache for %d files to: %s', len(self._entries), self._path)
@@ -0,0 +1,172 @@
+from io import open
+import logging
+import os
+import tarfile
+import six.moves.xmlrpc_server as xmlrpc_server
+import six.moves.socketserver as socketserver
+
+from rfremoterunner.compression import available_codecs, negotiate_codec, get_codec, DecompressingReader
+from rfremoterunner.metrics import METRICS_CONTENT_TYPE
+from rfremoterunner.transport import LimitedReader, ChunkedReader, BLOBS_PATH, BUNDLES_PATH, ARTIFACTS_PATH, \
+    STREAM_CHUNK_BYTES
+
+logger = logging.getLogger(__file__)
+
+# HTTP path that the agent's metrics can be scraped from
+METRICS_PATH = '/metrics'
+# Amount of a test artifact read from disk and sent at a time
+ARTIFACT_CHUNK_BYTES = 1024 * 1024
+# Most a compressed upload of files may decompress to, so a small upload can't exhaust the agent's memory
+MAX_DECOMPRESSED_UPLOAD_BYTES = 256 * 1024 * 1024
+# Amount of a compressed upload decompressed at a time, which bounds how far past the limit a single step can go
+UPLOAD_DECOMPRESS_CHUNK_BYTES = 8 * 1024
+
+
+class AgentRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+    """
+    XML-RPC request handler that also serves the binary transport's uploads and artifact downloads, and the agent's
+    metrics in the Prometheus text format to a GET of METRICS_PATH. It counts the bytes received and sent by clients.
+    """
+
+    def decode_request_content(self, data):
+        self.server.metrics_registry.bytes_received.inc(len(data))
+        return xmlrpc_server.SimpleXMLRPCRequestHandler.decode_request_content(self, data)
+
+    def send_header(self, keyword, value):
+        # Artifacts count the bytes they send themselves as compressed artifacts are sent without a Content-Length
+        if self.command == 'POST' and keyword.lower() == 'content-length':
+            self.server.metrics_registry.bytes_sent.inc(int(value))
+        xmlrpc_server.SimpleXMLRPCRequestHandler.send_header(self, keyword, value)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Store the files or extract the bundle uploaded over the binary transport, or handle an XML-RPC call
+        """
+        if self.path == BUNDLES_PATH:
+            self._receive_bundle()
+            return
+        if self.path != BLOBS_PATH:
+            xmlrpc_server.SimpleXMLRPCRequestHandler.do_POST(self)
+            return
+        try:
+            length = int(self.headers['content-length'])
+            self.server.metrics_registry.bytes_received.inc(length)
+            encoding = self.headers.get('content-encoding')
+            if encoding:
+                body = DecompressingReader(LimitedReader(self.rfile, length), encoding,
+                                           UPLOAD_DECOMPRESS_CHUNK_BYTES, MAX_DECOMPRESSED_UPLOAD_BYTES)
+                count = self.server.agent.store_blob_frames(body)
+            else:
+                count = self.server.agent.store_blob_frames(self.rfile, length)
+        except (ValueError, TypeError) as err:
+            logger.error('Rejected upload: %s', err)
+            # The rest of the body may not have been read, so the connection can't be reused
+            self.close_connection = True
+            self._send_text(400, str(err))
+            return
+        self._send_text(200, str(count))
+
+    def _receive_bundle(self):
+        """
+        Extract a bundle sent with chunked transfer encoding into a new workspace as it is received
+        """
+        # The body isn't read if the bundle is rejected, so the connection can't be reused
+        if self.headers.get('transfer-encoding', '').lower() != 'chunked':
+            self.close_connection = True
+            self._send_text(411, 'Bundles must be sent with chunked transfer encoding')
+            return
+        body = ChunkedReader(self.rfile)
+        encoding = self.headers.get('content-encoding')
+        stream = DecompressingReader(body, encoding) if encoding else body
+        try:
+            bundle_id = self.server.agent.store_bundle(stream)
+            # Extracting stops at the end of archive marker, before the rest of the tar record and the end of the
+            # body. Closing the connection with them unread would reset it and could lose the response
+            while stream.read(STREAM_CHUNK_BYTES):
+                pass
+        except (ValueError, tarfile.TarError) as err:
+            logger.error('Rejected bundle: %s', err)
+            self.close_connection = True
+            self._send_text(400, str(err))
+            return
+        finally:
+            self.server.metrics_registry.bytes_received.inc(body.received)
+        self._send_text(200, bundle_id)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Serve the metrics, or a test artifact over the binary transport
+        """
+        if self.path == METRICS_PATH:
+            self._send_text(200, self.server.metrics_registry.render(), METRICS_CONTENT_TYPE)
+        elif self.path.startswith(ARTIFACTS_PATH + '/'):
+            self._send_artifact(self.path[len(ARTIFACTS_PATH) + 1:].split('/'))
+        else:
+            self.report_404()
+
+    def _send_artifact(self, path_parts):
+        """
+        Stream a test artifact from disk a chunk at a time, compressed with the first codec the client accepts that
+        the agent supports
+
+        :param path_parts: The job ID and artifact name from the request path
+        :type path_parts: list
+        """
+        try:
+            artifact_path = self.server.agent.get_artifact_path(*path_parts)
+        except (KeyError, ValueError, TypeError):
+            artifact_path = None
+        if not artifact_path or not os.path.exists(artifact_path):
+            self.report_404()
+            return
+        accepted = [value.split(';')[0].strip() for value in self.headers.get('accept-encoding', '').split(',')]
+        encoding = negotiate_codec(available_codecs(), accepted)
+        compressor = get_codec(encoding).compressor() if encoding else None
+        sent = 0
+        with open(artifact_path, 'rb') as file_handle:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            if compressor:
+                # The compressed size isn't known up front so the end of the response is marked by closing the
+                # connection
+                self.send_header('Content-Encoding', encoding)
+                self.close_connection = True
+            else:
+                self.send_header('Content-Length', str(os.path.getsize(artifact_path)))
+            self.end_headers()
+            while True:
+                data = file_handle.read(ARTIFACT_CHUNK_BYTES)
+                if not data:
+                    break
+                if compressor:
+                    data = compressor.compress(data)
+                self.wfile.write(data)
+                sent += len(data)
+            if compressor:
+                data = compressor.flush()
+                self.wfile.write(data)
+                sent += len(data)
+        self.server.metrics_registry.bytes_sent.inc(sent)
+
+    def _send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+        """
+        :param status: HTTP status code
+        :type status: int
+        :param text: Body of the response
+        :type text: str
+        :param content_type: Content type of the response
+        :type content_type: str
+        """
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, xmlrpc_server.SimpleXMLRPCServer):
+    """
+    XML-RPC server that handles each request on its own thread, so that a long robot run doesn't block other clients
+    """
+    daemon_threads = True
@@ -0,0 +1,110 @@
+import logging
+import os
+from six import StringIO
+from robot import rebot
+from robot.api import ExecutionResult
+from robot.output import LOGGER
+from robot.reporting import ResultWriter
+
+logger = logging.getLogger(__file__)
+
+# Arguments for robot.run that stop the agent generating a log and report. Both embed the whole result model again, so
+# only the output xml is transferred and they are generated on the local machine instead
+OUTPUT_ONLY_ROBOT_ARGS = {'log': 'NONE', 'report': 'NONE'}
+
+
+def merge_results(output_paths):
+    """
+    Combine the output.xml files of robot runs that each executed a different part of the same suite tree into a
+    single result. Suites with the same name at the same position in the hierarchy are merged, so the combined result
+    looks as though it came from a single robot run.
+
+    :param output_paths: Paths to the output.xml files to merge
+    :type output_paths: list
+
+    :return: The merged result
+    :rtype: robot.result.Result
+    """
+    merged = None
+    for output_path in output_paths:
+        logger.debug('Merging result: %s', output_path)
+        result = ExecutionResult(output_path)
+        if merged is None:
+            merged = result
+        else:
+            _merge_suite(merged.suite, result.suite)
+
+    if merged is None:
+        raise ValueError('There are no results to merge')
+    return merged
+
+
+def _merge_suite(target, source):
+    """
+    Recursively merge the test cases and child suites of one result suite into another
+
+    :param target: Suite to merge into
+    :type target: robot.result.TestSuite
+    :param source: Suite to merge from
+    :type source: robot.result.TestSuite
+    """
+    # The merged suite spans from the earliest start to the latest end. Robot's timestamp format sorts chronologically
+    for attr_name, pick in (('starttime', min), ('endtime', max)):
+        timestamps = [ts for ts in (getattr(target, attr_name), getattr(source, attr_name)) if ts and ts != 'N/A']
+        if timestamps:
+            setattr(target, attr_name, pick(timestamps))
+
+    for test in list(source.tests):
+        target.tests.append(test)
+
+    target_children = dict((suite.name, suite) for suite in target.suites)
+    new_children = []
+    for child in list(source.suites):
+        if child.name in target_children:
+            _merge_suite(target_children[child.name], child)
+        else:
+            new_children.append(child)
+
+    if new_children:
+        # Restore the order robot would have executed the suites in had they been in a single run
+        target.suites = sorted(list(target.suites) + new_children,
+                               key=lambda suite: os.path.basename(suite.source or suite.name).lower())
+
+
+def write_results(result, output_xml_path, log_html_path, report_html_path):
+    """
+    Write a result to disk as an output xml, log html and report html
+
+    :param result: Result to write
+    :type result: robot.result.Result
+    :param output_xml_path: Path to save the output xml to
+    :type output_xml_path: str
+    :param log_html_path: Path to save the log html to
+    :type log_html_path: str
+    :param report_html_path: Path to save the report html to
+    :type report_html_path: str
+
+    :return: Robot return code of the result (the number of failed tests)
+    :rtype: int
+    """
+    # Only let robot print errors and warnings, the caller reports where the files have been written
+    LOGGER.register_console_logger(type='quiet')
+    return ResultWriter(result).write_results(output=output_xml_path, log=log_html_path, report=report_html_path)
+
+
+def generate_log_and_report(output_xml_path, log_html_path, report_html_path):
+    """
+    Generate the log html and report html for an output xml with rebot
+
+    :param output_xml_path: Path to the output xml
+    :type output_xml_path: str
+    :param log_html_path: Path to save the log html to
+    :type log_html_path: str
+    :param report_html_path: Path to save the report html to
+    :type report_html_path: str
+
+    :return: Rebot return code (the number of failed tests)
+    :rtype: int
+    """
+    # The caller reports where the files have been written
+    return rebot(output_xml_path, log=log_html_path, report=report_html_path, stdout=StringIO())
@@ -1,39 +1,101 @@
+import codecs
 import os
 import logging
 import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import six.moves.xmlrpc_client as xmlrpc_client
 import six
 from robot.api import TestSuiteBuilder
+from robot.conf import RobotSettings
+from robot.errors import DataError
 from robot.libraries import STDLIBS
 from robot.utils.robotpath import find_file
 
-from rfremoterunner.utils import normalize_xmlrpc_address, calculate_ts_parent_path, read_file_from_disk
+from rfremoterunner.bundles import write_bundle, write_bundle_file, read_bundle_file, BUNDLE_FILE_CODEC
+from rfremoterunner.jobs import parse_retry_after, QUEUE_FULL_FAULT_CODE, DEFAULT_RETRY_AFTER_SECONDS
+from rfremoterunner.metrics import PhaseTimings
+from rfremoterunner.transport import create_transport
+from rfremoterunner.utils import normalize_xmlrpc_address, calculate_ts_parent_path, read_file_from_disk, \
+    calculate_digest, collect_test_suites
+from rfremoterunner.timing import REMOTE_ROOT_SUITE_NAME
 
 logger = logging.getLogger(__file__)
 DEFAULT_PORT = 1471
+# Upper limit on the size of a single upload_blobs() request so that a large tree isn't sent as one giant request
+MAX_UPLOAD_BATCH_BYTES = 16 * 1024 * 1024
+# Number of threads that read and scan the robot files concurrently while the suites are being packaged
+PACKAGING_THREADS = 8
+# Interval between polls for the status of a job. Starts short so that quick runs return promptly and backs off for
+# long runs
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 10.0
+POLL_BACKOFF_FACTOR = 1.5
+# How long to keep resubmitting a run that the agent rejects because its queue is full before giving up
+MAX_SUBMIT_WAIT_SECONDS = 60 * 60
+# Arguments for robot.run that select test cases, which are also applied on this machine before packaging
+TEST_SELECTION_ROBOT_ARGS = ['test', 'include', 'exclude']
 IMPORT_LINE_REGEX = re.compile('(Resource|Library)([\\s]+)([^[\\n\\r]*)([\\s]+)')
 
 
+class RunCancelledError(Exception):
+    """
+    Raised when a run is cancelled before it finished
+    """
+
+
 class RemoteFrameworkClient:
 
-    def __init__(self, address, debug=False):
+    def __init__(self, address, debug=False, workspace=None, packaging_cache=None, attachments=None, priority=None):
         """
         Constructor for RemoteFrameworkClient
 
-        :param address: Hostname/IP of the server with optional :Port
+        :param address: Hostname/IP of the server with optional :Port. None if the client is only used to pack() bundle
+        files
         :type address: str
         :param debug: Run in debug mode. Enables extra logging and instructs the remote server not to cleanup the
         workspace after test execution
         :type debug: bool
+        :param workspace: Name of a persistent workspace on the agent to run in. Only the files that have changed since
+        the last run in the workspace are sent, if the agent supports it
+        :type workspace: str
+        :param packaging_cache: Cache of the robot files scanned by previous runs, so that unchanged files aren't
+        parsed again
+        :type packaging_cache: rfremoterunner.packaging_cache.PackagingCache
+        :param attachments: Paths of extra files, or directories of files, to copy into the root of the workspace as
+        they are, e.g. test data or binary files the suites read at run time
+        :type attachments: list
+        :param priority: Lane to queue the run in on the agent: 'high', 'normal' or 'low'. Defaults to the agent's
+        default lane
+        :type priority: str
         """
-        self._address = normalize_xmlrpc_address(address, DEFAULT_PORT)
-        self._client = xmlrpc_client.ServerProxy(self._address)
+        self._address = normalize_xmlrpc_address(address, DEFAULT_PORT) if address else None
+        self._client = xmlrpc_client.ServerProxy(self._address) if address else None
         self._debug = debug
+        self._workspace = workspace
+        self._packaging_cache = packaging_cache
+        self._attachments = attachments or []
+        self._priority = priority
+        # Bundle file written by pack() to send instead of packaging the suites
+        self._bundle_path = None
+        # Robot files scanned and libraries read ahead of packaging, keyed by path
+        self._scanned_files = {}
+        self._library_data = {}
         self._dependencies = {}
         self._suites = {}
+        self._capabilities = None
+        self._transport = None
+        self._cancelled = threading.Event()
+        # Time taken and bytes transferred by each phase of the run on this machine, and on the agent if it reports them
+        self.timings = PhaseTimings()
+        self.agent_timings = None
         logger.setLevel(logging.DEBUG if debug else logging.INFO)
 
-    def execute_run(self, suite_list, extensions, include_suites, robot_arg_dict):
+    def execute_run(self, suite_list, extensions, include_suites, robot_arg_dict, output_callback=None,
+                    artifact_paths=None):
         """
         Sources a series of test suites and then makes the RPC call to the
         agent to execute the robot run.
@@ -46,28 +108,581 @@ class RemoteFrameworkClient:
         :type include_suites: list
         :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
         :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the robot stdout/stderr as it is produced, if the agent supports
+        streaming it. Otherwise the output is returned in the result once the run has finished
+        :type output_callback: callable
+        :param artifact_paths: Dictionary of test artifact name (output_xml, log_html, report_html) to the local path
+        to save it to. The artifacts are saved rather than returned in the result
+        :type artifact_paths: dict
+
+        :return: Dictionary containing stdout/err, log html, output xml, report html, return code. If artifact_paths
+        is given, it contains the return code and the paths of the artifacts that were saved under 'artifact_paths'
+        :rtype: dict
+        """
+        with self.timings.phase('build'):
+            suite = self.build_test_suite(suite_list, extensions, include_suites)
+            self.prune_test_suite(suite, robot_arg_dict)
 
-        :return: Dictionary containing stdout/err, log html, output xml, report html, return code
+        with self.timings.phase('package'):
+            self._prefetch_robot_files(collect_test_suites(suite))
+            # Now iterate the suite's family tree, pull out the suites with test cases and resolve their dependencies.
+            # Package them up into a dictionary that can be serialized
+            self._package_suite_hierarchy(suite)
+
+        return self._dispatch_run(robot_arg_dict, output_callback, artifact_paths)
+
+    def pack(self, suite_list, extensions, include_suites, robot_arg_dict, bundle_path):
+        """
+        Sources a series of test suites and writes them, their dependencies and the attachments to a bundle file that
+        can be executed later with execute_bundle(), without parsing the suites again
+
+        :param suite_list: List of paths to test suites or directories containing test suites
+        :type suite_list: list
+        :param extensions: String that filters the accepted file extensions for the test suites
+        :type extensions: str
+        :param include_suites: List of strings that filter suites to include
+        :type include_suites: list
+        :param robot_arg_dict: Dictionary of arguments that select the test cases. Suites without any selected test
+        cases are left out of the bundle
+        :type robot_arg_dict: dict
+        :param bundle_path: Path of the bundle file to write
+        :type bundle_path: str
+
+        :return: Number of files in the bundle
+        :rtype: int
+        """
+        with self.timings.phase('build'):
+            suite = self.build_test_suite(suite_list, extensions, include_suites)
+            self.prune_test_suite(suite, robot_arg_dict)
+
+        with self.timings.phase('package'):
+            self._prefetch_robot_files(collect_test_suites(suite))
+            self._package_suite_hierarchy(suite)
+            files = self._packaged_files()
+            attachments = self._collect_attachments()
+            # Robot on the agent needs the same extensions to find the suites in the bundle
+            write_bundle_file(bundle_path, files, attachments, {'extension': extensions} if extensions else None)
+        logger.debug('Wrote %d files and %d attachments to: %s', len(files), len(attachments), bundle_path)
+        return len(files) + len(attachments)
+
+    def execute_bundle(self, bundle_path, robot_arg_dict, output_callback=None, artifact_paths=None):
+        """
+        Execute the test suites in a bundle file written by pack() on the agent
+
+        :param bundle_path: Path of the bundle file
+        :type bundle_path: str
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the robot stdout/stderr as it is produced, if the agent supports
+        streaming it. Otherwise the output is returned in the result once the run has finished
+        :type output_callback: callable
+        :param artifact_paths: Dictionary of test artifact name (output_xml, log_html, report_html) to the local path
+        to save it to. The artifacts are saved rather than returned in the result
+        :type artifact_paths: dict
+
+        :return: Dictionary containing stdout/err, log html, output xml, report html, return code. If artifact_paths
+        is given, it contains the return code and the paths of the artifacts that were saved under 'artifact_paths'
         :rtype: dict
         """
-        # Use robot to resolve all of the test suites
+        _, metadata = read_bundle_file(bundle_path, include_files=False)
+        if metadata.get('extension'):
+            robot_arg_dict = dict({'extension': metadata['extension']}, **robot_arg_dict)
+        self._bundle_path = bundle_path
+        return self._dispatch_run(robot_arg_dict, output_callback, artifact_paths)
+
+    def execute_suites(self, suites, robot_arg_dict, output_callback=None, artifact_paths=None):
+        """
+        Packages a subset of the test suites from a suite tree built with build_test_suite() and then makes the RPC call
+        to the agent to execute the robot run. Each suite keeps its position in the suite hierarchy.
+
+        :param suites: Test suites containing test cases
+        :type suites: list
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the robot stdout/stderr as it is produced, if the agent supports
+        streaming it. Otherwise the output is returned in the result once the run has finished
+        :type output_callback: callable
+        :param artifact_paths: Dictionary of test artifact name (output_xml, log_html, report_html) to the local path
+        to save it to. The artifacts are saved rather than returned in the result
+        :type artifact_paths: dict
+
+        :return: Dictionary containing stdout/err, log html, output xml, report html, return code. If artifact_paths
+        is given, it contains the return code and the paths of the artifacts that were saved under 'artifact_paths'
+        :rtype: dict
+        """
+        with self.timings.phase('package'):
+            self._prefetch_robot_files(suites)
+            for suite in suites:
+                self._suites[os.path.basename(suite.source)] = self._process_test_suite(suite)
+
+        return self._dispatch_run(robot_arg_dict, output_callback, artifact_paths)
+
+    @staticmethod
+    def build_test_suite(suite_list, extensions, include_suites):
+        """
+        Use robot to resolve and parse all of the test suites into a single suite tree
+
+        :param suite_list: List of paths to test suites or directories containing test suites
+        :type suite_list: list
+        :param extensions: String that filters the accepted file extensions for the test suites
+        :type extensions: str
+        :param include_suites: List of strings that filter suites to include
+        :type include_suites: list
+
+        :return: Root of the suite tree
+        :rtype: robot.running.model.TestSuite
+        """
         suite_list = [os.path.normpath(p) for p in suite_list]
         logger.debug('Suite List: %s', str(suite_list))
 
         # Let robot do the heavy lifting in parsing the test suites
-        builder = self._create_test_suite_builder(include_suites, extensions)
-        suite = builder.build(*suite_list)
+        builder = RemoteFrameworkClient._create_test_suite_builder(include_suites, extensions)
+        return builder.build(*suite_list)
 
-        # Now iterate the suite's family tree, pull out the suites with test cases and resolve their dependencies.
-        # Package them up into a dictionary that can be serialized
-        self._package_suite_hierarchy(suite)
+    @staticmethod
+    def prune_test_suite(suite, robot_arg_dict):
+        """
+        Apply the test case selection that robot will apply on the agent (--test, --include and --exclude) to the suite
+        tree, so that suites without any selected test cases aren't packaged and sent. The arguments are still passed
+        to the agent, which selects the test cases within the suites that are sent.
+
+        :param suite: Root of the suite tree, which is pruned in place
+        :type suite: robot.running.model.TestSuite
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        """
+        selection = dict((name, robot_arg_dict[name]) for name in TEST_SELECTION_ROBOT_ARGS if robot_arg_dict.get(name))
+        # A root suite with test cases is a single file, which is sent whatever is selected
+        if not selection or suite.tests:
+            return
+
+        suite_config = RobotSettings(**selection).suite_config
+        test_count = suite.test_count
+        # Record the tree so that it can be restored if nothing is selected
+        snapshot = []
+        pending = [suite]
+        while pending:
+            current = pending.pop()
+            snapshot.append((current, list(current.tests), list(current.suites)))
+            pending.extend(current.suites)
+
+        # Match long names in the same way as the agent, which executes the tree under a root suite of its own
+        root_name = suite.name
+        suite.name = REMOTE_ROOT_SUITE_NAME + '.' + root_name
+        try:
+            suite.configure(include_tests=suite_config['include_tests'],
+                            include_tags=suite_config['include_tags'],
+                            exclude_tags=suite_config['exclude_tags'],
+                            empty_suite_ok=True)
+        finally:
+            suite.name = root_name
+
+        if not suite.test_count:
+            # Send the whole tree and leave robot on the agent to report that nothing was selected
+            logger.debug('No test cases selected, not pruning the suite tree')
+            for current, tests, child_suites in snapshot:
+                current.tests = tests
+                current.suites = child_suites
+        else:
+            logger.debug('Selected %d of %d test cases', suite.test_count, test_count)
+
+    def cancel(self):
+        """
+        Cancel the run that is executing from another thread. The thread that is waiting for the run asks the agent to
+        stop the run the next time it polls and then raises a RunCancelledError. Only agents that support async jobs
+        can be cancelled.
+        """
+        self._cancelled.set()
 
-        # Make the RPC
+    def _dispatch_run(self, robot_arg_dict, output_callback, artifact_paths=None):
+        """
+        Send the packaged suites and dependencies to the agent using the most efficient method it supports and execute
+        the robot run
+
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param output_callback: Callable that is passed the robot stdout/stderr as it is produced
+        :type output_callback: callable
+        :param artifact_paths: Dictionary of test artifact name to the local path to save it to
+        :type artifact_paths: dict
+
+        :return: Dictionary containing stdout/err, log html, output xml, report html, return code
+        :rtype: dict
+        """
         logger.info('Connecting to: %s', self._address)
-        response = self._client.execute_robot_run(self._suites, self._dependencies, robot_arg_dict, self._debug)
+        capabilities = self._get_capabilities()
+        # Download the artifacts straight to disk a chunk at a time rather than in one giant response
+        chunked_artifacts = artifact_paths is not None and 'async_jobs' in capabilities and \
+            'chunked_artifacts' in capabilities
+        warm_workspace = self._workspace and 'warm_workspaces' in capabilities
+        if 'content_addressed_upload' in capabilities:
+            with self.timings.phase('upload'):
+                options = {'debug': self._debug, 'chunked_artifacts': chunked_artifacts}
+                if self._priority and 'priority_queue' in capabilities:
+                    options['priority'] = self._priority
+                elif self._priority:
+                    logger.warning('The agent does not support priorities, the run is queued in submission order')
+                if 'bundle_upload' in capabilities and not warm_workspace:
+                    # Stream all of the files as a single archive that the agent extracts as it arrives
+                    manifest = {}
+                    options['bundle'] = self._upload_bundle()
+                else:
+                    # Only send the files that the agent doesn't already hold
+                    manifest, blobs = self._build_manifest()
+                    if warm_workspace:
+                        # Only send the changes since the last run in the workspace
+                        manifest, options['workspace'] = self._calculate_workspace_changes(manifest)
+                        blobs = dict((digest, blobs[digest]) for digest in manifest.values())
+                    self._upload_missing_blobs(blobs)
+            with self.timings.phase('execute'):
+                if 'async_jobs' in capabilities:
+                    # Queue the run and poll for it to finish rather than holding a request open for the whole run
+                    job_id = self._submit_run(manifest, robot_arg_dict, options)
+                    response = self._wait_for_job(job_id, output_callback)
+                else:
+                    response = self._client.execute_manifest_run(manifest, robot_arg_dict, self._debug)
+        else:
+            if self._bundle_path:
+                raise RuntimeError('The agent at {} is too old to execute a bundle'.format(self._address))
+            if self._attachments:
+                logger.warning('The agent does not support attachments, they have not been sent')
+            with self.timings.phase('execute'):
+                response = self._client.execute_robot_run(self._suites, self._dependencies, robot_arg_dict,
+                                                          self._debug)
+        self.agent_timings = response.pop('timings', None)
+
+        if artifact_paths is None:
+            return response
+        with self.timings.phase('download'):
+            if chunked_artifacts:
+                return self._download_artifacts(job_id, response, artifact_paths)
+            return self._save_artifacts(response, artifact_paths)
+
+    def _download_artifacts(self, job_id, response, artifact_paths):
+        """
+        Download the test artifacts of a finished job from the agent a chunk at a time, writing each chunk straight to
+        disk, and then release the job
 
+        :param job_id: ID of the job
+        :type job_id: str
+        :param response: Result of the job, containing the size of each artifact it generated
+        :type response: dict
+        :param artifact_paths: Dictionary of test artifact name to the local path to save it to
+        :type artifact_paths: dict
+
+        :return: Dictionary containing the return code and the paths of the artifacts that were saved
+        :rtype: dict
+        """
+        saved_paths = {}
+        try:
+            for name, path in artifact_paths.items():
+                if name not in response['artifact_sizes']:
+                    continue
+                logger.debug('Downloading %s (%d bytes) to: %s', name, response['artifact_sizes'][name], path)
+                with open(path, 'wb') as file_handle:
+                    self.timings.add_bytes('download', self._get_transport().download_artifact(job_id, name,
+                                                                                               file_handle))
+                saved_paths[name] = path
+        finally:
+            self._client.release_job(job_id)
+
+        return {'ret_code': response['ret_code'], 'artifact_paths': saved_paths}
+
+    def _save_artifacts(self, response, artifact_paths):
+        """
+        Save the test artifacts returned in a run's result to disk
+
+        :param response: Dictionary containing stdout/err, log html, output xml, report html, return code
+        :type response: dict
+        :param artifact_paths: Dictionary of test artifact name to the local path to save it to
+        :type artifact_paths: dict
+
+        :return: Dictionary containing stdout/err, return code and the paths of the artifacts that were saved
+        :rtype: dict
+        """
+        saved_paths = {}
+        for name, path in artifact_paths.items():
+            artifact = response.pop(name, None)
+            if artifact is not None and artifact.data:
+                with open(path, 'wb') as file_handle:
+                    file_handle.write(artifact.data)
+                self.timings.add_bytes('download', len(artifact.data))
+                saved_paths[name] = path
+        for name in ('output_xml', 'log_html', 'report_html'):
+            response.pop(name, None)
+        response['artifact_paths'] = saved_paths
         return response
 
+    def _get_capabilities(self):
+        """
+        Query the agent for the features it supports. Agents that pre-date get_capabilities() are treated as only
+        supporting execute_robot_run()
+
+        :return: List of capability names
+        :rtype: list
+        """
+        if self._capabilities is None:
+            try:
+                self._capabilities = self._client.get_capabilities()
+            except xmlrpc_client.Fault:
+                self._capabilities = []
+            logger.debug('Agent capabilities: %s', self._capabilities)
+        return self._capabilities
+
+    def _get_transport(self):
+        """
+        :return: The most efficient transport for file contents that the agent supports
+        :rtype: rfremoterunner.transport.BinaryTransport | rfremoterunner.transport.XmlRpcTransport
+        """
+        if self._transport is None:
+            self._transport = create_transport(self._address, self._client, self._get_capabilities())
+        return self._transport
+
+    def _submit_run(self, manifest, robot_arg_dict, options):
+        """
+        Queue the run on the agent. If the agent's queue is full, wait for as long as it says to and submit the run
+        again
+
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+        :param robot_arg_dict: Dictionary of arguments that will be passed to robot.run on the remote host
+        :type robot_arg_dict: dict
+        :param options: Dictionary of run options
+        :type options: dict
+
+        :return: ID of the queued job
+        :rtype: str
+
+        :raises xmlrpc_client.Fault: If the agent is still rejecting the run after MAX_SUBMIT_WAIT_SECONDS
+        """
+        deadline = time.time() + MAX_SUBMIT_WAIT_SECONDS
+        while True:
+            try:
+                return self._client.submit_run(manifest, robot_arg_dict, options)
+            except xmlrpc_client.Fault as fault:
+                if fault.faultCode != QUEUE_FULL_FAULT_CODE:
+                    raise
+                retry_after = parse_retry_after(fault.faultString) or DEFAULT_RETRY_AFTER_SECONDS
+                if time.time() + retry_after > deadline:
+                    raise
+                logger.info('The agent is busy, retrying in %d seconds', retry_after)
+            # Wait on the cancel event so that cancelling doesn't have to wait for the retry
+            if self._cancelled.wait(retry_after):
+                raise RunCancelledError('The run was cancelled before the agent accepted it')
+
+    def _wait_for_job(self, job_id, output_callback=None):
+        """
+        Poll the agent with an increasing interval until the job has finished and then collect its result. While
+        waiting, any new robot stdout/stderr is passed to the output callback.
+
+        :param job_id: ID of the job returned by submit_run()
+        :type job_id: str
+        :param output_callback: Callable that is passed the robot stdout/stderr as it is produced
+        :type output_callback: callable
+
+        :return: Dictionary containing stdout/err, log html, output xml, report html, return code
+        :rtype: dict
+        """
+        logger.debug('Waiting for job: %s', job_id)
+        stream_output = output_callback is not None and 'streaming_output' in self._get_capabilities()
+        # Output is fetched by byte offset so a multi-byte character may be split across two chunks
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        output_offset = 0
+        poll_interval = MIN_POLL_INTERVAL
+        queue_reported = False
+        while True:
+            if self._cancelled.is_set():
+                self._cancel_job(job_id)
+            status = self._client.get_job_status(job_id)
+            # Agents with a priority queue report how many runs are ahead while the job is queued
+            if status.get('queue_position') and not queue_reported:
+                logger.info('Queued on the agent behind %d runs', status['queue_position'])
+                queue_reported = True
+            if stream_output:
+                new_offset = self._read_job_output(job_id, output_offset, decoder, output_callback)
+                if new_offset != output_offset:
+                    # Keep polling quickly while the run is producing output
+                    poll_interval = MIN_POLL_INTERVAL
+                    output_offset = new_offset
+            if status['state'] == 'cancelled':
+                raise RunCancelledError('Job {} was cancelled'.format(job_id))
+            if status['state'] in ('finished', 'failed'):
+                break
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * POLL_BACKOFF_FACTOR, MAX_POLL_INTERVAL)
+
+        logger.debug('Job %s %s', job_id, status['state'])
+        return self._client.get_job_result(job_id)
+
+    def _cancel_job(self, job_id):
+        """
+        Ask the agent to stop a job and raise a RunCancelledError
+
+        :param job_id: ID of the job
+        :type job_id: str
+        """
+        if 'cancel_jobs' in self._get_capabilities():
+            logger.debug('Cancelling job: %s', job_id)
+            self._client.cancel_job(job_id)
+        raise RunCancelledError('Job {} was cancelled'.format(job_id))
+
+    def _read_job_output(self, job_id, offset, decoder, output_callback):
+        """
+        Fetch all of the robot stdout/stderr currently available for a job and pass it to the output callback
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param offset: Byte offset of the output already received
+        :type offset: int
+        :param decoder: Incremental UTF-8 decoder for the output
+        :type decoder: codecs.IncrementalDecoder
+        :param output_callback: Callable that is passed the robot stdout/stderr
+        :type output_callback: callable
+
+        :return: Byte offset of the output received so far
+        :rtype: int
+        """
+        while True:
+            chunk = self._client.get_job_output(job_id, offset)
+            if chunk['offset'] == offset:
+                return offset
+            offset = chunk['offset']
+            text = decoder.decode(chunk['data'].data)
+            if text:
+                output_callback(text)
+
+    def _packaged_files(self):
+        """
+        :return: Dictionary of the workspace relative path of each packaged suite and dependency to its contents
+        :rtype: dict
+        """
+        files = OrderedDict()
+        for suite_filename, suite in self._suites.items():
+            files['/'.join(filter(None, [suite['path'], suite_filename]))] = suite['suite_data'].encode('utf-8')
+        for dep_filename, dep_data in self._dependencies.items():
+            files[dep_filename] = dep_data.encode('utf-8')
+        return files
+
+    def _collect_attachments(self):
+        """
+        Find the files to attach to the run. An attached file is placed in the root of the workspace, an attached
+        directory is placed in the root of the workspace along with everything in it
+
+        :return: Dictionary of workspace relative paths to the path of each file on disk
+        :rtype: dict
+        """
+        attachments = OrderedDict()
+        for path in self._attachments:
+            path = os.path.abspath(path)
+            if os.path.isfile(path):
+                attachments[os.path.basename(path)] = path
+            elif os.path.isdir(path):
+                for dir_path, dir_names, filenames in os.walk(path):
+                    dir_names.sort()
+                    rel_dir = os.path.relpath(dir_path, os.path.dirname(path)).replace(os.sep, '/')
+                    for filename in sorted(filenames):
+                        attachments[rel_dir + '/' + filename] = os.path.join(dir_path, filename)
+            else:
+                raise IOError('Attachment not found: {}'.format(path))
+        return attachments
+
+    def _build_manifest(self):
+        """
+        Convert the packaged suites, dependencies and attachments into a manifest of workspace relative paths to content
+        digests
+
+        :return: The manifest, and a dictionary of digest to file contents
+        :rtype: tuple
+        """
+        manifest = {}
+        blobs = {}
+        if self._bundle_path:
+            files, _ = read_bundle_file(self._bundle_path)
+        else:
+            files = self._packaged_files()
+        for rel_path, data in files.items():
+            manifest[rel_path] = calculate_digest(data)
+            blobs[manifest[rel_path]] = data
+
+        for rel_path, path in self._collect_attachments().items():
+            with open(path, 'rb') as file_handle:
+                data = file_handle.read()
+            manifest[rel_path] = calculate_digest(data)
+            blobs[manifest[rel_path]] = data
+
+        return manifest, blobs
+
+    def _upload_bundle(self):
+        """
+        Stream the packaged suites, dependencies and attachments to the agent as a single archive. Attachments are read
+        from disk as the archive is sent rather than being held in memory. A bundle file is sent as it is
+
+        :return: ID of the bundle on the agent
+        :rtype: str
+        """
+        if self._bundle_path:
+            logger.debug('Uploading the bundle file: %s', self._bundle_path)
+            with open(self._bundle_path, 'rb') as file_handle:
+                bundle_id, sent = self._get_transport().upload_bundle(
+                    lambda fileobj: shutil.copyfileobj(file_handle, fileobj), BUNDLE_FILE_CODEC)
+            self.timings.add_bytes('upload', sent)
+            return bundle_id
+
+        files = self._packaged_files()
+        attachments = self._collect_attachments()
+        logger.debug('Uploading a bundle of %d files and %d attachments', len(files), len(attachments))
+        bundle_id, sent = self._get_transport().upload_bundle(
+            lambda fileobj: write_bundle(fileobj, files, attachments))
+        self.timings.add_bytes('upload', sent)
+        return bundle_id
+
+    def _calculate_workspace_changes(self, manifest):
+        """
+        Compare a manifest with the files held in the agent's persistent workspace
+
+        :param manifest: Dictionary of workspace relative paths to content digests of the files to run with
+        :type manifest: dict
+
+        :return: Dictionary of the added and changed files in the manifest, and the workspace options for submit_run()
+        :rtype: tuple
+        """
+        state = self._client.get_workspace_state(self._workspace)
+        held = state['manifest']
+        changes = dict((rel_path, digest) for rel_path, digest in manifest.items() if held.get(rel_path) != digest)
+        deleted_paths = sorted(rel_path for rel_path in held if rel_path not in manifest)
+        logger.debug('Workspace %s: %d of %d files changed, %d deleted', self._workspace, len(changes), len(manifest),
+                     len(deleted_paths))
+        return changes, {'name': self._workspace,
+                         'base_revision': state['revision'],
+                         'deleted_paths': deleted_paths}
+
+    def _upload_missing_blobs(self, blobs):
+        """
+        Ask the agent which files it doesn't already hold and upload only those, in batches
+
+        :param blobs: Dictionary of digest to file contents
+        :type blobs: dict
+        """
+        missing = self._client.get_missing_blobs(sorted(blobs.keys()))
+        logger.debug('Uploading %d of %d files (%d bytes)', len(missing), len(blobs),
+                     sum(len(blobs[digest]) for digest in missing))
+
+        # Record the bytes actually sent, which is less than the size of the files if they were compressed
+        sent = 0
+        batch = {}
+        batch_size = 0
+        for digest in missing:
+            if batch and batch_size + len(blobs[digest]) > MAX_UPLOAD_BATCH_BYTES:
+                sent += self._get_transport().upload_blobs(batch)
+                batch = {}
+                batch_size = 0
+            batch[digest] = blobs[digest]
+            batch_size += len(blobs[digest])
+
+        if batch:
+            sent += self._get_transport().upload_blobs(batch)
+        self.timings.add_bytes('upload', sent)
+
     @staticmethod
     def _create_test_suite_builder(include_suites, extensions):
         """
@@ -94,6 +709,54 @@ class RemoteFrameworkClient:
 
         return builder
 
+    def _prefetch_robot_files(self, suites):
+        """
+        Read and scan the test suites and every file they import on a pool of threads, one wave of imports at a time.
+        Packaging then walks the files in the same order as it always has, so the result is identical, but without
+        waiting on each file read and import lookup in turn. A file that fails to scan is left for packaging to scan
+        again, so that any error is raised at the same point it would have been.
+
+        :param suites: Test suites containing test cases
+        :type suites: list
+        """
+        def scan(file_path):
+            try:
+                return file_path, self._scan_robot_file(file_path, suites_by_path.get(file_path))
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug('Unable to scan %s ahead of packaging: %s', file_path, err)
+                return file_path, None
+
+        def read_library(file_path):
+            try:
+                return file_path, read_file_from_disk(file_path)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug('Unable to read %s ahead of packaging: %s', file_path, err)
+                return file_path, None
+
+        suites_by_path = dict((suite.source, suite) for suite in suites)
+        pool = ThreadPool(PACKAGING_THREADS)
+        try:
+            wave = sorted(set(suites_by_path) - set(self._scanned_files))
+            while wave:
+                libraries = set()
+                resources = set()
+                for file_path, scanned in pool.map(scan, wave):
+                    if scanned is None:
+                        continue
+                    self._scanned_files[file_path] = scanned
+                    for imp_type, _, _, full_path in scanned[1]:
+                        if full_path:
+                            (libraries if imp_type == 'Library' else resources).add(full_path)
+
+                for file_path, data in pool.map(read_library, sorted(libraries - set(self._library_data))):
+                    if data is not None:
+                        self._library_data[file_path] = data
+                wave = sorted(resources - set(self._scanned_files))
+        finally:
+            pool.close()
+            pool.join()
+        logger.debug('Prefetched %d robot files and %d libraries', len(self._scanned_files), len(self._library_data))
+
     def _package_suite_hierarchy(self, suite):
         """
         Parses through a Test Suite and its child Suites and packages them up into a dictionary so they can be
@@ -159,11 +822,115 @@ class RemoteFrameworkClient:
             file_path = source.source
             is_test_suite = True
 
-        modified_file_lines = []
-        # Read the actual file from disk
+        new_file_data, imports = self._scan_robot_file(file_path, source if is_test_suite else None)
+        for imp_type, res_path, filename, full_path in imports:
+            # If this not a dependency we've already dealt with and not a built-in robot library
+            if filename not in self._dependencies and not self._is_builtin_library(res_path):
+                if not full_path:
+                    # The import couldn't be found when the file was scanned. Now that it is needed, raise the error
+                    full_path = find_file(res_path, os.path.dirname(file_path), imp_type)
+                if imp_type == 'Library':
+                    # If its a Library (python file) then read the data and add to the dependencies
+                    if full_path in self._library_data:
+                        self._dependencies[filename] = self._library_data[full_path]
+                    else:
+                        self._dependencies[filename] = read_file_from_disk(full_path)
+                else:
+                    # If its a Resource, recurse down and parse it
+                    self._process_robot_file(full_path)
+
+        if not is_test_suite:
+            self._dependencies[os.path.basename(file_path)] = new_file_data
+
+        return new_file_data
+
+    def _scan_robot_file(self, file_path, suite=None):
+        """
+        Find the Library and Resource imports in a robot file, resolve the path of each and rewrite them to just the
+        filename. The file is always read from disk to be rewritten, as robot's model doesn't keep its text. The imports
+        of a test suite are taken from the model robot has already parsed, while resource files, which robot doesn't
+        parse until the agent runs them, are scanned line by line. The result is served from the packaging cache if the
+        file hasn't changed since it was last scanned.
+
+        :param file_path: Path to the robot file
+        :type file_path: str
+        :param suite: The test suite robot parsed from the file, if it is a test suite. Its imports are taken from the
+        parsed model rather than by matching each line of the file
+        :type suite: robot.running.model.TestSuite
+
+        :return: The updated robot file data, and a list of (import type, import path, filename, resolved path) tuples
+        for each import. The resolved path is None for robot's built-in libraries and imports that can't be found
+        :rtype: tuple
+        """
+        if file_path in self._scanned_files:
+            return self._scanned_files[file_path]
+        if self._packaging_cache:
+            cached = self._packaging_cache.get(file_path)
+            if cached:
+                return cached
+
+        # Read the actual file from disk, even for a test suite that robot has parsed
         file_lines = read_file_from_disk(file_path, into_lines=True)
+        # Robot versions before 3.2 don't record which line each import is on
+        if suite is not None and all(getattr(imp, 'lineno', None) for imp in suite.resource.imports):
+            imports = self._rewrite_model_imports(file_lines, file_path, suite.resource.imports)
+        else:
+            imports = self._rewrite_line_imports(file_lines, file_path)
+
+        new_file_data = ''.join(file_lines)
+        if self._packaging_cache:
+            self._packaging_cache.put(file_path, new_file_data, imports)
+        return new_file_data, imports
+
+    @staticmethod
+    def _rewrite_model_imports(file_lines, file_path, model_imports):
+        """
+        Rewrite the Library and Resource imports of a file that robot has already parsed, using the imports in the
+        parsed model to find the lines to rewrite
+
+        :param file_lines: Lines of the file, which are updated in place
+        :type file_lines: list
+        :param file_path: Path to the robot file
+        :type file_path: str
+        :param model_imports: Imports robot parsed from the file
+        :type model_imports: robot.running.model.Imports
+
+        :return: List of (import type, import path, filename, resolved path) tuples for each import
+        :rtype: list
+        """
+        imports = []
+        for imp in model_imports:
+            # Newer robot versions use upper case import types
+            imp_type = imp.type.title()
+            if imp_type not in ('Library', 'Resource'):
+                continue
+            # Replace the path with just the filename. They will be in the PYTHONPATH on the remote side so only
+            # the filename is required. Search after the setting name so that it isn't matched by mistake
+            filename = os.path.basename(imp.name)
+            line = file_lines[imp.lineno - 1]
+            setting_end = max(line.lower().find(imp_type.lower()), 0) + len(imp_type)
+            name_index = line.find(imp.name, setting_end)
+            if name_index != -1:
+                file_lines[imp.lineno - 1] = line[:name_index] + filename + line[name_index + len(imp.name):]
+            imports.append((imp_type, imp.name, filename,
+                            RemoteFrameworkClient._resolve_import(imp_type, imp.name, file_path)))
+        return imports
 
-        for line in file_lines:
+    @staticmethod
+    def _rewrite_line_imports(file_lines, file_path):
+        """
+        Scan each line of a file for Library and Resource imports and rewrite them
+
+        :param file_lines: Lines of the file, which are updated in place
+        :type file_lines: list
+        :param file_path: Path to the robot file
+        :type file_path: str
+
+        :return: List of (import type, import path, filename, resolved path) tuples for each import
+        :rtype: list
+        """
+        imports = []
+        for index, line in enumerate(file_lines):
             # Check if the current line is a Library or Resource import
             matches = IMPORT_LINE_REGEX.search(line)
             if matches and len(matches.groups()) == 4:
@@ -175,29 +942,43 @@ class RemoteFrameworkClient:
                 filename = os.path.basename(res_path)
                 line_ending = matches.group(4)
 
-                # Rebuild the updated line and append
-                modified_file_lines.append(imp_type + whitespace_sep + filename + line_ending)
-
-                # If this not a dependency we've already dealt with and not a built-in robot library
-                # (e.g. robot.libraries.Process)
-                if filename not in self._dependencies and \
-                        not res_path.strip().startswith('robot.libraries') \
-                        and res_path.strip() not in STDLIBS:
-                    # Find the actual file path
-                    full_path = find_file(res_path, os.path.dirname(file_path), imp_type)
-
-                    if imp_type == 'Library':
-                        # If its a Library (python file) then read the data and add to the dependencies
-                        self._dependencies[filename] = read_file_from_disk(full_path)
-                    else:
-                        # If its a Resource, recurse down and parse it
-                        self._process_robot_file(full_path)
-            else:
-                modified_file_lines.append(line)
+                # Rebuild the updated line
+                file_lines[index] = imp_type + whitespace_sep + filename + line_ending
+                imports.append((imp_type, res_path, filename,
+                                RemoteFrameworkClient._resolve_import(imp_type, res_path, file_path)))
+        return imports
 
-        new_file_data = ''.join(modified_file_lines)
+    @staticmethod
+    def _resolve_import(imp_type, res_path, file_path):
+        """
+        Find the file a Library or Resource import refers to
+
+        :param imp_type: Type of import (Library or Resource)
+        :type imp_type: str
+        :param res_path: Path or name given in the import
+        :type res_path: str
+        :param file_path: Path of the file containing the import
+        :type file_path: str
+
+        :return: Absolute path of the imported file, or None for built-in robot libraries which are already on the
+        remote side. Also None if the file can't be found, which is only an error if the import is packaged: a file can
+        import the same filename as another file that has already been packaged
+        :rtype: str
+        """
+        if RemoteFrameworkClient._is_builtin_library(res_path):
+            return None
+        try:
+            return find_file(res_path, os.path.dirname(file_path), imp_type)
+        except DataError:
+            return None
 
-        if not is_test_suite:
-            self._dependencies[os.path.basename(file_path)] = new_file_data
+    @staticmethod
+    def _is_builtin_library(res_path):
+        """
+        :param res_path: Path or name given in a Library or Resource import
+        :type res_path: str
 
-        return new_file_data
+        :return: Whether the import is a built-in robot library (e.g. robot.libraries.Process)
+        :rtype: bool
+        """
+        return res_path.strip().startswith('robot.libraries') or res_path.strip() in STDLIBS
@@ -1,14 +1,26 @@
+import functools
+from io import open
 import tempfile
 import os
 import shutil
 import sys
 import logging
+import threading
+import time
+import uuid
 import six.moves.xmlrpc_client as xmlrpc_client
-import six.moves.xmlrpc_server as xmlrpc_server
-from six import StringIO
-from robot.run import run
 
-from rfremoterunner.utils import write_file_to_disk, read_file_from_disk
+from rfremoterunner.blob_store import BlobStore
+from rfremoterunner.bundles import extract_bundle
+from rfremoterunner.compression import available_codecs, CODEC_CAPABILITY_PREFIX
+from rfremoterunner.jobs import JobManager, QueueFullError, CANCELLED, NORMAL_PRIORITY, QUEUE_FULL_FAULT_CODE
+from rfremoterunner.metrics import MetricsRegistry, PhaseTimings
+from rfremoterunner.request_handler import AgentRequestHandler, ThreadedXMLRPCServer, METRICS_PATH
+from rfremoterunner.transport import read_frames
+from rfremoterunner.utils import write_file_to_disk, read_file_from_disk, resolve_workspace_path
+from rfremoterunner.workers import run_robot, stop_robot_run, clear_robot_stop_request, robot_worker_main, \
+    missing_modules_main, import_modules, create_worker_context
+from rfremoterunner.workspaces import WorkspaceStore, calculate_revision
 
 
 logging.basicConfig(format='%(message)s', level=logging.INFO, stream=sys.stdout)
@@ -16,14 +28,75 @@ logger = logging.getLogger(__file__)
 
 DEFAULT_ADDRESS = '0.0.0.0'
 DEFAULT_PORT = 1471
+# Maximum amount of console output returned by a single get_job_output() call
+MAX_OUTPUT_CHUNK_BYTES = 64 * 1024
+# Maximum amount of a test artifact returned by a single read_artifact() call
+MAX_ARTIFACT_CHUNK_BYTES = 1024 * 1024
+# Test artifacts that can be downloaded with read_artifact() and the files robot writes them to
+ARTIFACT_FILENAMES = {'output_xml': 'output.xml', 'log_html': 'log.html', 'report_html': 'report.html'}
+# How long cancel_job() waits for a cancelled run to stop before returning
+CANCEL_TIMEOUT_SECONDS = 30
+# How long a bundle is kept for if no run is submitted with it
+BUNDLE_RETENTION_SECONDS = 60 * 60
+
+
+class AgentMetrics(MetricsRegistry):
+    """
+    The cumulative metrics of an agent
+    """
+
+    def __init__(self):
+        MetricsRegistry.__init__(self)
+        self.runs = self.counter('rfremoterunner_runs_total', 'Robot runs executed, by the state they ended in',
+                                 label_name='state')
+        self.queue_wait = self.histogram('rfremoterunner_queue_wait_seconds',
+                                         'Time robot runs spent queued before they started')
+        self.run_duration = self.histogram('rfremoterunner_run_duration_seconds',
+                                           'Time taken to execute robot runs, from starting to finishing')
+        self.bytes_received = self.counter('rfremoterunner_received_bytes_total',
+                                           'Bytes of XML-RPC requests received')
+        self.bytes_sent = self.counter('rfremoterunner_sent_bytes_total',
+                                       'Bytes of XML-RPC responses sent, after any compression')
+        self.runs_rejected = self.counter('rfremoterunner_runs_rejected_total',
+                                          'Robot runs rejected because the queue was full')
+
+    def record_job(self, job):
+        """
+        Record a job that has finished executing
+
+        :param job: The job
+        :type job: rfremoterunner.jobs.Job
+        """
+        self.runs.inc(label=job.state)
+        if job.started_time is not None:
+            self.queue_wait.observe(job.started_time - job.submitted_time)
+            self.run_duration.observe(job.finished_time - job.started_time)
 
 
 class RobotFrameworkServer:
 
     # Executable RPC functions
     EXECUTE_FUNC = 'execute_robot_run'
-
-    def __init__(self, address=DEFAULT_ADDRESS, port=DEFAULT_PORT, debug=False):
+    GET_CAPABILITIES_FUNC = 'get_capabilities'
+    GET_MISSING_BLOBS_FUNC = 'get_missing_blobs'
+    UPLOAD_BLOBS_FUNC = 'upload_blobs'
+    EXECUTE_MANIFEST_FUNC = 'execute_manifest_run'
+    SUBMIT_RUN_FUNC = 'submit_run'
+    GET_JOB_STATUS_FUNC = 'get_job_status'
+    GET_JOB_RESULT_FUNC = 'get_job_result'
+    GET_JOB_OUTPUT_FUNC = 'get_job_output'
+    CANCEL_JOB_FUNC = 'cancel_job'
+    READ_ARTIFACT_FUNC = 'read_artifact'
+    RELEASE_JOB_FUNC = 'release_job'
+    GET_WORKSPACE_STATE_FUNC = 'get_workspace_state'
+
+    # Features advertised to clients through get_capabilities(). Agents that pre-date get_capabilities() only support
+    # execute_robot_run()
+    CAPABILITIES = ['content_addressed_upload', 'async_jobs', 'streaming_output', 'cancel_jobs',
+                    'chunked_artifacts', 'warm_workspaces', 'binary_transport', 'bundle_upload', 'priority_queue']
+
+    def __init__(self, address=DEFAULT_ADDRESS, port=DEFAULT_PORT, debug=False, blob_store_dir=None, workers=None,
+                 workspace_store_dir=None, preload_modules=None, max_queued=None):
         """
         Constructor for RobotFrameworkServer
 
@@ -33,11 +106,60 @@ class RobotFrameworkServer:
         :type port: int
         :param debug: Run in debug mode. This changes the logging level and does not cleanup the workspace
         :type debug: bool
+        :param blob_store_dir: Directory to keep uploaded files in so they do not need to be sent again. Defaults to a
+        directory in the system temp directory
+        :type blob_store_dir: str
+        :param workers: Number of robot runs that can execute concurrently, each in its own worker process. By default
+        runs are executed one at a time inside the agent process
+        :type workers: int
+        :param workspace_store_dir: Directory to keep the named workspaces that clients sync incrementally in. Defaults
+        to a directory in the system temp directory
+        :type workspace_store_dir: str
+        :param preload_modules: Names of modules, e.g. heavy test libraries, to import once when the agent starts rather
+        than in every run. With workers, each worker process starts with them already imported
+        :type preload_modules: list
+        :param max_queued: Maximum number of runs that can be waiting for a worker. Further runs are rejected with a
+        fault that tells the client when to retry. Unlimited by default
+        :type max_queued: int
         """
         self._address = address
         self._port = port
-        self._server = xmlrpc_server.SimpleXMLRPCServer((address, int(port)), encoding='utf-8')
-        self._server.register_function(RobotFrameworkServer.execute_robot_run, self.EXECUTE_FUNC)
+        self._blob_store = BlobStore(blob_store_dir)
+        self._workspace_store = WorkspaceStore(workspace_store_dir)
+        self._workers = workers
+        self._preload_modules = list(preload_modules or [])
+        if workers:
+            self._worker_context = create_worker_context(self._preload_modules)
+        else:
+            self._worker_context = None
+            missing = import_modules(self._preload_modules)
+            if missing:
+                logger.warning('Failed to preload modules: %s', ', '.join(missing))
+        # Workspaces extracted from uploaded bundles and when they were stored, keyed by bundle ID, until a run claims
+        # them
+        self._bundles = {}
+        self._bundles_lock = threading.Lock()
+        self._metrics = AgentMetrics()
+        # In-process runs change the CWD & PYTHONPATH of the agent so have to be executed one at a time
+        self._max_queued = max_queued
+        self._jobs = JobManager(workers or 1, on_job_done=self._metrics.record_job, max_queued=max_queued)
+        self._server = ThreadedXMLRPCServer((address, int(port)), requestHandler=AgentRequestHandler,
+                                            encoding='utf-8')
+        self._server.metrics_registry = self._metrics
+        self._server.agent = self
+        self._server.register_function(self.execute_robot_run, self.EXECUTE_FUNC)
+        self._server.register_function(self.get_capabilities, self.GET_CAPABILITIES_FUNC)
+        self._server.register_function(self.get_missing_blobs, self.GET_MISSING_BLOBS_FUNC)
+        self._server.register_function(self.upload_blobs, self.UPLOAD_BLOBS_FUNC)
+        self._server.register_function(self.execute_manifest_run, self.EXECUTE_MANIFEST_FUNC)
+        self._server.register_function(self.submit_run, self.SUBMIT_RUN_FUNC)
+        self._server.register_function(self.get_job_status, self.GET_JOB_STATUS_FUNC)
+        self._server.register_function(self.get_job_result, self.GET_JOB_RESULT_FUNC)
+        self._server.register_function(self.get_job_output, self.GET_JOB_OUTPUT_FUNC)
+        self._server.register_function(self.cancel_job, self.CANCEL_JOB_FUNC)
+        self._server.register_function(self.read_artifact, self.READ_ARTIFACT_FUNC)
+        self._server.register_function(self.release_job, self.RELEASE_JOB_FUNC)
+        self._server.register_function(self.get_workspace_state, self.GET_WORKSPACE_STATE_FUNC)
         logger.setLevel(logging.DEBUG if debug else logging.INFO)
 
     def serve(self):
@@ -45,10 +167,495 @@ class RobotFrameworkServer:
         Blocking call to wait for XML-RPC connections
         """
         logger.info('Listening on %s:%s', self._address, self._port)
-        self._server.serve_forever()
+        logger.info('Metrics available at http://%s:%s%s', self._address, self._port, METRICS_PATH)
+        if self._workers:
+            logger.info('Executing up to %d robot runs concurrently', self._workers)
+            self._start_worker_context()
+        elif self._preload_modules:
+            logger.info('Preloaded modules: %s', ', '.join(self._preload_modules))
+        if self._max_queued is not None:
+            logger.info('Queueing up to %d robot runs', self._max_queued)
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
 
-    @staticmethod
-    def execute_robot_run(test_suites, dependencies, robot_args, debug=False):
+    def close(self):
+        """
+        Close the listening socket and delete the files held for any jobs
+        """
+        self._server.server_close()
+        self._jobs.close()
+        with self._bundles_lock:
+            for workspace_dir, _ in self._bundles.values():
+                shutil.rmtree(workspace_dir, ignore_errors=True)
+            self._bundles.clear()
+
+    def shutdown(self):
+        """
+        Stop serve() from another thread. Blocks until it has stopped
+        """
+        self._server.shutdown()
+
+    def _start_worker_context(self):
+        """
+        Start a worker process so that the fork server, if there is one, imports the preload modules before the first
+        run rather than during it, and check that they were imported
+
+        :return: Names of the preload modules that the workers don't start with
+        :rtype: list
+        """
+        reader, writer = self._worker_context.Pipe(duplex=False)
+        worker = self._worker_context.Process(target=missing_modules_main, args=(self._preload_modules, writer))
+        worker.start()
+        writer.close()
+        try:
+            missing = reader.recv()
+        except EOFError:
+            missing = list(self._preload_modules)
+        finally:
+            reader.close()
+            worker.join()
+
+        if missing:
+            logger.warning('Worker processes failed to preload modules: %s', ', '.join(missing))
+        elif self._preload_modules:
+            logger.info('Worker processes preloaded modules: %s', ', '.join(self._preload_modules))
+        return missing
+
+    def get_capabilities(self):
+        """
+        Callback that is invoked when a client queries which features this agent supports
+
+        :return: List of capability names
+        :rtype: list
+        """
+        return list(self.CAPABILITIES) + [CODEC_CAPABILITY_PREFIX + codec for codec in available_codecs()]
+
+    def get_missing_blobs(self, digests):
+        """
+        Callback that is invoked when a client wants to know which of its files need to be uploaded
+
+        :param digests: Digests of the files the client wants to use in a robot run
+        :type digests: list
+
+        :return: Digests of the files that are not held in the blob store
+        :rtype: list
+        """
+        missing = self._blob_store.missing(digests)
+        logger.debug('%d of %d blobs are missing from the blob store', len(missing), len(digests))
+        return missing
+
+    def upload_blobs(self, blobs):
+        """
+        Callback that is invoked when a client uploads files into the blob store
+
+        :param blobs: Dictionary of digest to file contents
+        :type blobs: dict
+
+        :return: Number of blobs stored
+        :rtype: int
+        """
+        for digest, data in blobs.items():
+            self._blob_store.put(digest, data.data)
+        return len(blobs)
+
+    def store_blob_frames(self, stream, length=None):
+        """
+        Callback that is invoked when a client uploads files into the blob store over the binary transport
+
+        :param stream: Request body containing the files framed by rfremoterunner.transport.write_frames()
+        :type stream: file
+        :param length: Length of the request body, or None to read until the stream ends
+        :type length: int
+
+        :return: Number of blobs stored
+        :rtype: int
+        """
+        count = 0
+        size = 0
+        for digest, data in read_frames(stream, length):
+            self._blob_store.put(digest, data)
+            count += 1
+            size += len(data)
+        logger.debug('Stored %d blobs (%d bytes) received over the binary transport', count, size)
+        return count
+
+    def store_bundle(self, stream):
+        """
+        Callback that is invoked when a client uploads a bundle of files over the binary transport. The bundle is
+        extracted into a new workspace as it is read, ready for a run to be submitted with the bundle ID
+
+        :param stream: File-like object of the tar archive written by rfremoterunner.bundles.write_bundle()
+        :type stream: file
+
+        :return: ID of the bundle
+        :rtype: str
+        """
+        workspace_dir = tempfile.mkdtemp()
+        try:
+            count = extract_bundle(stream, workspace_dir)
+        except Exception:
+            shutil.rmtree(workspace_dir)
+            raise
+        bundle_id = uuid.uuid4().hex
+        with self._bundles_lock:
+            self._prune_expired_bundles()
+            self._bundles[bundle_id] = (workspace_dir, time.time())
+        logger.debug('Extracted bundle %s of %d files to: %s', bundle_id, count, workspace_dir)
+        return bundle_id
+
+    def _claim_bundle(self, bundle_id):
+        """
+        :param bundle_id: ID of a bundle returned by store_bundle()
+        :type bundle_id: str
+
+        :return: Path of the workspace the bundle was extracted into, which the caller is then responsible for
+        :rtype: str
+        """
+        with self._bundles_lock:
+            if bundle_id not in self._bundles:
+                raise KeyError('Unknown bundle: {}'.format(bundle_id))
+            return self._bundles.pop(bundle_id)[0]
+
+    def _release_bundle(self, bundle_id):
+        """
+        Delete the workspace of a bundle that no run will claim, if no run has claimed it already
+
+        :param bundle_id: ID of a bundle returned by store_bundle()
+        :type bundle_id: str
+        """
+        with self._bundles_lock:
+            workspace_dir, _ = self._bundles.pop(bundle_id, (None, None))
+        if workspace_dir:
+            logger.debug('Releasing bundle: %s', bundle_id)
+            shutil.rmtree(workspace_dir, ignore_errors=True)
+
+    def _prune_expired_bundles(self):
+        """
+        Delete the workspaces of bundles that no run was submitted with. Must be called with the bundles lock held
+        """
+        cutoff = time.time() - BUNDLE_RETENTION_SECONDS
+        for bundle_id, (workspace_dir, stored_time) in list(self._bundles.items()):
+            if stored_time < cutoff:
+                logger.debug('Discarding unclaimed bundle: %s', bundle_id)
+                del self._bundles[bundle_id]
+                shutil.rmtree(workspace_dir, ignore_errors=True)
+
+    def get_artifact_path(self, job_id, name):
+        """
+        Locate a test artifact of a finished job that is waiting to be downloaded
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param name: Name of the artifact: output_xml, log_html or report_html
+        :type name: str
+
+        :return: Path of the artifact on disk
+        :rtype: str
+        """
+        job = self._jobs.get(job_id)
+        if name not in ARTIFACT_FILENAMES:
+            raise ValueError('Unknown artifact: {}'.format(name))
+        return os.path.join(job.artifact_dir, ARTIFACT_FILENAMES[name])
+
+    def execute_manifest_run(self, manifest, robot_args, debug=False):
+        """
+        Callback that is invoked when a request to execute a robot run is made using files already uploaded to the blob
+        store
+
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param debug: Run in debug mode. This changes the logging level and does not cleanup the workspace
+        :type debug: bool
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        return self._execute_job_and_wait(
+            lambda job: self._execute_run(lambda: self._create_workspace_from_manifest(manifest),
+                                          robot_args,
+                                          debug,
+                                          job))
+
+    def submit_run(self, manifest, robot_args, options):
+        """
+        Callback that is invoked when a request to queue a robot run is made. Returns straight away with a job ID that
+        the client uses to poll for the status, console output and result of the run. The files in the manifest must
+        already have been uploaded to the blob store.
+
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param options: Dictionary of run options. Supports 'debug', 'chunked_artifacts', 'workspace', 'bundle' and
+        'priority'.
+        With 'chunked_artifacts' the result only contains the size of each test artifact, which the client then
+        downloads with read_artifact() before calling release_job(). 'workspace' is a dictionary containing the 'name'
+        of a persistent workspace, the 'base_revision' returned by get_workspace_state() and the 'deleted_paths' since
+        then, in which case the manifest only contains the files that have been added or changed. 'bundle' is the ID of
+        a bundle uploaded over the binary transport to run in, in which case the manifest is empty. 'priority' is the
+        lane to queue the run in: 'high', 'normal' (the default) or 'low'
+        :type options: dict
+
+        :return: ID of the queued job
+        :rtype: str
+
+        :raises xmlrpc_client.Fault: With QUEUE_FULL_FAULT_CODE if the queue is full
+        """
+        debug = options.get('debug', False)
+        keep_artifacts = options.get('chunked_artifacts', False)
+        workspace = options.get('workspace')
+        bundle_id = options.get('bundle')
+        cleanup = None
+        if workspace:
+            target = functools.partial(self._run_workspace_job, workspace, manifest, robot_args, debug, keep_artifacts)
+        elif bundle_id:
+            target = functools.partial(self._run_bundle_job, bundle_id, robot_args, debug, keep_artifacts)
+            cleanup = functools.partial(self._release_bundle, bundle_id)
+        else:
+            target = functools.partial(self._run_manifest_job, manifest, robot_args, debug, keep_artifacts)
+        # The console output is streamed with get_job_output() so is not held in memory for the result
+        try:
+            job = self._submit_job(target, options.get('priority', NORMAL_PRIORITY), cleanup)
+        except Exception:
+            # The run will never claim what is held for it
+            if cleanup:
+                cleanup()
+            raise
+        logger.debug('Queued job: %s', job.job_id)
+        return job.job_id
+
+    def _run_workspace_job(self, workspace, manifest, robot_args, debug, keep_artifacts, job):
+        """
+        Execute a queued run in a persistent workspace, once the changes in the manifest have been applied to it
+
+        :param workspace: Dictionary of the workspace 'name', 'base_revision' and 'deleted_paths', as passed to
+        submit_run()
+        :type workspace: dict
+        :param manifest: Dictionary of workspace relative file paths to blob digests of the added or changed files
+        :type manifest: dict
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param debug: Run in debug mode
+        :type debug: bool
+        :param keep_artifacts: Keep the test artifacts on disk for the client to download
+        :type keep_artifacts: bool
+        :param job: The job
+        :type job: rfremoterunner.jobs.Job
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        create_workspace = functools.partial(self._workspace_store.apply, workspace['name'],
+                                             workspace['base_revision'], manifest, workspace.get('deleted_paths', []),
+                                             self._blob_store)
+        with self._workspace_store.lock(workspace['name']):
+            return self._execute_run(create_workspace, robot_args, debug, job, include_console_output=False,
+                                     keep_artifacts=keep_artifacts, persistent_workspace=True)
+
+    def _run_bundle_job(self, bundle_id, robot_args, debug, keep_artifacts, job):
+        """
+        Execute a queued run in the workspace extracted from an uploaded bundle
+
+        :param bundle_id: ID of the bundle
+        :type bundle_id: str
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param debug: Run in debug mode
+        :type debug: bool
+        :param keep_artifacts: Keep the test artifacts on disk for the client to download
+        :type keep_artifacts: bool
+        :param job: The job
+        :type job: rfremoterunner.jobs.Job
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        return self._execute_run(functools.partial(self._claim_bundle, bundle_id), robot_args, debug, job,
+                                 include_console_output=False, keep_artifacts=keep_artifacts)
+
+    def _run_manifest_job(self, manifest, robot_args, debug, keep_artifacts, job):
+        """
+        Execute a queued run in a new workspace created from the files in the blob store
+
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param debug: Run in debug mode
+        :type debug: bool
+        :param keep_artifacts: Keep the test artifacts on disk for the client to download
+        :type keep_artifacts: bool
+        :param job: The job
+        :type job: rfremoterunner.jobs.Job
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        return self._execute_run(functools.partial(self._create_workspace_from_manifest, manifest), robot_args, debug,
+                                 job, include_console_output=False, keep_artifacts=keep_artifacts)
+
+    def _submit_job(self, target, priority=NORMAL_PRIORITY, cleanup=None):
+        """
+        Queue a robot run, rejecting it if the queue is full
+
+        :param target: Callable that is passed the job, executes the robot run and returns the result dictionary
+        :type target: callable
+        :param priority: Lane to queue the run in
+        :type priority: str
+        :param cleanup: Callable that frees what is held for the run if it is cancelled while queued
+        :type cleanup: callable
+
+        :return: The queued job
+        :rtype: rfremoterunner.jobs.Job
+
+        :raises xmlrpc_client.Fault: With QUEUE_FULL_FAULT_CODE if the queue is full, so that the client can tell it
+        apart from a failure and retry
+        """
+        try:
+            return self._jobs.submit(target, priority, cleanup)
+        except QueueFullError as err:
+            self._metrics.runs_rejected.inc()
+            logger.info('Rejected a run: %s', err)
+            raise xmlrpc_client.Fault(QUEUE_FULL_FAULT_CODE, str(err))
+
+    def get_job_status(self, job_id):
+        """
+        Callback that is invoked when a client polls for the status of a job
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: Dictionary containing the job ID, its state, any error and the number of runs ahead of it while it is
+        queued
+        :rtype: dict
+        """
+        job = self._jobs.get(job_id)
+        status = job.get_status()
+        queue_position = self._jobs.get_queue_position(job)
+        if queue_position is not None:
+            status['queue_position'] = queue_position
+        return status
+
+    def get_job_result(self, job_id):
+        """
+        Callback that is invoked when a client collects the result of a finished job. The job is forgotten once its
+        result has been collected, unless its test artifacts are still to be downloaded with read_artifact().
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        job = self._jobs.get(job_id)
+        if not job.is_done():
+            raise RuntimeError('Job {} has not finished'.format(job_id))
+        # A job cancelled after its run returned has no result
+        if job.state == CANCELLED or job.error is not None or 'artifact_sizes' not in job.result:
+            self._jobs.remove(job_id)
+        if job.state == CANCELLED:
+            raise RuntimeError('Job {} was cancelled'.format(job_id))
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def get_job_output(self, job_id, offset):
+        """
+        Callback that is invoked when a client polls for the robot stdout/stderr of a job. The output is read from the
+        job's console file a chunk at a time so that it never has to be held in memory in full.
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param offset: Byte offset into the output to read from
+        :type offset: int
+
+        :return: Dictionary containing the next chunk of output and the offset to read from next
+        :rtype: dict
+        """
+        job = self._jobs.get(job_id)
+        data = b''
+        if os.path.exists(job.console_path):
+            with open(job.console_path, 'rb') as file_handle:
+                file_handle.seek(offset)
+                data = file_handle.read(MAX_OUTPUT_CHUNK_BYTES)
+        return {'data': xmlrpc_client.Binary(data), 'offset': offset + len(data)}
+
+    def get_workspace_state(self, name):
+        """
+        Callback that is invoked when a client wants to know which files a persistent workspace holds, so that it can
+        send just the changes in its next submit_run()
+
+        :param name: Name of the workspace
+        :type name: str
+
+        :return: Dictionary containing the 'revision' of the workspace and its 'manifest' of workspace relative file
+        paths to blob digests
+        :rtype: dict
+        """
+        with self._workspace_store.lock(name):
+            manifest = self._workspace_store.get_manifest(name)
+        return {'revision': calculate_revision(manifest), 'manifest': manifest}
+
+    def read_artifact(self, job_id, name, offset):
+        """
+        Callback that is invoked when a client downloads a test artifact of a finished job. The artifact is read from
+        disk a chunk at a time so that it never has to be held in memory in full.
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param name: Name of the artifact: output_xml, log_html or report_html
+        :type name: str
+        :param offset: Byte offset into the artifact to read from
+        :type offset: int
+
+        :return: Dictionary containing the next chunk of the artifact and the offset to read from next
+        :rtype: dict
+        """
+        with open(self.get_artifact_path(job_id, name), 'rb') as file_handle:
+            file_handle.seek(offset)
+            data = file_handle.read(MAX_ARTIFACT_CHUNK_BYTES)
+        return {'data': xmlrpc_client.Binary(data), 'offset': offset + len(data)}
+
+    def release_job(self, job_id):
+        """
+        Callback that is invoked when a client has finished downloading the test artifacts of a job. The job and its
+        files are forgotten.
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: True
+        :rtype: bool
+        """
+        self._jobs.remove(job_id)
+        return True
+
+    def cancel_job(self, job_id):
+        """
+        Callback that is invoked when a client no longer wants the result of a job. A queued job is dropped and a
+        running job is stopped: a worker process is terminated, a run inside the agent process stops before its next
+        keyword. Its workspace is cleaned up and the job is forgotten once it has stopped.
+
+        :param job_id: ID of the job
+        :type job_id: str
+
+        :return: Dictionary containing the job ID, its state and any error
+        :rtype: dict
+        """
+        job = self._jobs.get(job_id)
+        logger.debug('Cancelling job: %s', job_id)
+        # Also frees the job's place in the queue if it was still queued
+        self._jobs.cancel(job_id)
+        # Returns straight away for a job that was still queued
+        if job.wait(CANCEL_TIMEOUT_SECONDS):
+            self._jobs.remove(job_id)
+        return job.get_status()
+
+    def execute_robot_run(self, test_suites, dependencies, robot_args, debug=False):
         """
         Callback that is invoked when a request to execute a robot run is made
 
@@ -64,61 +671,157 @@ class RobotFrameworkServer:
         :return: Dictionary containing test results and artifacts
         :rtype: dict
         """
+        return self._execute_job_and_wait(
+            lambda job: self._execute_run(lambda: RobotFrameworkServer._create_workspace(test_suites, dependencies),
+                                          robot_args,
+                                          debug,
+                                          job))
+
+    def _execute_job_and_wait(self, target):
+        """
+        Queue a robot run behind any other jobs and block until it has executed
+
+        :param target: Callable that executes the robot run and returns the result dictionary
+        :type target: callable
+
+        :return: Dictionary containing test results and artifacts
+        :rtype: dict
+        """
+        job = self._submit_job(target)
+        job.wait()
+        self._jobs.remove(job.job_id)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _execute_run(self, create_workspace, robot_args, debug, job, include_console_output=True,
+                     keep_artifacts=False, persistent_workspace=False):
+        """
+        Create a workspace, execute the robot run inside it and collect the test artifacts
+
+        :param create_workspace: Callable that creates the workspace and returns its path
+        :type create_workspace: callable
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param debug: Run in debug mode. This changes the logging level and does not cleanup the workspace
+        :type debug: bool
+        :param job: Job the run is executed as
+        :type job: rfremoterunner.jobs.Job
+        :param include_console_output: Whether to return the robot stdout/stderr in the result
+        :type include_console_output: bool
+        :param keep_artifacts: Move the test artifacts into the job's artifact directory to be downloaded with
+        read_artifact(), rather than returning them in the result
+        :type keep_artifacts: bool
+        :param persistent_workspace: Whether the workspace is kept for future runs. The test artifacts are then written
+        to a separate directory and only that is deleted after the run
+        :type persistent_workspace: bool
+
+        :return: Dictionary containing test results and artifacts, and the 'timings' of each phase of the run
+        :rtype: dict
+        """
         workspace_dir = None
-        std_out_err = None
-        old_cwd = None
+        output_dir = None
+        timings = PhaseTimings()
+        timings.record('queue', job.started_time - job.submitted_time)
         try:
             old_log_level = logger.level
             if debug:
                 logger.setLevel(logging.DEBUG)
 
             # Save all suites & dependencies to disk
-            workspace_dir = RobotFrameworkServer._create_workspace(test_suites, dependencies)
-
-            # Change the CWD to the workspace
-            old_cwd = os.getcwd()
-            os.chdir(workspace_dir)
-            sys.path.append(workspace_dir)
+            with timings.phase('workspace'):
+                workspace_dir = create_workspace()
+            # Keep the test artifacts out of a persistent workspace so that they aren't left behind for the next run
+            output_dir = tempfile.mkdtemp() if persistent_workspace else workspace_dir
 
             # Execute the robot run
-            std_out_err = StringIO()
             logger.debug('Beginning Robot Run.')
             logger.debug('Robot Run Args: %s', str(robot_args))
-            ret_code = run('.',
-                           stdout=std_out_err,
-                           stderr=std_out_err,
-                           outputdir=workspace_dir,
-                           name='Root',
-                           **robot_args)
+            with timings.phase('robot'):
+                if self._workers:
+                    ret_code = self._run_robot_in_worker(workspace_dir, robot_args, job, output_dir)
+                else:
+                    job.set_cancel_handler(stop_robot_run)
+                    try:
+                        ret_code = run_robot(workspace_dir, robot_args, job.console_path, output_dir)
+                    finally:
+                        job.set_cancel_handler(None)
+                        clear_robot_stop_request()
             logger.debug('Robot Run finished')
 
-            # Read the test artifacts from disk
-            output_xml, log_html, report_html = RobotFrameworkServer._read_robot_artifacts_from_disk(workspace_dir)
-
-            ret_val = {'std_out_err': xmlrpc_client.Binary(std_out_err.getvalue().encode('utf-8')),
-                       'output_xml': xmlrpc_client.Binary(output_xml.encode('utf-8')),
-                       'log_html': xmlrpc_client.Binary(log_html.encode('utf-8')),
-                       'report_html': xmlrpc_client.Binary(report_html.encode('utf-8')),
-                       'ret_code': ret_code}
+            with timings.phase('artifacts'):
+                if keep_artifacts:
+                    artifact_sizes = RobotFrameworkServer._move_robot_artifacts(output_dir, job.artifact_dir)
+                    ret_val = {'artifact_sizes': artifact_sizes, 'ret_code': ret_code}
+                    timings.add_bytes('artifacts', sum(artifact_sizes.values()))
+                else:
+                    # Read the test artifacts from disk
+                    artifacts = [artifact.encode('utf-8') for artifact in
+                                 RobotFrameworkServer._read_robot_artifacts_from_disk(output_dir)]
+                    ret_val = {'output_xml': xmlrpc_client.Binary(artifacts[0]),
+                               'log_html': xmlrpc_client.Binary(artifacts[1]),
+                               'report_html': xmlrpc_client.Binary(artifacts[2]),
+                               'ret_code': ret_code}
+                    timings.add_bytes('artifacts', sum(len(artifact) for artifact in artifacts))
+            ret_val['timings'] = timings.as_dict()
+            if include_console_output:
+                std_out_err = read_file_from_disk(job.console_path)
+                ret_val['std_out_err'] = xmlrpc_client.Binary(std_out_err.encode('utf-8'))
         except Exception as err:
             # Log here because the RPC framework doesn't give the client a full stacktrace
             logging.error(err)
             raise
         finally:
-            if old_cwd:
-                os.chdir(old_cwd)
-
-            if std_out_err:
-                std_out_err.close()
-
-            if workspace_dir and not debug:
-                shutil.rmtree(workspace_dir)
+            if not debug:
+                # A persistent workspace is kept for the next run, only its separate output directory is deleted
+                if persistent_workspace and output_dir:
+                    shutil.rmtree(output_dir)
+                elif not persistent_workspace and workspace_dir:
+                    shutil.rmtree(workspace_dir)
 
         logger.debug('End of RPC function')
         # Revert the logger back to its original level
         logger.setLevel(old_log_level)
         return ret_val
 
+    def _run_robot_in_worker(self, workspace_dir, robot_args, job, output_dir=None):
+        """
+        Execute the robot run in a new worker process so that it gets its own CWD and PYTHONPATH. Cancelling the job
+        kills the worker process.
+
+        :param workspace_dir: Directory containing the test suites & dependencies
+        :type workspace_dir: str
+        :param robot_args: Dictionary of arguments to pass to robot.run()
+        :type robot_args: dict
+        :param job: Job the run is executed as
+        :type job: rfremoterunner.jobs.Job
+        :param output_dir: Directory to write the test artifacts to. Defaults to the workspace directory
+        :type output_dir: str
+
+        :return: Robot return code
+        :rtype: int
+        """
+        reader, writer = self._worker_context.Pipe(duplex=False)
+        worker = self._worker_context.Process(target=robot_worker_main,
+                                         args=(workspace_dir, robot_args, job.console_path, output_dir, writer))
+        worker.start()
+        logger.debug('Started worker process %s for workspace: %s', worker.pid, workspace_dir)
+        job.set_cancel_handler(worker.terminate)
+        # Close the parent's copy of the write end so that recv() fails if the worker dies without replying
+        writer.close()
+        try:
+            result, error = reader.recv()
+        except EOFError:
+            result, error = None, 'Worker process exited unexpectedly'
+        finally:
+            job.set_cancel_handler(None)
+            reader.close()
+            worker.join()
+
+        if error:
+            raise RuntimeError('Robot worker process {} failed. {}'.format(worker.pid, error))
+        return result
+
     @staticmethod
     def _create_workspace(test_suites, dependencies):
         """
@@ -150,6 +853,58 @@ class RobotFrameworkServer:
 
         return workspace_dir
 
+    def _create_workspace_from_manifest(self, manifest):
+        """
+        Create a directory in the temporary directory and copy every file listed in the manifest into it from the blob
+        store
+
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+
+        :return: An absolute path to the directory created
+        :rtype: str
+        """
+        workspace_dir = tempfile.mkdtemp()
+        logger.debug('Created workspace at: %s', workspace_dir)
+
+        try:
+            for rel_path, digest in manifest.items():
+                full_path = resolve_workspace_path(workspace_dir, rel_path)
+                full_dir = os.path.dirname(full_path)
+                if not os.path.exists(full_dir):
+                    os.makedirs(full_dir)
+                logger.debug('Copying blob %s to: %s', digest, full_path)
+                self._blob_store.copy_to(digest, full_path)
+        except Exception:
+            shutil.rmtree(workspace_dir)
+            raise
+
+        return workspace_dir
+
+    @staticmethod
+    def _move_robot_artifacts(workspace_dir, artifact_dir):
+        """
+        Move the output xml, log html and report html files generated by robot out of the workspace so that they can be
+        downloaded after the workspace has been deleted
+
+        :param workspace_dir: Directory containing the test artifacts
+        :type workspace_dir: str
+        :param artifact_dir: Directory to move the test artifacts to
+        :type artifact_dir: str
+
+        :return: Dictionary of the name of each artifact that was generated to its size in bytes
+        :rtype: dict
+        """
+        os.makedirs(artifact_dir)
+        artifact_sizes = {}
+        for name, filename in ARTIFACT_FILENAMES.items():
+            artifact_path = os.path.join(workspace_dir, filename)
+            if os.path.exists(artifact_path):
+                logger.debug('Moving %s to: %s', artifact_path, artifact_dir)
+                shutil.move(artifact_path, os.path.join(artifact_dir, filename))
+                artifact_sizes[name] = os.path.getsize(os.path.join(artifact_dir, filename))
+        return artifact_sizes
+
     @staticmethod
     def _read_robot_artifacts_from_disk(workspace_dir):
         """
@@ -0,0 +1,114 @@
+import io
+import json
+import logging
+import os
+from robot.api import ExecutionResult
+
+from rfremoterunner.utils import collect_test_suites
+
+logger = logging.getLogger(__file__)
+
+# Name of the root suite that the agent executes the run under
+REMOTE_ROOT_SUITE_NAME = 'Root'
+# Seconds assumed per test case when there's no history to base an estimate on
+DEFAULT_TEST_DURATION = 1.0
+
+
+class TimingHistory:
+
+    def __init__(self, path):
+        """
+        Constructor for TimingHistory. The history records how long each test suite took to execute in previous runs
+        so that future runs can be balanced across agents. It is kept on disk as JSON.
+
+        :param path: Path of the JSON file to load the history from and save it to
+        :type path: str
+        """
+        self._path = path
+        self._timings = {}
+        if os.path.exists(path):
+            try:
+                with io.open(path, 'r', encoding='utf-8') as file_handle:
+                    self._timings = json.load(file_handle)
+            except ValueError:
+                logger.warning('Ignoring invalid timing history: %s', path)
+        logger.debug('Loaded timings for %d suites from: %s', len(self._timings), path)
+
+    def record_output_xml(self, output_xml_path):
+        """
+        Harvest the suite timings from an output xml written by a previous run
+
+        :param output_xml_path: Path to the output xml
+        :type output_xml_path: str
+        """
+        try:
+            result = ExecutionResult(output_xml_path)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning('Unable to read timings from %s: %s', output_xml_path, err)
+            return
+        self.record_result(result)
+
+    def record_result(self, result):
+        """
+        Record the execution time of each suite containing test cases in a result returned by an agent
+
+        :param result: Result of the run
+        :type result: robot.result.Result
+        """
+        for suite in collect_test_suites(result.suite):
+            self._timings[self._get_local_longname(suite.longname)] = {
+                'elapsed': suite.elapsedtime / 1000.0,
+                'tests': len(suite.tests)
+            }
+
+    def estimate(self, suite):
+        """
+        Estimate how long a test suite will take to execute. Suites without any history are weighted by the number of
+        test cases they contain, using the average test case duration from the history
+
+        :param suite: Test suite containing test cases
+        :type suite: robot.running.model.TestSuite
+
+        :return: Estimated duration in seconds
+        :rtype: float
+        """
+        timing = self._timings.get(suite.longname)
+        if timing:
+            return timing['elapsed']
+        return len(suite.tests) * self._get_average_test_duration()
+
+    def save(self):
+        """
+        Write the history to disk
+        """
+        data = json.dumps(self._timings, indent=2, sort_keys=True)
+        with io.open(self._path, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(data if isinstance(data, type(u'')) else data.decode('utf-8'))
+        logger.debug('Saved timings for %d suites to: %s', len(self._timings), self._path)
+
+    def _get_average_test_duration(self):
+        """
+        :return: Average duration of a test case in seconds across all of the suites in the history
+        :rtype: float
+        """
+        total_tests = sum(timing['tests'] for timing in self._timings.values())
+        if not total_tests:
+            return DEFAULT_TEST_DURATION
+        return sum(timing['elapsed'] for timing in self._timings.values()) / total_tests
+
+    @staticmethod
+    def _get_local_longname(remote_longname):
+        """
+        The agent nests the suite tree under a root suite of its own. Strip it so that the name matches the suite built
+        on this machine
+
+        :param remote_longname: Long name of the suite in the agent's result
+        :type remote_longname: str
+
+        :return: Long name of the suite in the local suite tree
+        :rtype: str
+        """
+        prefix = REMOTE_ROOT_SUITE_NAME + '.'
+        if remote_longname.startswith(prefix):
+            return remote_longname[len(prefix):]
+        return remote_longname
@@ -0,0 +1,449 @@
+import logging
+import struct
+import six.moves.http_client as http_client
+import six.moves.xmlrpc_client as xmlrpc_client
+import six
+from six.moves.urllib.parse import urlparse
+
+from rfremoterunner.compression import available_codecs, negotiate_codec, get_codec, DECOMPRESSION_ERRORS, \
+    CODEC_CAPABILITY_PREFIX
+
+logger = logging.getLogger(__file__)
+
+# HTTP paths of the binary transport on the agent's port
+BLOBS_PATH = '/blobs'
+BUNDLES_PATH = '/bundles'
+ARTIFACTS_PATH = '/artifacts'
+# Each uploaded file is framed by its hex digest and its size
+FRAME_HEADER = struct.Struct('>64sQ')
+# Amount of a response read into memory at a time when it is streamed to disk. Compressed responses are read in
+# smaller chunks as each one expands many times over when it is decompressed
+STREAM_CHUNK_BYTES = 1024 * 1024
+COMPRESSED_CHUNK_BYTES = 64 * 1024
+
+
+class TransportError(Exception):
+    """
+    Raised when the agent rejects a request made over the binary transport
+    """
+
+
+def write_frames(blobs, write):
+    """
+    Write files as a sequence of frames, each made up of the file's digest, its size and its contents
+
+    :param blobs: Dictionary of digest to file contents
+    :type blobs: dict
+    :param write: Callable that is passed each piece of the body in turn
+    :type write: callable
+    """
+    for digest, data in blobs.items():
+        write(FRAME_HEADER.pack(digest.encode('ascii'), len(data)))
+        write(data)
+
+
+def calculate_frames_size(blobs):
+    """
+    :param blobs: Dictionary of digest to file contents
+    :type blobs: dict
+
+    :return: Size in bytes of the files once framed by write_frames()
+    :rtype: int
+    """
+    return sum(FRAME_HEADER.size + len(data) for data in blobs.values())
+
+
+def read_frames(stream, length=None):
+    """
+    Read the files framed by write_frames() from a stream, one at a time
+
+    :param stream: File-like object to read from
+    :type stream: file
+    :param length: Number of bytes of frames in the stream, or None to read frames until the stream ends
+    :type length: int
+
+    :return: Generator of (digest, file contents)
+    :rtype: generator
+    """
+    remaining = length
+    while remaining is None or remaining > 0:
+        header = stream.read(FRAME_HEADER.size)
+        if not header and remaining is None:
+            return
+        header += _read_exactly(stream, FRAME_HEADER.size - len(header))
+        digest, size = FRAME_HEADER.unpack(header)
+        if remaining is not None:
+            remaining -= FRAME_HEADER.size
+            if size > remaining:
+                raise ValueError('Frame of {} bytes overruns the request body'.format(size))
+            remaining -= size
+        yield digest.decode('ascii'), _read_exactly(stream, size)
+
+
+def _read_exactly(stream, size):
+    """
+    :param stream: File-like object to read from
+    :type stream: file
+    :param size: Number of bytes to read
+    :type size: int
+
+    :return: The bytes read
+    :rtype: bytes
+    """
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError('Request body ended part way through a frame')
+        data += chunk
+    return data
+
+
+class ChunkedWriter:
+
+    def __init__(self, conn, compressor=None):
+        """
+        Constructor for ChunkedWriter. File-like object that sends whatever is written to it as the chunked body of an
+        HTTP request, so a body can be sent while it is being generated without knowing its size up front
+
+        :param conn: Connection the request headers have been sent on
+        :type conn: http_client.HTTPConnection
+        :param compressor: Compressor from rfremoterunner.compression to compress the body with
+        :type compressor: object
+        """
+        self._conn = conn
+        self._compressor = compressor
+        self._buffer = []
+        self._buffer_size = 0
+        self.sent = 0
+
+    def write(self, data):
+        """
+        :param data: Next piece of the body
+        :type data: bytes
+        """
+        if self._compressor:
+            data = self._compressor.compress(data)
+        if data:
+            self._buffer.append(data)
+            self._buffer_size += len(data)
+        if self._buffer_size >= COMPRESSED_CHUNK_BYTES:
+            self._send_chunk()
+
+    def close(self):
+        """
+        Send the rest of the body and the chunk that marks its end
+        """
+        if self._compressor:
+            self._buffer.append(self._compressor.flush())
+        self._send_chunk()
+        self._conn.send(b'0\r\n\r\n')
+
+    def _send_chunk(self):
+        """
+        Send the buffered data as a chunk
+        """
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        if data:
+            self._conn.send('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            self.sent += len(data)
+
+
+class LimitedReader:
+
+    def __init__(self, stream, length):
+        """
+        Constructor for LimitedReader. File-like object that reads the body of an HTTP request sent with a
+        Content-Length, and ends at the end of the body rather than waiting on the connection
+
+        :param stream: Stream positioned at the start of the body
+        :type stream: file
+        :param length: Length of the body
+        :type length: int
+        """
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, size=-1):
+        """
+        :param size: Maximum number of bytes to read. Reads to the end of the body if negative
+        :type size: int
+
+        :return: The bytes read, or empty at the end of the body
+        :rtype: bytes
+        """
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size) if size else b''
+        self._remaining -= len(data)
+        return data
+
+
+class ChunkedReader:
+
+    def __init__(self, stream):
+        """
+        Constructor for ChunkedReader. File-like object that reads the body of an HTTP request sent with chunked
+        transfer encoding
+
+        :param stream: Stream positioned at the start of the body
+        :type stream: file
+        """
+        self._stream = stream
+        self._chunk_remaining = 0
+        self._chunk_count = 0
+        self._finished = False
+        self.received = 0
+
+    def read(self, size=-1):
+        """
+        :param size: Maximum number of bytes to read. Reads to the end of the body if negative
+        :type size: int
+
+        :return: The bytes read, which is fewer than requested at the end of a chunk, or empty at the end of the body
+        :rtype: bytes
+        """
+        if self._chunk_remaining == 0 and not self._finished:
+            self._start_chunk()
+        if self._finished:
+            return b''
+        if size < 0:
+            data = []
+            while not self._finished:
+                data.append(_read_exactly(self._stream, self._chunk_remaining))
+                self._chunk_remaining = 0
+                self._start_chunk()
+            return b''.join(data)
+        data = _read_exactly(self._stream, min(size, self._chunk_remaining))
+        self._chunk_remaining -= len(data)
+        return data
+
+    def _start_chunk(self):
+        """
+        Read the line ending of the previous chunk and the line that starts the next chunk
+        """
+        if self._chunk_count:
+            _read_exactly(self._stream, 2)
+        line = self._stream.readline(1024)
+        try:
+            self._chunk_remaining = int(line.split(b';')[0].strip(), 16)
+        except ValueError as err:
+            six.raise_from(ValueError('Invalid chunk size: {!r}'.format(line)), err)
+        self._chunk_count += 1
+        self.received += len(line) + self._chunk_remaining
+        if self._chunk_remaining == 0:
+            # Skip any trailers and the empty line that end the body
+            while self._stream.readline(1024).strip():
+                pass
+            self._finished = True
+
+
+class XmlRpcTransport:
+
+    def __init__(self, proxy):
+        """
+        Constructor for XmlRpcTransport. Sends files to and fetches test artifacts from the agent as base64 encoded
+        XML-RPC values. Supported by every agent that supports content addressed upload.
+
+        :param proxy: XML-RPC proxy of the agent
+        :type proxy: xmlrpc_client.ServerProxy
+        """
+        self._proxy = proxy
+
+    def upload_blobs(self, blobs):
+        """
+        Upload files into the agent's blob store
+
+        :param blobs: Dictionary of digest to file contents
+        :type blobs: dict
+
+        :return: Number of bytes of file contents sent
+        :rtype: int
+        """
+        self._proxy.upload_blobs(dict((digest, xmlrpc_client.Binary(data)) for digest, data in blobs.items()))
+        return sum(len(data) for data in blobs.values())
+
+    def download_artifact(self, job_id, name, file_handle):
+        """
+        Download a test artifact of a finished job a chunk at a time, writing each chunk straight to a file
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param name: Name of the artifact: output_xml, log_html or report_html
+        :type name: str
+        :param file_handle: File opened for writing in binary mode
+        :type file_handle: file
+
+        :return: Number of bytes downloaded
+        :rtype: int
+        """
+        offset = 0
+        while True:
+            chunk = self._proxy.read_artifact(job_id, name, offset)
+            if chunk['offset'] == offset:
+                return offset
+            file_handle.write(chunk['data'].data)
+            offset = chunk['offset']
+
+
+class BinaryTransport:
+
+    def __init__(self, address, codec=None):
+        """
+        Constructor for BinaryTransport. Sends files to and fetches test artifacts from the agent as raw bytes over
+        plain HTTP requests to the agent's port, avoiding the size and CPU cost of encoding them as XML-RPC
+
+        :param address: Normalised address of the agent, e.g. http://host:1471
+        :type address: str
+        :param codec: Name of the codec to compress the uploads and downloads with. Sent uncompressed if None
+        :type codec: str
+        """
+        parsed = urlparse(address)
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._codec = codec
+
+    def upload_blobs(self, blobs):
+        """
+        Upload files into the agent's blob store as a single request body of frames
+
+        :param blobs: Dictionary of digest to file contents
+        :type blobs: dict
+
+        :return: Number of bytes sent
+        :rtype: int
+        """
+        conn = http_client.HTTPConnection(self._host, self._port)
+        try:
+            conn.putrequest('POST', BLOBS_PATH)
+            conn.putheader('Content-Type', 'application/octet-stream')
+            if self._codec:
+                # Compressed into memory first as the size has to be sent ahead of the body. The batches are bounded
+                compressor = get_codec(self._codec).compressor()
+                pieces = []
+                write_frames(blobs, lambda data: pieces.append(compressor.compress(data)))
+                pieces.append(compressor.flush())
+                body = b''.join(pieces)
+                conn.putheader('Content-Encoding', self._codec)
+                conn.putheader('Content-Length', str(len(body)))
+                conn.endheaders()
+                conn.send(body)
+                sent = len(body)
+            else:
+                sent = calculate_frames_size(blobs)
+                conn.putheader('Content-Length', str(sent))
+                conn.endheaders()
+                write_frames(blobs, conn.send)
+            BinaryTransport._check_response(conn.getresponse()).read()
+        finally:
+            conn.close()
+        return sent
+
+    def upload_bundle(self, write_bundle, encoding=None):
+        """
+        Stream a bundle of files to the agent as the body of a single request, sent while it is being generated. The
+        agent extracts it into the workspace of the run that is submitted with the bundle ID.
+
+        :param write_bundle: Callable that is passed a file-like object to write the bundle to
+        :type write_bundle: callable
+        :param encoding: Name of the codec the bundle written is already compressed with, in which case it is sent as
+        it is. Otherwise it is compressed with the transport's codec
+        :type encoding: str
+
+        :return: ID of the bundle on the agent, and the number of bytes sent
+        :rtype: tuple
+        """
+        conn = http_client.HTTPConnection(self._host, self._port)
+        try:
+            conn.putrequest('POST', BUNDLES_PATH)
+            conn.putheader('Content-Type', 'application/x-tar')
+            conn.putheader('Transfer-Encoding', 'chunked')
+            if encoding or self._codec:
+                conn.putheader('Content-Encoding', encoding or self._codec)
+            conn.endheaders()
+            compress = self._codec and not encoding
+            writer = ChunkedWriter(conn, get_codec(self._codec).compressor() if compress else None)
+            write_bundle(writer)
+            writer.close()
+            bundle_id = BinaryTransport._check_response(conn.getresponse()).read().decode('ascii')
+        finally:
+            conn.close()
+        return bundle_id, writer.sent
+
+    def download_artifact(self, job_id, name, file_handle):
+        """
+        Download a test artifact of a finished job in a single response, writing it straight to a file a chunk at a
+        time
+
+        :param job_id: ID of the job
+        :type job_id: str
+        :param name: Name of the artifact: output_xml, log_html or report_html
+        :type name: str
+        :param file_handle: File opened for writing in binary mode
+        :type file_handle: file
+
+        :return: Number of bytes received, which is less than the size of the artifact if it was compressed
+        :rtype: int
+        """
+        conn = http_client.HTTPConnection(self._host, self._port)
+        try:
+            headers = {'Accept-Encoding': self._codec} if self._codec else {}
+            conn.request('GET', '{}/{}/{}'.format(ARTIFACTS_PATH, job_id, name), headers=headers)
+            response = BinaryTransport._check_response(conn.getresponse())
+            encoding = response.getheader('Content-Encoding')
+            decompressor = get_codec(encoding).decompressor() if encoding else None
+            received = 0
+            while True:
+                chunk = response.read(COMPRESSED_CHUNK_BYTES if decompressor else STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                received += len(chunk)
+                try:
+                    file_handle.write(decompressor.decompress(chunk) if decompressor else chunk)
+                except DECOMPRESSION_ERRORS as err:
+                    six.raise_from(TransportError('Invalid {} data in {}: {}'.format(encoding, name, err)), err)
+            if decompressor:
+                file_handle.write(decompressor.flush())
+            return received
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _check_response(response):
+        """
+        :param response: Response from the agent
+        :type response: http_client.HTTPResponse
+
+        :return: The response, if the request succeeded
+        :rtype: http_client.HTTPResponse
+        """
+        if response.status != 200:
+            raise TransportError('Agent responded {} {}: {}'.format(response.status, response.reason,
+                                                                     response.read().decode('utf-8', 'replace')))
+        return response
+
+
+def create_transport(address, proxy, capabilities):
+    """
+    Choose the most efficient transport for file contents that the agent supports, compressed with the fastest codec
+    that both machines support
+
+    :param address: Normalised address of the agent
+    :type address: str
+    :param proxy: XML-RPC proxy of the agent
+    :type proxy: xmlrpc_client.ServerProxy
+    :param capabilities: Capabilities the agent advertised
+    :type capabilities: list
+
+    :return: The transport
+    :rtype: BinaryTransport | XmlRpcTransport
+    """
+    if 'binary_transport' in capabilities:
+        agent_codecs = [capability[len(CODEC_CAPABILITY_PREFIX):] for capability in capabilities
+                        if capability.startswith(CODEC_CAPABILITY_PREFIX)]
+        codec = negotiate_codec(agent_codecs, available_codecs())
+        logger.debug('Using the binary transport, compression: %s', codec or 'none')
+        return BinaryTransport(address, codec)
+    return XmlRpcTransport(proxy)
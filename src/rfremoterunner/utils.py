@@ -1,4 +1,5 @@
 from io import open
+import hashlib
 import os
 import re
 import six
@@ -87,3 +88,55 @@ def calculate_ts_parent_path(suite):
 
     # Stick with unix style slashes for consistency
     return os.path.join(*reversed(family_tree)).replace('\\', '/')
+
+
+def calculate_digest(data):
+    """
+    Calculate the content digest used to address a file in the agent's blob store
+
+    :param data: File contents
+    :type data: bytes | str | unicode
+
+    :return: Hex encoded SHA-256 digest of the data
+    :rtype: str
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def resolve_workspace_path(workspace_dir, rel_path):
+    """
+    Join a relative path sent by the client onto the workspace directory, making sure that it cannot escape the
+    workspace (e.g. an absolute path or one containing '..')
+
+    :param workspace_dir: Workspace directory
+    :type workspace_dir: str
+    :param rel_path: Path relative to the root of the workspace, using unix style slashes
+    :type rel_path: str
+
+    :return: Absolute path inside the workspace
+    :rtype: str
+    """
+    workspace_dir = os.path.abspath(workspace_dir)
+    full_path = os.path.normpath(os.path.join(workspace_dir, *rel_path.split('/')))
+    if os.path.isabs(rel_path) or not full_path.startswith(workspace_dir + os.sep):
+        raise ValueError('Path is outside of the workspace: {}'.format(rel_path))
+    return full_path
+
+
+def collect_test_suites(suite):
+    """
+    Walks a test suite's family tree and collects the suites that contain test cases. Suites without test cases are
+    likely directories
+
+    :param suite: Root of the suite tree
+    :type suite: robot.running.model.TestSuite
+
+    :return: Suites containing test cases, in the order robot would execute them
+    :rtype: list
+    """
+    suites = [suite] if suite.tests else []
+    for sub_suite in suite.suites:
+        suites.extend(collect_test_suites(sub_suite))
+    return suites
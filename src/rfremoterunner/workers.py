@@ -0,0 +1,194 @@
+import importlib
+from io import open
+import linecache
+import logging
+import multiprocessing
+import os
+import sys
+from robot.run import run
+from robot.running.signalhandler import STOP_SIGNAL_MONITOR
+
+logger = logging.getLogger(__file__)
+
+# Modules the fork server that worker processes are started from always imports. Importing this module also imports
+# robot, and importing __main__ stops each worker from running the agent's script again
+WORKER_PRELOAD_MODULES = ['__main__', 'rfremoterunner.workers']
+
+
+def run_robot(workspace_dir, robot_args, console_path, output_dir=None):
+    """
+    Execute a robot run against a workspace. The CWD and PYTHONPATH of the process are changed for the duration of the
+    run, so this must not be called concurrently within the same process. Afterwards the process is restored to the
+    state it was in before the run, so that a long-running agent doesn't grow with every run or reuse test libraries
+    from a previous run.
+
+    :param workspace_dir: Directory containing the test suites & dependencies
+    :type workspace_dir: str
+    :param robot_args: Dictionary of arguments to pass to robot.run()
+    :type robot_args: dict
+    :param console_path: File to write the robot stdout/stderr to as the run progresses
+    :type console_path: str
+    :param output_dir: Directory to write the test artifacts to. Defaults to the workspace directory
+    :type output_dir: str
+
+    :return: Robot return code
+    :rtype: int
+    """
+    old_cwd = os.getcwd()
+    old_sys_path = list(sys.path)
+    old_modules = dict(sys.modules)
+    # Line buffered so that the output can be streamed to the client while the run is in progress
+    with open(console_path, 'w', encoding='utf-8', buffering=1) as std_out_err:
+        try:
+            # Change the CWD to the workspace
+            os.chdir(workspace_dir)
+            sys.path.append(workspace_dir)
+
+            return run('.',
+                       stdout=std_out_err,
+                       stderr=std_out_err,
+                       outputdir=output_dir or workspace_dir,
+                       name='Root',
+                       **robot_args)
+        finally:
+            os.chdir(old_cwd)
+            _restore_interpreter_state(workspace_dir, old_sys_path, old_modules)
+
+
+def _restore_interpreter_state(workspace_dir, old_sys_path, old_modules):
+    """
+    Undo the changes a robot run made to the interpreter that refer to its workspace. Modules imported from anywhere
+    else, such as installed test libraries, are kept so that the next run doesn't have to import them again.
+
+    :param workspace_dir: Directory containing the test suites & dependencies of the run
+    :type workspace_dir: str
+    :param old_sys_path: Copy of sys.path from before the run
+    :type old_sys_path: list
+    :param old_modules: Copy of sys.modules from before the run
+    :type old_modules: dict
+    """
+    sys.path[:] = old_sys_path
+    workspace_prefix = os.path.join(os.path.abspath(workspace_dir), '')
+    for name, module in list(sys.modules.items()):
+        if _is_module_in_dir(module, workspace_prefix):
+            if name in old_modules:
+                # Robot replaces modules that have the same name as a test library in the workspace
+                sys.modules[name] = old_modules[name]
+            else:
+                del sys.modules[name]
+    # Finders and source lines cached for the workspace's files would otherwise be kept forever
+    for path in list(sys.path_importer_cache):
+        if os.path.join(os.path.abspath(path), '').startswith(workspace_prefix):
+            del sys.path_importer_cache[path]
+    for path in list(linecache.cache):
+        if os.path.abspath(path).startswith(workspace_prefix):
+            del linecache.cache[path]
+
+
+def _is_module_in_dir(module, dir_prefix):
+    """
+    :param module: Module from sys.modules
+    :type module: module
+    :param dir_prefix: Absolute path of the directory, ending with a separator
+    :type dir_prefix: str
+
+    :return: Whether the module was imported from a file, or is a namespace package, inside the directory
+    :rtype: bool
+    """
+    paths = [getattr(module, '__file__', None)] + list(getattr(module, '__path__', None) or [])
+    return any(path and os.path.abspath(path).startswith(dir_prefix) for path in paths)
+
+
+def stop_robot_run():
+    """
+    Ask the robot run executing inside the agent process to stop, in the same way robot handles the first Ctrl-C. The
+    run stops before it starts its next keyword and still writes its output.
+    """
+    STOP_SIGNAL_MONITOR._signal_count = 1  # pylint: disable=protected-access
+
+
+def clear_robot_stop_request():
+    """
+    Robot never resets its stop request, so clear it once the run has finished so that it doesn't stop the next run
+    """
+    STOP_SIGNAL_MONITOR._signal_count = 0  # pylint: disable=protected-access
+
+
+def robot_worker_main(workspace_dir, robot_args, console_path, output_dir, conn):
+    """
+    Entrypoint of a worker process. Executes the robot run and sends the result back to the agent process.
+
+    :param workspace_dir: Directory containing the test suites & dependencies
+    :type workspace_dir: str
+    :param robot_args: Dictionary of arguments to pass to robot.run()
+    :type robot_args: dict
+    :param console_path: File to write the robot stdout/stderr to as the run progresses
+    :type console_path: str
+    :param output_dir: Directory to write the test artifacts to
+    :type output_dir: str
+    :param conn: Pipe connection to send the result over
+    :type conn: multiprocessing.connection.Connection
+    """
+    try:
+        conn.send((run_robot(workspace_dir, robot_args, console_path, output_dir), None))
+    except Exception as err:  # pylint: disable=broad-except
+        conn.send((None, '{}: {}'.format(type(err).__name__, err)))
+    finally:
+        conn.close()
+
+
+def missing_modules_main(modules, conn):
+    """
+    Entrypoint of a worker process that reports which of the modules it didn't inherit from the fork server
+
+    :param modules: Names of the modules to check for
+    :type modules: list
+    :param conn: Pipe connection to send the names of the missing modules over
+    :type conn: multiprocessing.connection.Connection
+    """
+    try:
+        conn.send([name for name in modules if name not in sys.modules])
+    finally:
+        conn.close()
+
+
+def import_modules(modules):
+    """
+    :param modules: Names of the modules to import
+    :type modules: list
+
+    :return: Names of the modules that couldn't be imported
+    :rtype: list
+    """
+    missing = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as err:
+            logger.debug('Failed to import %s: %s', name, err)
+            missing.append(name)
+    return missing
+
+
+def create_worker_context(preload_modules):
+    """
+    Create the multiprocessing context that worker processes are started with. Where the platform supports it, each
+    worker is forked from a single-threaded fork server that has already imported robot and the preload modules, rather
+    than from the multi-threaded agent process. Otherwise the modules are imported into the agent process, which the
+    workers are forked from on Py2
+
+    :param preload_modules: Names of extra modules for the workers to start with, e.g. heavy test libraries
+    :type preload_modules: list
+
+    :return: Object with the Process and Pipe factories of the multiprocessing module
+    """
+    if hasattr(multiprocessing, 'get_context') and 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # The fork server is shared by the whole process and only starts once, so this only applies if it isn't already
+        # running
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES + list(preload_modules))
+        return context
+    missing = import_modules(preload_modules)
+    if missing:
+        logger.warning('Failed to preload modules: %s', ', '.join(missing))
+    return multiprocessing
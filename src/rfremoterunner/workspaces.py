@@ -0,0 +1,183 @@
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from rfremoterunner.utils import calculate_digest, resolve_workspace_path
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_WORKSPACE_STORE_DIR = os.path.join(tempfile.gettempdir(), 'rfremoterunner_workspaces')
+WORKSPACE_NAME_REGEX = re.compile('^[A-Za-z0-9_.-]{1,64}$')
+
+
+def calculate_revision(manifest):
+    """
+    Calculate an identifier for the contents of a workspace
+
+    :param manifest: Dictionary of workspace relative file paths to blob digests
+    :type manifest: dict
+
+    :return: Hex encoded SHA-256 digest of the manifest
+    :rtype: str
+    """
+    return calculate_digest(json.dumps(manifest, sort_keys=True))
+
+
+class WorkspaceStore:
+
+    def __init__(self, root_dir=None):
+        """
+        Constructor for WorkspaceStore. The store keeps named workspaces on disk between runs, along with a record of
+        the files in each, so that a client only needs to send the files that have changed since its last run rather
+        than a whole new workspace being created and deleted every time.
+
+        :param root_dir: Directory to keep the workspaces in. Defaults to a directory in the system temp directory
+        :type root_dir: str
+        """
+        # Absolute, as in-process robot runs change the CWD of the agent while other requests are being handled
+        self._root_dir = os.path.abspath(root_dir or DEFAULT_WORKSPACE_STORE_DIR)
+        if not os.path.exists(self._root_dir):
+            os.makedirs(self._root_dir)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _workspace_dir(self, name):
+        """
+        :param name: Name of the workspace
+        :type name: str
+
+        :return: Path of the workspace on disk
+        :rtype: str
+        """
+        if not WORKSPACE_NAME_REGEX.match(name):
+            raise ValueError('Invalid workspace name: {}'.format(name))
+        return os.path.join(self._root_dir, name)
+
+    def _state_path(self, name):
+        """
+        :param name: Name of the workspace
+        :type name: str
+
+        :return: Path of the file recording the files in the workspace
+        :rtype: str
+        """
+        return self._workspace_dir(name) + '.json'
+
+    def lock(self, name):
+        """
+        Get the lock that must be held while a workspace is being synced or used by a robot run
+
+        :param name: Name of the workspace
+        :type name: str
+
+        :return: The workspace's lock
+        :rtype: threading.Lock
+        """
+        self._workspace_dir(name)
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get_manifest(self, name):
+        """
+        :param name: Name of the workspace
+        :type name: str
+
+        :return: Dictionary of workspace relative file paths to blob digests of the files in the workspace. Empty if
+        the workspace doesn't exist
+        :rtype: dict
+        """
+        state_path = self._state_path(name)
+        if not os.path.exists(state_path) or not os.path.isdir(self._workspace_dir(name)):
+            return {}
+        with io.open(state_path, 'r', encoding='utf-8') as file_handle:
+            return json.load(file_handle)
+
+    def apply(self, name, base_revision, changes, deleted_paths, blob_store):
+        """
+        Bring a workspace up to date by copying in the files that have been added or changed and deleting the files
+        that have been removed. Must be called with the workspace's lock held.
+
+        :param name: Name of the workspace
+        :type name: str
+        :param base_revision: Revision of the workspace the changes were calculated against
+        :type base_revision: str
+        :param changes: Dictionary of workspace relative file paths to blob digests of the added and changed files
+        :type changes: dict
+        :param deleted_paths: Workspace relative paths of the files that have been removed
+        :type deleted_paths: list
+        :param blob_store: Blob store holding the contents of the added and changed files
+        :type blob_store: rfremoterunner.blob_store.BlobStore
+
+        :return: An absolute path to the workspace
+        :rtype: str
+        """
+        workspace_dir = self._workspace_dir(name)
+        manifest = self.get_manifest(name)
+        if calculate_revision(manifest) != base_revision:
+            raise ValueError('Workspace {} has changed since its state was retrieved'.format(name))
+        if not os.path.exists(workspace_dir):
+            os.makedirs(workspace_dir)
+
+        try:
+            for rel_path in deleted_paths:
+                full_path = resolve_workspace_path(workspace_dir, rel_path)
+                logger.debug('Deleting from workspace: %s', full_path)
+                if os.path.exists(full_path):
+                    os.remove(full_path)
+                manifest.pop(rel_path, None)
+                # Remove directories left empty so that robot doesn't see them as empty suites
+                parent_dir = os.path.dirname(full_path)
+                while parent_dir != workspace_dir and os.path.isdir(parent_dir) and not os.listdir(parent_dir):
+                    os.rmdir(parent_dir)
+                    parent_dir = os.path.dirname(parent_dir)
+
+            for rel_path, digest in changes.items():
+                full_path = resolve_workspace_path(workspace_dir, rel_path)
+                full_dir = os.path.dirname(full_path)
+                if not os.path.exists(full_dir):
+                    os.makedirs(full_dir)
+                logger.debug('Copying blob %s to: %s', digest, full_path)
+                blob_store.copy_to(digest, full_path)
+                manifest[rel_path] = digest
+        except Exception:
+            # The files on disk no longer match the recorded state, so start again from an empty workspace next time
+            self.delete(name)
+            raise
+
+        self._save_manifest(name, manifest)
+        logger.debug('Workspace %s: %d changed, %d deleted, %d files', name, len(changes), len(deleted_paths),
+                     len(manifest))
+        return workspace_dir
+
+    def delete(self, name):
+        """
+        Delete a workspace and its recorded state
+
+        :param name: Name of the workspace
+        :type name: str
+        """
+        if os.path.exists(self._state_path(name)):
+            os.remove(self._state_path(name))
+        shutil.rmtree(self._workspace_dir(name), ignore_errors=True)
+
+    def _save_manifest(self, name, manifest):
+        """
+        Record the files in a workspace. Written via a temporary file so that a partially written state is never read
+
+        :param name: Name of the workspace
+        :type name: str
+        :param manifest: Dictionary of workspace relative file paths to blob digests
+        :type manifest: dict
+        """
+        state_path = self._state_path(name)
+        file_handle, tmp_path = tempfile.mkstemp(dir=self._root_dir)
+        with os.fdopen(file_handle, 'wb') as tmp_file:
+            tmp_file.write(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        os.rename(tmp_path, state_path)
@@ -0,0 +1,87 @@
+"""
+Benchmark of the client's packaging stage. Generates a synthetic tree of test suites that share a pool of resource
+files and libraries, then times robot parsing the suite tree and the client packaging it. With --compare, packaging is
+also timed with the line scanner that found each suite's imports before they were taken from robot's parsed model, so
+that the two can be compared on the same tree.
+
+Usage: python tests/benchmarks/benchmark_packaging.py [--suites 5000] [--resources 200] [--depth 1] [--repeat 3]
+                                                      [--compare]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from robot.api import TestSuiteBuilder
+
+from rfremoterunner.rf_client import RemoteFrameworkClient
+from synthetic_tree import generate_tree
+
+
+class LineScanClient(RemoteFrameworkClient):
+    """
+    Client that packages test suites the way it did before their imports were taken from robot's parsed model: every
+    line of each file read with read_file_from_disk() is matched against IMPORT_LINE_REGEX
+    """
+
+    def _scan_robot_file(self, file_path, suite=None):
+        return RemoteFrameworkClient._scan_robot_file(self, file_path)
+
+
+def time_packaging(client_class, suite):
+    """
+    :param client_class: Class of the client to package the suite tree with
+    :type client_class: type
+    :param suite: Root test suite built by robot
+    :type suite: robot.running.model.TestSuite
+
+    :return: Number of seconds the client took to package the suite tree
+    :rtype: float
+    """
+    client = client_class('127.0.0.1')
+    start_time = time.time()
+    client._package_suite_hierarchy(suite)  # pylint: disable=protected-access
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the client\'s packaging of a synthetic suite tree')
+    parser.add_argument('--suites', type=int, default=5000, help='Number of test suites. Default: 5000')
+    parser.add_argument('--resources', type=int, default=200, help='Number of shared resource files. Default: 200')
+    parser.add_argument('--depth', type=int, default=1, help='Directory levels the suites are nested in. Default: 1')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each stage. Default: 3')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also time packaging with the line scanner the imports of test suites were found with '
+                             'before they were taken from robot\'s parsed model')
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix='rfremoterunner_benchmark_')
+    try:
+        suites_dir = generate_tree(root_dir, args.suites, args.resources, args.depth)
+        build_times = []
+        package_times = []
+        line_scan_times = []
+        for index in range(args.repeat):
+            start_time = time.time()
+            suite = TestSuiteBuilder().build(suites_dir)
+            build_times.append(time.time() - start_time)
+
+            # Alternate which goes first so that neither always benefits from the files being in the OS cache
+            if args.compare and index % 2:
+                line_scan_times.append(time_packaging(LineScanClient, suite))
+            package_times.append(time_packaging(RemoteFrameworkClient, suite))
+            if args.compare and not index % 2:
+                line_scan_times.append(time_packaging(LineScanClient, suite))
+
+        sys.stdout.write('{} suites, {} resources\n'.format(args.suites, args.resources))
+        sys.stdout.write('TestSuiteBuilder.build:   best {:.3f}s\n'.format(min(build_times)))
+        sys.stdout.write('_package_suite_hierarchy: best {:.3f}s\n'.format(min(package_times)))
+        if args.compare:
+            sys.stdout.write('  with the line scanner:  best {:.3f}s\n'.format(min(line_scan_times)))
+            sys.stdout.write('  line scanner / model:   {:.2f}x\n'.format(min(line_scan_times) / min(package_times)))
+    finally:
+        shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark of each stage of a run, executed against the agent's code in this process. Generates a synthetic tree of test
+suites, resource files and libraries, then times each stage on its own and reports the time, peak memory allocated and
+bytes produced. The upload payload and the artifacts are also compressed with each codec available, to compare the
+size saved against the time it costs. The results can be saved as JSON to compare releases.
+
+Usage: python tests/benchmarks/benchmark_stages.py [--suites 500] [--resources 50] [--depth 2] [--repeat 3]
+                                                   [--json results.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import six.moves.xmlrpc_client as xmlrpc_client
+import robot
+from robot.api import TestSuiteBuilder
+
+from rfremoterunner.compression import available_codecs, compress, decompress
+from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.rf_server import RobotFrameworkServer
+from rfremoterunner.workers import run_robot
+from synthetic_tree import generate_tree
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not available in Py2
+    tracemalloc = None
+
+
+def measure(stage, repeat, trace_memory=True):
+    """
+    Time a stage, then execute it once more with tracemalloc to find the peak amount of memory it allocated
+
+    :param stage: Callable that executes the stage
+    :type stage: callable
+    :param repeat: Number of times to time the stage
+    :type repeat: int
+    :param trace_memory: Whether to measure the peak memory
+    :type trace_memory: bool
+
+    :return: The best time in seconds, the peak memory in bytes (None if not measured) and the stage's return value
+    :rtype: tuple
+    """
+    times = []
+    value = None
+    for _ in range(repeat):
+        start_time = time.time()
+        value = stage()
+        times.append(time.time() - start_time)
+
+    peak_bytes = None
+    if trace_memory and tracemalloc:
+        tracemalloc.start()
+        try:
+            value = stage()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(times), peak_bytes, value
+
+
+def package(suite):
+    """
+    :param suite: Root of the suite tree
+    :type suite: robot.running.model.TestSuite
+
+    :return: The packaged suites and dependencies
+    :rtype: tuple
+    """
+    client = RemoteFrameworkClient('127.0.0.1')
+    client._package_suite_hierarchy(suite)  # pylint: disable=protected-access
+    return client._suites, client._dependencies  # pylint: disable=protected-access
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each stage of a run against a synthetic suite tree')
+    parser.add_argument('--suites', type=int, default=500, help='Number of test suites. Default: 500')
+    parser.add_argument('--resources', type=int, default=50, help='Number of shared resource files. Default: 50')
+    parser.add_argument('--depth', type=int, default=2, help='Directory levels the suites are nested in. Default: 2')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each stage. Default: 3')
+    parser.add_argument('--json', help='File to save the results to as JSON')
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix='rfremoterunner_benchmark_')
+    workspaces = []
+
+    def create_workspace(params):
+        create = RobotFrameworkServer._create_workspace  # pylint: disable=protected-access
+        workspaces.append(create(params[0], params[1]))
+        return workspaces[-1]
+
+    try:
+        suites_dir = generate_tree(root_dir, args.suites, args.resources, args.depth)
+        stages = []
+
+        seconds, peak, suite = measure(lambda: TestSuiteBuilder().build(suites_dir), args.repeat)
+        stages.append(('TestSuiteBuilder.build', seconds, peak, None))
+
+        seconds, peak, packaged = measure(lambda: package(suite), args.repeat)
+        stages.append(('_package_suite_hierarchy', seconds, peak, None))
+
+        seconds, peak, payload = measure(
+            lambda: xmlrpc_client.dumps(packaged + ({}, False), 'execute_robot_run').encode('utf-8'), args.repeat)
+        stages.append(('XML-RPC serialisation', seconds, peak, len(payload)))
+
+        seconds, peak, (received, _) = measure(lambda: xmlrpc_client.loads(payload), args.repeat)
+        stages.append(('XML-RPC deserialisation', seconds, peak, None))
+
+        seconds, peak, workspace_dir = measure(lambda: create_workspace(received), args.repeat)
+        stages.append(('_create_workspace', seconds, peak, None))
+
+        console_path = os.path.join(root_dir, 'console.log')
+        seconds, _, _ = measure(lambda: run_robot(workspace_dir, {}, console_path), 1, trace_memory=False)
+        stages.append(('robot.run', seconds, None, None))
+
+        read_artifacts = RobotFrameworkServer._read_robot_artifacts_from_disk  # pylint: disable=protected-access
+        seconds, peak, artifacts = measure(lambda: read_artifacts(workspace_dir), args.repeat)
+        stages.append(('_read_robot_artifacts_from_disk', seconds, peak,
+                       sum(len(artifact.encode('utf-8')) for artifact in artifacts)))
+
+        artifact_data = b''.join(artifact.encode('utf-8') for artifact in artifacts)
+        for codec in available_codecs():
+            for data_name, data in (('upload', payload), ('artifacts', artifact_data)):
+                # pylint: disable=cell-var-from-loop
+                seconds, peak, compressed = measure(lambda: compress(codec, data), args.repeat)
+                stages.append(('{} compress {}'.format(codec, data_name), seconds, peak, len(compressed)))
+                seconds, peak, _ = measure(lambda: decompress(codec, compressed), args.repeat)
+                stages.append(('{} decompress {}'.format(codec, data_name), seconds, peak, None))
+    finally:
+        for workspace in workspaces:
+            shutil.rmtree(workspace, ignore_errors=True)
+        shutil.rmtree(root_dir)
+
+    sys.stdout.write('{} suites, {} resources, depth {}. Python {}, robotframework {}\n'.format(
+        args.suites, args.resources, args.depth, platform.python_version(), robot.__version__))
+    sys.stdout.write('{:<34} {:>10} {:>14} {:>14}\n'.format('Stage', 'Best (s)', 'Peak mem (KiB)', 'Bytes'))
+    for name, seconds, peak, size in stages:
+        sys.stdout.write('{:<34} {:>10.3f} {:>14} {:>14}\n'.format(
+            name, seconds, '-' if peak is None else peak // 1024, '-' if size is None else size))
+
+    if args.json:
+        results = {
+            'config': {'suites': args.suites, 'resources': args.resources, 'depth': args.depth,
+                       'python': platform.python_version(), 'robotframework': robot.__version__},
+            'stages': [{'name': name, 'seconds': seconds, 'peak_bytes': peak, 'bytes': size}
+                       for name, seconds, peak, size in stages]
+        }
+        data = json.dumps(results, indent=2)
+        with io.open(args.json, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(data if isinstance(data, type(u'')) else data.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    main()
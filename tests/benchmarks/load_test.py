@@ -0,0 +1,212 @@
+"""
+End to end load test. Starts several agents on localhost ports inside this process, each executing runs in its own
+worker processes, and fires concurrent client runs of a trivially fast suite at them. Reports the throughput and the
+latency of each phase of a run.
+
+Usage: python tests/benchmarks/load_test.py [--agents 2] [--workers 2] [--clients 8] [--runs 40] [--base-port 18470]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import six.moves.queue as queue
+
+from rfremoterunner import rf_client
+from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.rf_server import RobotFrameworkServer
+
+# Phases of a run, each measured from the end of the previous one
+PHASES = [
+    ('build', 'built'),
+    ('package', 'packaged'),
+    ('upload', 'uploaded'),
+    ('submit', 'submitted'),
+    ('queue', 'running'),
+    ('execute', 'finished'),
+    ('collect', 'done')
+]
+SUITE_DATA = '*** Test Cases ***\nTC{0}\n    Log    Hello\n'
+
+
+class PhaseRecorder:
+    """
+    Wraps a client's ServerProxy to record the time at which each phase of a job ends
+    """
+
+    def __init__(self, proxy, marks):
+        self._proxy = proxy
+        self._marks = marks
+
+    def __getattr__(self, name):
+        method = getattr(self._proxy, name)
+
+        def call(*args):
+            if name == 'submit_run':
+                self._marks['uploaded'] = time.time()
+            value = method(*args)
+            if name == 'submit_run':
+                self._marks['submitted'] = time.time()
+            elif name == 'get_job_status':
+                # The state is only seen when polled, so the queue and execute phases are as accurate as the poll
+                # interval
+                if value['state'] != 'queued':
+                    self._marks.setdefault('running', time.time())
+                if value['state'] in ('finished', 'failed'):
+                    self._marks.setdefault('finished', time.time())
+            return value
+        return call
+
+
+class TimedClient(RemoteFrameworkClient):
+    """
+    Client that records when each phase of its run ends
+    """
+
+    def __init__(self, address):
+        RemoteFrameworkClient.__init__(self, address)
+        self.marks = {}
+        self._client = PhaseRecorder(self._client, self.marks)
+
+    def build_test_suite(self, suite_list, extensions, include_suites):  # pylint: disable=arguments-differ
+        suite = RemoteFrameworkClient.build_test_suite(suite_list, extensions, include_suites)
+        self.marks['built'] = time.time()
+        return suite
+
+    def _upload_missing_blobs(self, blobs):
+        self.marks['packaged'] = time.time()
+        RemoteFrameworkClient._upload_missing_blobs(self, blobs)
+
+    def _upload_bundle(self):
+        self.marks['packaged'] = time.time()
+        return RemoteFrameworkClient._upload_bundle(self)
+
+
+def percentile(values, percent):
+    """
+    :param values: Sorted values
+    :type values: list
+    :param percent: Percentile to find
+    :type percent: float
+
+    :return: The nearest rank percentile of the values
+    :rtype: float
+    """
+    index = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def execute_runs(hosts, suite_dir, output_dir, runs, results):
+    """
+    Client thread target. Executes runs from the queue until it is empty, alternating between the agents
+
+    :param hosts: Addresses of the agents
+    :type hosts: list
+    :param suite_dir: Directory containing the suite to run
+    :type suite_dir: str
+    :param output_dir: Directory to save the output xml files to
+    :type output_dir: str
+    :param runs: Queue of run numbers
+    :type runs: queue.Queue
+    :param results: List to append the marks of each run to, or the error it raised
+    :type results: list
+    """
+    while True:
+        try:
+            run_number = runs.get_nowait()
+        except queue.Empty:
+            return
+        client = TimedClient(hosts[run_number % len(hosts)])
+        client.marks['start'] = time.time()
+        output_xml_path = os.path.join(output_dir, 'output_{}.xml'.format(run_number))
+        try:
+            client.execute_run([suite_dir], None, None, {'log': 'NONE', 'report': 'NONE'},
+                               artifact_paths={'output_xml': output_xml_path})
+            client.marks['done'] = time.time()
+            results.append(client.marks)
+        except Exception as err:  # pylint: disable=broad-except
+            results.append(err)
+        finally:
+            if os.path.exists(output_xml_path):
+                os.remove(output_xml_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test agents running on this machine with concurrent clients')
+    parser.add_argument('--agents', type=int, default=2, help='Number of agents to start. Default: 2')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes per agent. Default: 2')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients. Default: 8')
+    parser.add_argument('--runs', type=int, default=40, help='Total number of runs to execute. Default: 40')
+    parser.add_argument('--suites', type=int, default=2, help='Number of test suites in each run. Default: 2')
+    parser.add_argument('--base-port', type=int, default=18470, help='Port of the first agent. Default: 18470')
+    parser.add_argument('--poll-interval', type=float, default=0.05,
+                        help='Initial interval the clients poll for the status of a run at. Default: 0.05')
+    args = parser.parse_args()
+
+    rf_client.MIN_POLL_INTERVAL = args.poll_interval
+    root_dir = tempfile.mkdtemp(prefix='rfremoterunner_load_test_')
+    agents = []
+    try:
+        suite_dir = os.path.join(root_dir, 'suites')
+        output_dir = os.path.join(root_dir, 'output')
+        os.makedirs(suite_dir)
+        os.makedirs(output_dir)
+        for index in range(args.suites):
+            with open(os.path.join(suite_dir, 'suite_{}.robot'.format(index)), 'w') as file_handle:
+                file_handle.write(SUITE_DATA.format(index))
+
+        hosts = []
+        for index in range(args.agents):
+            agent_dir = os.path.join(root_dir, 'agent_{}'.format(index))
+            agent = RobotFrameworkServer('127.0.0.1', args.base_port + index, blob_store_dir=agent_dir + '_blobs',
+                                         workers=args.workers, workspace_store_dir=agent_dir + '_workspaces')
+            agent_thread = threading.Thread(target=agent.serve)
+            agent_thread.daemon = True
+            agent_thread.start()
+            agents.append(agent)
+            hosts.append('127.0.0.1:{}'.format(args.base_port + index))
+
+        runs = queue.Queue()
+        for run_number in range(args.runs):
+            runs.put(run_number)
+        results = []
+        start_time = time.time()
+        clients = [threading.Thread(target=execute_runs, args=(hosts, suite_dir, output_dir, runs, results))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.time() - start_time
+    finally:
+        for agent in agents:
+            agent.shutdown()
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    completed = [marks for marks in results if isinstance(marks, dict)]
+    errors = [err for err in results if not isinstance(err, dict)]
+    sys.stdout.write('{} agents x {} workers, {} clients, {} runs of {} suites\n'.format(
+        args.agents, args.workers, args.clients, args.runs, args.suites))
+    sys.stdout.write('Completed: {}, failed: {}, elapsed: {:.2f}s, throughput: {:.1f} runs/min\n'.format(
+        len(completed), len(errors), elapsed, len(completed) / elapsed * 60))
+    for err in errors[:5]:
+        sys.stdout.write('Error: {}\n'.format(err))
+    if not completed:
+        return
+
+    sys.stdout.write('{:<10} {:>10} {:>10} {:>10}\n'.format('Phase', 'p50 (s)', 'p95 (s)', 'p99 (s)'))
+    previous_mark = 'start'
+    for phase, mark in PHASES + [('total', 'done')]:
+        start_mark = 'start' if phase == 'total' else previous_mark
+        durations = sorted(marks[mark] - marks[start_mark] for marks in completed
+                           if mark in marks and start_mark in marks)
+        previous_mark = mark
+        if durations:
+            sys.stdout.write('{:<10} {:>10.3f} {:>10.3f} {:>10.3f}\n'.format(
+                phase, percentile(durations, 50), percentile(durations, 95), percentile(durations, 99)))
+
+
+if __name__ == '__main__':
+    main()
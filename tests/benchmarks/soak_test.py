@@ -0,0 +1,125 @@
+"""
+Soak test of a long-running agent. Executes thousands of runs one after the other inside a single agent, without
+worker processes, and checks that they leave the agent process unchanged: the length of sys.path, the number of
+modules in sys.modules and the resident memory must stay flat once the agent has warmed up. Each run imports a test
+library from its workspace that returns the number of the run, so a library left over from a previous run fails it.
+
+Usage: python tests/benchmarks/soak_test.py [--runs 2000] [--warmup 100] [--sample-interval 250] [--max-rss-growth 16]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from rfremoterunner.rf_server import RobotFrameworkServer
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+SUITE_DATA = ('*** Settings ***\n'
+              'Library    SoakLib\n'
+              'Library    ${{CURDIR}}/SoakPathLib.py\n'
+              '*** Test Cases ***\n'
+              'TC{0}\n'
+              '    ${{name_run}}=    Get Run Number\n'
+              '    Should Be Equal As Integers    ${{name_run}}    {0}\n'
+              '    ${{path_run}}=    Get Path Run Number\n'
+              '    Should Be Equal As Integers    ${{path_run}}    {0}\n')
+# Imported by name, so found through the workspace being on sys.path
+NAME_LIBRARY_DATA = 'def get_run_number():\n    return {0}\n'
+# Imported by path
+PATH_LIBRARY_DATA = 'def get_path_run_number():\n    return {0}\n'
+
+
+def get_rss():
+    """
+    :return: Resident memory of this process in bytes. Where the current value isn't available, the peak value. None
+    if neither is available
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    try:
+        with open('/proc/self/statm') as file_handle:
+            return int(file_handle.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def take_sample(run_number):
+    """
+    :param run_number: Number of runs executed so far
+    :type run_number: int
+
+    :return: The run number, length of sys.path, number of modules and resident memory in bytes
+    :rtype: tuple
+    """
+    return run_number, len(sys.path), len(sys.modules), get_rss()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test a single agent with thousands of consecutive runs')
+    parser.add_argument('--runs', type=int, default=2000, help='Number of runs to execute. Default: 2000')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='Number of runs after which the agent should have stopped growing. Default: 100')
+    parser.add_argument('--sample-interval', type=int, default=250,
+                        help='Number of runs between each report of the agent state. Default: 250')
+    parser.add_argument('--max-rss-growth', type=float, default=16,
+                        help='Megabytes the resident memory may grow by after the warmup. Default: 16')
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix='rfremoterunner_soak_test_')
+    agent = RobotFrameworkServer('127.0.0.1', 0, blob_store_dir=os.path.join(root_dir, 'blobs'),
+                                 workspace_store_dir=os.path.join(root_dir, 'workspaces'))
+    samples = [take_sample(0)]
+    failures = []
+    start_time = time.time()
+    try:
+        for run_number in range(1, args.runs + 1):
+            suites = {'Soak.robot': {'path': '', 'suite_data': SUITE_DATA.format(run_number)}}
+            dependencies = {'SoakLib.py': NAME_LIBRARY_DATA.format(run_number),
+                            'SoakPathLib.py': PATH_LIBRARY_DATA.format(run_number)}
+            result = agent.execute_robot_run(suites, dependencies, {'loglevel': 'NONE'})
+            if result['ret_code'] != 0:
+                failures.append(run_number)
+            if run_number == args.warmup or run_number % args.sample_interval == 0 or run_number == args.runs:
+                samples.append(take_sample(run_number))
+    finally:
+        agent.close()
+        shutil.rmtree(root_dir, ignore_errors=True)
+    elapsed = time.time() - start_time
+
+    sys.stdout.write('{} runs in {:.1f}s, {} failed\n'.format(args.runs, elapsed, len(failures)))
+    sys.stdout.write('{:>8} {:>10} {:>10} {:>12}\n'.format('Runs', 'sys.path', 'modules', 'RSS (MB)'))
+    for run_number, path_length, module_count, rss in samples:
+        sys.stdout.write('{:>8} {:>10} {:>10} {:>12}\n'.format(
+            run_number, path_length, module_count, '-' if rss is None else '{:.1f}'.format(rss / 1024.0 / 1024.0)))
+
+    warm = [sample for sample in samples if sample[0] == args.warmup] or samples[:1]
+    _, warm_path_length, warm_module_count, warm_rss = warm[0]
+    _, path_length, module_count, rss = samples[-1]
+    errors = []
+    if failures:
+        errors.append('Runs failed, first: {}'.format(failures[0]))
+    if path_length != warm_path_length:
+        errors.append('sys.path grew from {} to {} entries'.format(warm_path_length, path_length))
+    if module_count != warm_module_count:
+        errors.append('sys.modules grew from {} to {} modules'.format(warm_module_count, module_count))
+    if rss is not None and rss - warm_rss > args.max_rss_growth * 1024 * 1024:
+        errors.append('RSS grew by {:.1f}MB'.format((rss - warm_rss) / 1024.0 / 1024.0))
+    for error in errors:
+        sys.stdout.write('FAIL: {}\n'.format(error))
+    if errors:
+        sys.exit(1)
+    sys.stdout.write('PASS\n')
+
+
+if __name__ == '__main__':
+    main()
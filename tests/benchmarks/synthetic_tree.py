@@ -0,0 +1,62 @@
+"""
+Generates synthetic trees of test suites, resource files and libraries for the benchmarks
+"""
+import os
+
+SUITES_PER_DIR = 100
+DIRS_PER_LEVEL = 10
+TESTS_PER_SUITE = 5
+KEYWORDS_PER_RESOURCE = 20
+
+
+def generate_tree(root_dir, suite_count, resource_count, depth=1):
+    """
+    Write a synthetic suite tree to disk. The suites are spread across nested directories, each suite imports two
+    resource files and a library, and each resource file imports a library of its own. Every file name is unique
+    because the client packages the suites and dependencies by file name
+
+    :param root_dir: Directory to write the tree into
+    :type root_dir: str
+    :param suite_count: Number of test suites to generate
+    :type suite_count: int
+    :param resource_count: Number of resource files shared between the suites
+    :type resource_count: int
+    :param depth: Number of directory levels the suites are nested in
+    :type depth: int
+
+    :return: Path of the suite tree
+    :rtype: str
+    """
+    suites_dir = os.path.join(root_dir, 'suites')
+    resources_dir = os.path.join(root_dir, 'resources')
+    os.makedirs(resources_dir)
+    for index in range(resource_count):
+        with open(os.path.join(resources_dir, 'lib_{}.py'.format(index)), 'w') as file_handle:
+            file_handle.write('def keyword_{}():\n    pass\n'.format(index))
+        with open(os.path.join(resources_dir, 'res_{}.robot'.format(index)), 'w') as file_handle:
+            file_handle.write('*** Settings ***\nLibrary    lib_{0}.py\n\n*** Keywords ***\n'.format(index))
+            for keyword in range(KEYWORDS_PER_RESOURCE):
+                file_handle.write('Keyword {0} {1}\n    [Arguments]    ${{arg}}\n    Log    ${{arg}}\n'
+                                  '    Should Be Equal    ${{arg}}    ${{arg}}\n\n'.format(index, keyword))
+
+    # Path from a suite back up to the directory containing the suites and resources
+    to_root = '../' * (depth + 1)
+    for index in range(suite_count):
+        dir_index = index // SUITES_PER_DIR
+        path_parts = ['level{}_{}'.format(level, dir_index // (DIRS_PER_LEVEL ** level) % DIRS_PER_LEVEL)
+                      for level in reversed(range(depth))]
+        suite_dir = os.path.join(suites_dir, *path_parts)
+        if not os.path.exists(suite_dir):
+            os.makedirs(suite_dir)
+        with open(os.path.join(suite_dir, 'suite_{}.robot'.format(index)), 'w') as file_handle:
+            file_handle.write('*** Settings ***\n'
+                              'Library    Collections\n'
+                              'Resource    {2}resources/res_{0}.robot\n'
+                              'Resource    {2}resources/res_{1}.robot\n'
+                              'Library    {2}resources/lib_{0}.py\n\n'
+                              '*** Test Cases ***\n'.format(index % resource_count, (index * 7) % resource_count,
+                                                            to_root))
+            for test in range(TESTS_PER_SUITE):
+                file_handle.write('Test {0} {1}\n    [Tags]    tag{1}\n    Log    Hello\n'
+                                  '    Should Be Equal    a    a\n\n'.format(index, test))
+    return suites_dir
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rfremoterunner.blob_store import BlobStore
+from rfremoterunner.utils import calculate_digest
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.test_obj = BlobStore(os.path.join(self.workspace, 'blobs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_put_and_copy_to(self):
+        """
+        Test that a blob added with put() can be copied back out with copy_to()
+        """
+        data = b'\x00\x01 binary data \xff'
+        digest = calculate_digest(data)
+        self.test_obj.put(digest, data)
+        self.assertTrue(self.test_obj.contains(digest))
+
+        dest_path = os.path.join(self.workspace, 'copy.bin')
+        self.test_obj.copy_to(digest, dest_path)
+        with open(dest_path, 'rb') as file_handle:
+            self.assertEqual(data, file_handle.read())
+
+    def test_relative_root_dir(self):
+        """
+        Test that a relative root directory still refers to the same place after the CWD changes
+        """
+        old_cwd = os.getcwd()
+        os.chdir(self.workspace)
+        try:
+            test_obj = BlobStore('relative_blobs')
+            os.chdir(old_cwd)
+            data = b'data'
+            digest = calculate_digest(data)
+            test_obj.put(digest, data)
+        finally:
+            os.chdir(old_cwd)
+        self.assertTrue(os.path.exists(os.path.join(self.workspace, 'relative_blobs', digest[:2], digest)))
+
+    def test_put_digest_mismatch(self):
+        """
+        Test that put() rejects data that does not match its digest
+        """
+        digest = calculate_digest(b'expected data')
+        self.assertRaises(ValueError, self.test_obj.put, digest, b'different data')
+        self.assertFalse(self.test_obj.contains(digest))
+
+    def test_missing(self):
+        """
+        Test that missing() only returns the digests that are not held in the store
+        """
+        held_digest = calculate_digest(b'held')
+        missing_digest = calculate_digest(b'missing')
+        self.test_obj.put(held_digest, b'held')
+        self.assertListEqual([missing_digest], self.test_obj.missing([held_digest, missing_digest]))
+
+    def test_invalid_digest(self):
+        """
+        Test that a digest that could be used to address a file outside of the store is rejected
+        """
+        self.assertRaises(ValueError, self.test_obj.contains, '../../etc/passwd')
+
+    def test_copy_to_missing_blob(self):
+        """
+        Test that copy_to() raises a KeyError when the blob is not held in the store
+        """
+        self.assertRaises(KeyError, self.test_obj.copy_to, calculate_digest(b'missing'),
+                          os.path.join(self.workspace, 'copy.bin'))
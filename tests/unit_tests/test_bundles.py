@@ -0,0 +1,74 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from rfremoterunner.bundles import write_bundle, extract_bundle, write_bundle_file, read_bundle_file
+from rfremoterunner.compression import DecompressingReader
+
+
+class TestBundles(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workspace)
+
+    def test_round_trip(self):
+        """
+        Test that the files and attachments written to a bundle are extracted into the same paths, with binary
+        attachments intact
+        """
+        attachment = os.path.join(self.workspace, 'data.bin')
+        attachment_data = os.urandom(3000) + b'\xff\xfe\x00'
+        with open(attachment, 'wb') as file_handle:
+            file_handle.write(attachment_data)
+        files = {'Suites/Sub/Suite1.robot': u'*** Test Cases ***\nTC\u00e91\n'.encode('utf-8'), 'Lib1.py': b'pass\n'}
+
+        bundle = io.BytesIO()
+        write_bundle(bundle, files, {'data/data.bin': attachment})
+        bundle.seek(0)
+        workspace_dir = os.path.join(self.workspace, 'extracted')
+        os.makedirs(workspace_dir)
+        self.assertEqual(3, extract_bundle(bundle, workspace_dir))
+
+        for rel_path, data in list(files.items()) + [('data/data.bin', attachment_data)]:
+            with open(os.path.join(workspace_dir, *rel_path.split('/')), 'rb') as file_handle:
+                self.assertEqual(data, file_handle.read())
+
+    def test_bundle_file(self):
+        """
+        Test that a bundle file can be read back with its metadata, and can be extracted by the agent as it is sent
+        """
+        bundle_path = os.path.join(self.workspace, 'bundle.tar.gz')
+        files = {'Suites/Suite1.txt': b'*** Test Cases ***\nTC1\n', 'Lib1.py': b'pass\n'}
+        write_bundle_file(bundle_path, files, metadata={'extension': 'txt:robot'})
+
+        read_files, metadata = read_bundle_file(bundle_path)
+        self.assertDictEqual(files, dict(read_files))
+        self.assertDictEqual({'extension': 'txt:robot'}, metadata)
+        self.assertEqual(({}, metadata), read_bundle_file(bundle_path, include_files=False))
+
+        workspace_dir = os.path.join(self.workspace, 'extracted')
+        os.makedirs(workspace_dir)
+        with open(bundle_path, 'rb') as file_handle:
+            self.assertEqual(2, extract_bundle(DecompressingReader(file_handle, 'gzip'), workspace_dir))
+        self.assertListEqual(['Lib1.py', 'Suites'], sorted(os.listdir(workspace_dir)))
+
+    def test_extract_rejects_unsafe_members(self):
+        """
+        Test that a bundle containing a path outside of the workspace, or a link, is rejected
+        """
+        for name, member_type in (('../escaped.txt', tarfile.REGTYPE), ('/tmp/escaped.txt', tarfile.REGTYPE),
+                                  ('link', tarfile.SYMTYPE)):
+            bundle = io.BytesIO()
+            with tarfile.open(fileobj=bundle, mode='w') as tar:
+                info = tarfile.TarInfo(name)
+                info.type = member_type
+                info.linkname = '/etc/passwd'
+                tar.addfile(info, io.BytesIO())
+            bundle.seek(0)
+            self.assertRaises(ValueError, extract_bundle, bundle, self.workspace)
+        self.assertListEqual([], os.listdir(self.workspace))
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.workspace), 'escaped.txt')))
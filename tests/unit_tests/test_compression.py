@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from rfremoterunner.compression import available_codecs, negotiate_codec, get_codec, compress, decompress
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_round_trip(self):
+        """
+        Test that data compressed with each available codec decompresses to the original, including when it is
+        decompressed a chunk at a time
+        """
+        data = b'*** Test Cases ***\nTC1\n    Log    Hello\n' * 1000 + os.urandom(1000)
+        for codec in available_codecs():
+            compressed = compress(codec, data)
+            self.assertLess(len(compressed), len(data) // 10)
+            self.assertEqual(data, decompress(codec, compressed))
+
+            decompressor = get_codec(codec).decompressor()
+            chunks = [decompressor.decompress(compressed[index:index + 100])
+                      for index in range(0, len(compressed), 100)]
+            self.assertEqual(data, b''.join(chunks) + decompressor.flush())
+
+    def test_gzip_always_available(self):
+        """
+        Test that gzip is available as the baseline codec and is the last choice
+        """
+        self.assertEqual('gzip', available_codecs()[-1])
+
+    def test_negotiate_codec(self):
+        """
+        Test that the first preferred codec that the other machine supports is chosen
+        """
+        self.assertEqual('gzip', negotiate_codec(['gzip'], ['zstd', 'gzip']))
+        self.assertEqual('zstd', negotiate_codec(['gzip', 'zstd'], ['zstd', 'gzip']))
+        self.assertIsNone(negotiate_codec([], ['zstd', 'gzip']))
+
+    def test_invalid_data_and_codec(self):
+        """
+        Test that a ValueError is raised for data that isn't valid for the codec, or a codec that isn't available
+        """
+        self.assertRaises(ValueError, decompress, 'gzip', b'not gzip')
+        self.assertRaises(ValueError, get_codec, 'unknown')
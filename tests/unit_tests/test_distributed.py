@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+import unittest
+from mock import patch, MagicMock
+
+from rfremoterunner.distributed import DistributedRun, WorkQueue, split_into_shards, DYNAMIC_DISPATCH
+from rfremoterunner.metrics import PhaseTimings
+from rfremoterunner.rf_client import RemoteFrameworkClient, RunCancelledError
+
+
+class TestDistributedRun(unittest.TestCase):
+
+    def setUp(self):
+        self.resource_dir = os.path.join(os.path.dirname(__file__), 'rf_client_test_resources')
+
+    @staticmethod
+    def create_suite(name, test_count):
+        """
+        Helper function to create a mock suite with a number of test cases
+        """
+        suite = MagicMock()
+        suite.name = name
+        suite.tests = [MagicMock() for _ in range(test_count)]
+        return suite
+
+    @staticmethod
+    def save_output(host, artifact_paths):
+        """
+        Helper function that stands in for an agent returning the output xml of a run
+        """
+        with open(artifact_paths['output_xml'], 'wb') as file_handle:
+            file_handle.write(host.encode('utf-8'))
+        return {'artifact_paths': artifact_paths, 'ret_code': 0}
+
+    def test_split_into_shards(self):
+        """
+        Test that split_into_shards() balances the shards by number of test cases and drops empty shards
+        """
+        suites = [self.create_suite(name, count) for name, count in [('A', 1), ('B', 4), ('C', 2), ('D', 3)]]
+
+        shards = split_into_shards(suites, 2)
+        self.assertListEqual([['A', 'B'], ['C', 'D']], [[suite.name for suite in shard] for shard in shards])
+
+        shards = split_into_shards(suites[:2], 4)
+        self.assertListEqual([['B'], ['A']], [[suite.name for suite in shard] for shard in shards])
+
+    def test_split_into_shards_estimates(self):
+        """
+        Test that split_into_shards() places the longest suites first, each into the shard with the least work, and
+        keeps the suites in each shard in their original order
+        """
+        durations = {'A': 5, 'B': 1, 'C': 8, 'D': 3, 'E': 4, 'F': 2}
+        suites = [self.create_suite(name, 1) for name in sorted(durations)]
+
+        shards = split_into_shards(suites, 3, lambda suite: durations[suite.name])
+
+        self.assertListEqual([['C'], ['A', 'B', 'F'], ['D', 'E']],
+                             [[suite.name for suite in shard] for shard in shards])
+
+    def test_execute_run(self):
+        """
+        Test that execute_run() executes every suite exactly once, spread across the agents, and merges the results
+        """
+        executed = {}
+
+        def create_client(host, *_args, **_kwargs):
+            client = MagicMock()
+
+            # pylint: disable=unused-argument
+            def execute_suites(suites, robot_arg_dict, output_callback, artifact_paths):
+                executed[host] = sorted(suite.name for suite in suites)
+                output_callback('Output from ' + host)
+                return self.save_output(host, artifact_paths)
+
+            client.execute_suites = execute_suites
+            return client
+
+        output = []
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class, \
+                patch('rfremoterunner.distributed.merge_results') as mock_merge_results:
+            mock_client_class.side_effect = create_client
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            test_obj = DistributedRun(['host1', 'host2', 'host3'])
+            actual_result = test_obj.execute_run([self.resource_dir], 'txt:robot', None, {}, output.append)
+
+        self.assertEqual(mock_merge_results.return_value, actual_result)
+        self.assertListEqual(['host1', 'host2', 'host3'], sorted(executed.keys()))
+        all_suites = sorted(name for suites in executed.values() for name in suites)
+        self.assertListEqual(['S-TS2', 'S-TS3', 'S-TS4', 'T-TS5', 'T-TS6', 'TS1'], all_suites)
+        self.assertEqual(3, len(mock_merge_results.call_args[0][0]))
+        self.assertListEqual(['Output from host1', 'Output from host2', 'Output from host3'], sorted(output))
+
+    def test_execute_run_adds_up_timings(self):
+        """
+        Test that execute_run() adds up the phase timings of the shards, on this machine and on the agents
+        """
+        def create_client(host, *_args, **_kwargs):
+            client = MagicMock()
+            client.timings = PhaseTimings()
+            client.agent_timings = None
+            if host == 'host1':
+                client.agent_timings = {'durations': {'robot': 2.0}, 'bytes': {'artifacts': 10}}
+
+            # pylint: disable=unused-argument
+            def execute_suites(suites, robot_arg_dict, output_callback, artifact_paths):
+                client.timings.record('execute', 1.5)
+                client.timings.add_bytes('upload', 100)
+                return self.save_output(host, artifact_paths)
+
+            client.execute_suites = execute_suites
+            return client
+
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class, \
+                patch('rfremoterunner.distributed.merge_results'):
+            mock_client_class.side_effect = create_client
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            test_obj = DistributedRun(['host1', 'host2'])
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        self.assertListEqual(['build', 'execute', 'merge'], sorted(test_obj.timings.durations))
+        self.assertEqual(3.0, test_obj.timings.durations['execute'])
+        self.assertDictEqual({'upload': 200}, dict(test_obj.timings.byte_counts))
+        self.assertDictEqual({'durations': {'robot': 2.0}, 'bytes': {'artifacts': 10}},
+                             test_obj.agent_timings.as_dict())
+
+    def test_execute_run_timing_history(self):
+        """
+        Test that execute_run() balances the shards with the timing history and records the merged result in it
+        """
+        timing_history = MagicMock()
+        timing_history.estimate.side_effect = lambda suite: 10 if suite.name == 'TS1' else 1
+        executed = {}
+
+        def create_client(host, *_args, **_kwargs):
+            client = MagicMock()
+
+            # pylint: disable=unused-argument
+            def execute_suites(suites, robot_arg_dict, output_callback, artifact_paths):
+                executed[host] = sorted(suite.name for suite in suites)
+                return self.save_output(host, artifact_paths)
+
+            client.execute_suites = execute_suites
+            return client
+
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class, \
+                patch('rfremoterunner.distributed.merge_results') as mock_merge_results:
+            mock_client_class.side_effect = create_client
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            test_obj = DistributedRun(['host1', 'host2'], timing_history=timing_history)
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        self.assertListEqual(['TS1'], executed['host1'])
+        self.assertListEqual(['S-TS2', 'S-TS3', 'S-TS4', 'T-TS5', 'T-TS6'], executed['host2'])
+        timing_history.record_result.assert_called_once_with(mock_merge_results.return_value)
+
+    def run_dynamic(self, hosts, execute_suites):
+        """
+        Helper function that executes the test resources in dynamic dispatch mode with a fake client
+
+        :return: The units passed to merge_results()
+        """
+        def create_client(host, *_args, **_kwargs):
+            client = MagicMock()
+            client.execute_suites = lambda suites, robot_arg_dict, output_callback, artifact_paths: \
+                execute_suites(host, suites, artifact_paths)
+            return client
+
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class, \
+                patch('rfremoterunner.distributed.merge_results') as mock_merge_results:
+            mock_client_class.side_effect = create_client
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            test_obj = DistributedRun(hosts, dispatch=DYNAMIC_DISPATCH)
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+        return mock_merge_results.call_args[0][0]
+
+    def test_execute_run_dynamic(self):
+        """
+        Test that in dynamic dispatch mode each suite is executed on its own and a faster agent executes more suites
+        """
+        executed = []
+
+        def execute_suites(host, suites, artifact_paths):
+            if host == 'slow_host':
+                time.sleep(0.5)
+            executed.append((host, [suite.name for suite in suites]))
+            return self.save_output(host, artifact_paths)
+
+        output_paths = self.run_dynamic(['slow_host', 'fast_host'], execute_suites)
+
+        self.assertEqual(6, len(output_paths))
+        self.assertTrue(all(len(suite_names) == 1 for _, suite_names in executed))
+        self.assertListEqual(['S-TS2', 'S-TS3', 'S-TS4', 'T-TS5', 'T-TS6', 'TS1'],
+                             sorted(suite_names[0] for _, suite_names in executed))
+        self.assertEqual(1, len([host for host, _ in executed if host == 'slow_host']))
+
+    def test_execute_run_dynamic_agent_fails(self):
+        """
+        Test that in dynamic dispatch mode a suite on an agent that fails is executed by another agent
+        """
+        executed = []
+
+        def execute_suites(host, suites, artifact_paths):
+            if host == 'bad_host':
+                raise IOError('Connection refused')
+            time.sleep(0.05)
+            executed.append(suites[0].name)
+            return self.save_output(host, artifact_paths)
+
+        output_paths = self.run_dynamic(['good_host', 'bad_host'], execute_suites)
+
+        self.assertEqual(6, len(output_paths))
+        self.assertListEqual(['S-TS2', 'S-TS3', 'S-TS4', 'T-TS5', 'T-TS6', 'TS1'], sorted(executed))
+
+    def test_execute_run_dynamic_all_agents_fail(self):
+        """
+        Test that in dynamic dispatch mode the run fails if every agent fails
+        """
+        def execute_suites(host, suites, artifact_paths):
+            raise IOError('Connection refused')
+
+        self.assertRaises(RuntimeError, self.run_dynamic, ['host1', 'host2'], execute_suites)
+
+    def test_work_queue(self):
+        """
+        Test that WorkQueue returns a unit to the queue when requeued and runs out once every unit is done
+        """
+        work_queue = WorkQueue(['A', 'B'])
+        self.assertEqual('A', work_queue.get())
+        work_queue.task_done('A', requeue=True)
+        self.assertEqual('A', work_queue.get())
+        self.assertEqual('B', work_queue.get())
+        self.assertEqual(2, work_queue.remaining())
+        work_queue.task_done('A')
+        work_queue.task_done('B')
+        self.assertIsNone(work_queue.get())
+        self.assertEqual(0, work_queue.remaining())
+
+    def test_execute_run_speculative(self):
+        """
+        Test that a straggling shard is duplicated on an idle agent, the first result is taken and the straggler is
+        cancelled
+        """
+        cancelled = threading.Event()
+        executed = []
+
+        def create_client(host, *_args, **_kwargs):
+            client = MagicMock()
+            client.cancel.side_effect = cancelled.set
+
+            # pylint: disable=unused-argument
+            def execute_suites(suites, robot_arg_dict, output_callback, artifact_paths):
+                if host == 'slow_host':
+                    cancelled.wait(5)
+                    raise RunCancelledError('Cancelled')
+                time.sleep(0.05)
+                executed.append(sorted(suite.name for suite in suites))
+                return self.save_output(host, artifact_paths)
+
+            client.execute_suites = execute_suites
+            return client
+
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class, \
+                patch('rfremoterunner.distributed.merge_results') as mock_merge_results, \
+                patch('rfremoterunner.distributed.STRAGGLER_MIN_SECONDS', 0), \
+                patch('rfremoterunner.distributed.STRAGGLER_CHECK_INTERVAL', 0.05):
+            mock_client_class.side_effect = create_client
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            test_obj = DistributedRun(['fast_host', 'slow_host'], speculative=True)
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(2, len(executed))
+        self.assertListEqual(['S-TS2', 'S-TS3', 'S-TS4', 'T-TS5', 'T-TS6', 'TS1'],
+                             sorted(name for names in executed for name in names))
+        self.assertEqual(2, len(mock_merge_results.call_args[0][0]))
+
+    def test_execute_run_shard_fails(self):
+        """
+        Test that execute_run() raises when a shard fails to execute on its agent
+        """
+        with patch('rfremoterunner.distributed.RemoteFrameworkClient') as mock_client_class:
+            mock_client_class.build_test_suite = RemoteFrameworkClient.build_test_suite
+            mock_client_class.return_value.execute_suites.side_effect = IOError('Connection refused')
+            test_obj = DistributedRun(['host1', 'host2'])
+            self.assertRaises(RuntimeError, test_obj.execute_run, [self.resource_dir], 'txt:robot', None, {})
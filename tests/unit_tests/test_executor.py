@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from rfremoterunner.executor import _execute_distributed_run
+from rfremoterunner.executor_argparser import ExecutorArgumentParser
+from rfremoterunner.metrics import PhaseTimings
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.suite_dir = os.path.join(os.path.dirname(__file__), 'rf_client_test_resources')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_execute_distributed_run_timings(self):
+        """
+        Test that a distributed run logs the timings of each phase added up across the shards, on this machine and on
+        the agents
+        """
+        arg_parser = ExecutorArgumentParser(['host1,host2', self.suite_dir, '--outputdir', self.output_dir])
+        timings = PhaseTimings()
+        timings.record('execute', 3.0)
+        agent_timings = PhaseTimings()
+        agent_timings.record('robot', 2.0)
+
+        with patch('rfremoterunner.executor.DistributedRun') as mock_distributed_run_class, \
+                patch('rfremoterunner.executor.write_results', return_value=0), \
+                patch('rfremoterunner.executor.logger') as mock_logger:
+            mock_distributed_run_class.return_value.timings = timings
+            mock_distributed_run_class.return_value.agent_timings = agent_timings
+            ret_code = _execute_distributed_run(arg_parser, lambda text: None)
+
+        self.assertEqual(0, ret_code)
+        logged = [call[0][0] for call in mock_logger.info.call_args_list]
+        self.assertIn('\nTimings on this machine, added up across the shards:\n'
+                      '  execute          3.000s', logged)
+        self.assertIn('Timings on the agents, added up across the shards:\n'
+                      '  robot            2.000s', logged)
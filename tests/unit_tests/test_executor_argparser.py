@@ -65,6 +65,63 @@ class TestExecutorArgumentParser(unittest.TestCase):
             sorted(['loglevel', 'include', 'test', 'exclude', 'suite', 'extension']),
             sorted(eap.robot_run_args.keys()))
 
+    def test_multiple_hosts(self):
+        """
+        Test that a comma separated list of hosts is split into the individual hosts
+        """
+        eap = ExecutorArgumentParser(['192.168.56.1,192.168.56.2:1472, 192.168.56.3', self.suite_dir])
+        self.assertListEqual(['192.168.56.1', '192.168.56.2:1472', '192.168.56.3'], eap.hosts)
+
+    def test_attach(self):
+        """
+        Test that --attach can be given multiple times, and isn't passed to robot
+        """
+        eap = ExecutorArgumentParser(['192.168.56.1', self.suite_dir, '--attach', 'data', '--attach', 'raw.dat'])
+        self.assertListEqual(['data', 'raw.dat'], eap.attach)
+        self.assertNotIn('attach', eap.robot_run_args)
+        self.assertIsNone(ExecutorArgumentParser(['192.168.56.1', self.suite_dir]).attach)
+
+    def test_priority(self):
+        """
+        Test that --priority only accepts the agent's priority lanes, and isn't passed to robot
+        """
+        eap = ExecutorArgumentParser(['192.168.56.1', self.suite_dir, '--priority', 'high'])
+        self.assertEqual('high', eap.priority)
+        self.assertNotIn('priority', eap.robot_run_args)
+        eap = ExecutorArgumentParser(['send', 'bundle.tar.gz', 'host1', '--priority', 'low'])
+        self.assertEqual('low', eap.priority)
+        self.assertIsNone(ExecutorArgumentParser(['192.168.56.1', self.suite_dir]).priority)
+        self.assertRaises(SystemExit, ExecutorArgumentParser, ['192.168.56.1', self.suite_dir, '--priority', 'urgent'])
+
+    def test_pack_and_send_commands(self):
+        """
+        Test that the pack and send commands take the bundle path, and that a bundle can't be sent to multiple hosts
+        """
+        eap = ExecutorArgumentParser(['pack', 'bundle.tar.gz', self.suite_dir, '-F', 'txt:robot', '-i', 'Tag1'])
+        self.assertEqual('pack', eap.command)
+        self.assertEqual('bundle.tar.gz', eap.bundle)
+        self.assertListEqual([self.suite_dir], eap.suites)
+        self.assertListEqual([], eap.hosts)
+        self.assertDictEqual({'extension': 'txt:robot', 'include': 'Tag1'}, eap.robot_run_args)
+
+        eap = ExecutorArgumentParser(['send', 'bundle.tar.gz', '192.168.56.1:1472', '-L', 'DEBUG', '-d', 'out'])
+        self.assertEqual('send', eap.command)
+        self.assertEqual('bundle.tar.gz', eap.bundle)
+        self.assertListEqual(['192.168.56.1:1472'], eap.hosts)
+        self.assertDictEqual({'loglevel': 'DEBUG'}, eap.robot_run_args)
+        self.assertEqual(os.path.abspath(os.path.join('out', 'remote_output.xml')),
+                         eap.get_output_xml_output_location())
+        self.assertRaises(SystemExit, ExecutorArgumentParser, ['send', 'bundle.tar.gz', 'host1,host2'])
+
+        self.assertEqual('run', ExecutorArgumentParser(['192.168.56.1', self.suite_dir]).command)
+
+    def test_single_host(self):
+        """
+        Test that a single host is given as a list of one host
+        """
+        eap = ExecutorArgumentParser(['192.168.56.1', self.suite_dir])
+        self.assertListEqual(['192.168.56.1'], eap.hosts)
+
     def test_get_log_html_output_location_default(self):
         """
         Test that get_log_html_output_location() returns the default location if one has not been specified
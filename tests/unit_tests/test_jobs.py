@@ -0,0 +1,193 @@
+import os
+import tempfile
+import threading
+import unittest
+from mock import patch
+
+from rfremoterunner.jobs import JobManager, Job, QueueFullError, parse_retry_after, DEFAULT_RETRY_AFTER_SECONDS
+
+
+class TestJobs(unittest.TestCase):
+
+    def test_job_execute_success(self):
+        """
+        Test that Job.execute() records the result of a successful job
+        """
+        job = Job(lambda job: {'ret_code': 0}, tempfile.gettempdir())
+        self.assertEqual('queued', job.get_status()['state'])
+        job.execute()
+        self.assertTrue(job.is_done())
+        self.assertEqual({'ret_code': 0}, job.result)
+        self.assertDictEqual({'job_id': job.job_id, 'state': 'finished'}, job.get_status())
+
+    def test_job_execute_failure(self):
+        """
+        Test that Job.execute() records the error of a failed job
+        """
+        def target(job):  # pylint: disable=unused-argument
+            raise ValueError('Bad workspace')
+
+        job = Job(target, tempfile.gettempdir())
+        job.execute()
+        self.assertTrue(job.is_done())
+        self.assertIsNone(job.result)
+        self.assertDictEqual({'job_id': job.job_id, 'state': 'failed', 'error': 'Bad workspace'}, job.get_status())
+
+    def test_job_manager_executes_in_order(self):
+        """
+        Test that a JobManager with a concurrency of 1 executes jobs one at a time in submission order
+        """
+        executed = []
+        release = threading.Event()
+        test_obj = JobManager(1)
+        self.addCleanup(test_obj.close)
+
+        first_job = test_obj.submit(lambda job: release.wait(5) and executed.append(1))
+        second_job = test_obj.submit(lambda job: executed.append(2))
+        self.assertFalse(second_job.wait(0.2))
+        self.assertEqual('queued', second_job.state)
+
+        release.set()
+        self.assertTrue(second_job.wait(5))
+        self.assertTrue(first_job.is_done())
+        self.assertListEqual([1, 2], executed)
+
+    def test_job_manager_priorities(self):
+        """
+        Test that queued jobs are executed by priority, and in submission order within a priority
+        """
+        executed = []
+        release = threading.Event()
+        test_obj = JobManager(1)
+        self.addCleanup(test_obj.close)
+
+        blocking_job = test_obj.submit(lambda job: release.wait(5))
+        while blocking_job.state == 'queued':
+            blocking_job.wait(0.01)
+        jobs = [test_obj.submit(lambda job, name=name: executed.append(name), priority)
+                for name, priority in [('low', 'low'), ('normal', 'normal'), ('high1', 'high'), ('high2', 'high')]]
+        self.assertListEqual([3, 2, 0, 1], [test_obj.get_queue_position(job) for job in jobs])
+        self.assertIsNone(test_obj.get_queue_position(blocking_job))
+        self.assertRaises(ValueError, test_obj.submit, lambda job: None, 'urgent')
+
+        release.set()
+        self.assertTrue(jobs[0].wait(5))
+        self.assertListEqual(['high1', 'high2', 'normal', 'low'], executed)
+
+    def test_job_manager_max_queued(self):
+        """
+        Test that a job is rejected with a retry time while the queue is full, and that cancelling a queued job makes
+        room for another
+        """
+        release = threading.Event()
+        test_obj = JobManager(1, max_queued=1)
+        self.addCleanup(test_obj.close)
+
+        running_job = test_obj.submit(lambda job: release.wait(5))
+        while running_job.state == 'queued':
+            running_job.wait(0.01)
+        queued_job = test_obj.submit(lambda job: None)
+        with self.assertRaises(QueueFullError) as context:
+            test_obj.submit(lambda job: None)
+        self.assertEqual(DEFAULT_RETRY_AFTER_SECONDS, context.exception.retry_after)
+        self.assertEqual(DEFAULT_RETRY_AFTER_SECONDS, parse_retry_after(str(context.exception)))
+
+        self.assertTrue(test_obj.cancel(queued_job.job_id))
+        accepted_job = test_obj.submit(lambda job: None)
+        release.set()
+        self.assertTrue(accepted_job.wait(5))
+        self.assertEqual('cancelled', queued_job.state)
+        self.assertEqual('finished', accepted_job.state)
+
+    def test_job_manager_get_and_remove(self):
+        """
+        Test that JobManager.get() raises a KeyError and the console output is deleted once a job has been removed
+        """
+        def target(job):
+            with open(job.console_path, 'wb') as file_handle:
+                file_handle.write(b'Console output')
+
+        test_obj = JobManager(1)
+        self.addCleanup(test_obj.close)
+        job = test_obj.submit(target)
+        self.assertIs(job, test_obj.get(job.job_id))
+        job.wait(5)
+        self.assertTrue(os.path.exists(job.console_path))
+
+        test_obj.remove(job.job_id)
+        self.assertRaises(KeyError, test_obj.get, job.job_id)
+        self.assertFalse(os.path.exists(job.console_path))
+
+    def test_job_manager_prunes_uncollected_jobs(self):
+        """
+        Test that finished jobs whose results are not collected within the retention period are discarded
+        """
+        test_obj = JobManager(1, retention_seconds=60)
+        self.addCleanup(test_obj.close)
+        job = test_obj.submit(lambda job: None)
+        job.wait(5)
+
+        with patch('rfremoterunner.jobs.time.time', return_value=job.finished_time + 61):
+            test_obj.submit(lambda job: None)
+        self.assertRaises(KeyError, test_obj.get, job.job_id)
+
+    def test_job_manager_on_job_done(self):
+        """
+        Test that the on_job_done callback is passed each job once it has finished, and that a callback that raises
+        doesn't stop later jobs from executing
+        """
+        done = []
+        callback_called = threading.Event()
+
+        def on_job_done(job):
+            done.append(job)
+            callback_called.set()
+            raise ValueError('Callback failed')
+
+        test_obj = JobManager(1, on_job_done=on_job_done)
+        self.addCleanup(test_obj.close)
+        first_job = test_obj.submit(lambda job: None)
+        self.assertTrue(callback_called.wait(5))
+        callback_called.clear()
+        second_job = test_obj.submit(lambda job: None)
+        self.assertTrue(callback_called.wait(5))
+        self.assertListEqual([first_job, second_job], done)
+        self.assertEqual('finished', first_job.state)
+
+    def test_job_cancel_queued(self):
+        """
+        Test that a job cancelled before it starts is not executed and its cleanup is called instead
+        """
+        executed = []
+        cleaned_up = []
+        job = Job(lambda job: executed.append(1), tempfile.gettempdir(), cleanup=lambda: cleaned_up.append(1))
+        self.assertTrue(job.cancel())
+        self.assertListEqual([1], cleaned_up)
+        self.assertTrue(job.is_done())
+        self.assertEqual('cancelled', job.get_status()['state'])
+        job.execute()
+        self.assertListEqual([], executed)
+        self.assertEqual('cancelled', job.get_status()['state'])
+        self.assertFalse(job.cancel())
+
+    def test_job_cancel_running(self):
+        """
+        Test that cancelling a running job calls its cancel handler, including one registered after the cancel
+        """
+        stop = threading.Event()
+
+        def target(job):
+            job.set_cancel_handler(stop.set)
+            stop.wait(5)
+            job.set_cancel_handler(None)
+            raise RuntimeError('Stopped')
+
+        test_obj = JobManager(1)
+        self.addCleanup(test_obj.close)
+        job = test_obj.submit(target)
+        while job.state == 'queued':
+            job.wait(0.01)
+        self.assertTrue(test_obj.cancel(job.job_id))
+        self.assertTrue(job.wait(5))
+        self.assertTrue(stop.is_set())
+        self.assertEqual('cancelled', job.get_status()['state'])
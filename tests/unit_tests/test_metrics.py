@@ -0,0 +1,76 @@
+import unittest
+
+from rfremoterunner.metrics import PhaseTimings, MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_phase_timings(self):
+        """
+        Test that PhaseTimings adds up the time and bytes of each phase and keeps the order the phases happened in
+        """
+        test_obj = PhaseTimings()
+        with test_obj.phase('package'):
+            pass
+        test_obj.record('upload', 1.5)
+        test_obj.record('upload', 0.5)
+        test_obj.add_bytes('upload', 100)
+        test_obj.add_bytes('upload', 20)
+        self.assertListEqual(['package', 'upload'], list(test_obj.durations.keys()))
+        self.assertEqual(2.0, test_obj.durations['upload'])
+        self.assertDictEqual({'upload': 120}, test_obj.as_dict()['bytes'])
+
+    def test_phase_timings_add(self):
+        """
+        Test that add() totals the time and bytes of each phase with those of another run
+        """
+        test_obj = PhaseTimings()
+        test_obj.record('upload', 1.0)
+        test_obj.add_bytes('upload', 100)
+        test_obj.add({'durations': {'upload': 0.5, 'execute': 2.0}, 'bytes': {'upload': 20}})
+        self.assertDictEqual({'durations': {'upload': 1.5, 'execute': 2.0}, 'bytes': {'upload': 120}},
+                             test_obj.as_dict())
+
+    def test_format_summary(self):
+        """
+        Test that format_summary() lists the phases in the order given followed by any others, with their bytes
+        """
+        timings = {'durations': {'robot': 2.0, 'queue': 0.25, 'extra': 1.0}, 'bytes': {'robot': 1234}}
+        self.assertEqual('Timings:\n'
+                         '  queue            0.250s\n'
+                         '  robot            2.000s          1,234 bytes\n'
+                         '  extra            1.000s',
+                         PhaseTimings.format_summary('Timings:', timings, ['queue', 'robot', 'artifacts']))
+
+    def test_render(self):
+        """
+        Test that a registry renders its counters and histograms in the Prometheus text format
+        """
+        test_obj = MetricsRegistry()
+        runs = test_obj.counter('runs_total', 'Runs', label_name='state')
+        sent = test_obj.counter('sent_bytes_total', 'Bytes sent')
+        duration = test_obj.histogram('duration_seconds', 'Duration', buckets=(1, 10))
+        runs.inc(label='finished')
+        runs.inc(label='finished')
+        runs.inc(label='failed')
+        duration.observe(0.5)
+        duration.observe(5)
+        duration.observe(50)
+
+        self.assertEqual(2, runs.get('finished'))
+        self.assertEqual(0, sent.get())
+        self.assertEqual('# HELP runs_total Runs\n'
+                         '# TYPE runs_total counter\n'
+                         'runs_total{state="finished"} 2\n'
+                         'runs_total{state="failed"} 1\n'
+                         '# HELP sent_bytes_total Bytes sent\n'
+                         '# TYPE sent_bytes_total counter\n'
+                         'sent_bytes_total 0\n'
+                         '# HELP duration_seconds Duration\n'
+                         '# TYPE duration_seconds histogram\n'
+                         'duration_seconds_bucket{le="1.0"} 1\n'
+                         'duration_seconds_bucket{le="10.0"} 2\n'
+                         'duration_seconds_bucket{le="+Inf"} 3\n'
+                         'duration_seconds_sum 55.5\n'
+                         'duration_seconds_count 3\n',
+                         test_obj.render())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from robot.api import TestSuiteBuilder
+
+from rfremoterunner.packaging_cache import PackagingCache
+from rfremoterunner.rf_client import RemoteFrameworkClient
+
+
+class TestPackagingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.workspace, 'cache.json')
+        self.file_path = os.path.join(self.workspace, 'suite.robot')
+        with open(self.file_path, 'wb') as file_handle:
+            file_handle.write(b'*** Test Cases ***\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_put_and_get(self):
+        """
+        Test that a scan recorded with put() is returned by get() after the cache has been saved and reloaded
+        """
+        test_obj = PackagingCache(self.cache_path)
+        self.assertIsNone(test_obj.get(self.file_path))
+        test_obj.put(self.file_path, 'data', [('Library', 'Process', 'Process', None)])
+        test_obj.save()
+
+        test_obj = PackagingCache(self.cache_path)
+        self.assertEqual(('data', [('Library', 'Process', 'Process', None)]), test_obj.get(self.file_path))
+        self.assertEqual(1, test_obj.hits)
+        self.assertEqual(0, test_obj.misses)
+
+    def test_get_file_changed(self):
+        """
+        Test that get() ignores the recorded scan once the file has been modified
+        """
+        test_obj = PackagingCache(self.cache_path)
+        test_obj.put(self.file_path, 'data', [])
+        with open(self.file_path, 'ab') as file_handle:
+            file_handle.write(b'TC1\n    Log    Hello\n')
+        self.assertIsNone(test_obj.get(self.file_path))
+        self.assertEqual(1, test_obj.misses)
+
+    def test_get_import_removed(self):
+        """
+        Test that get() ignores the recorded scan once a file it imports no longer exists
+        """
+        test_obj = PackagingCache(self.cache_path)
+        test_obj.put(self.file_path, 'data', [('Resource', 'res.robot', 'res.robot',
+                                               os.path.join(self.workspace, 'res.robot'))])
+        self.assertIsNone(test_obj.get(self.file_path))
+
+    def test_invalid_cache_file(self):
+        """
+        Test that a cache file that can't be parsed is ignored
+        """
+        with open(self.cache_path, 'wb') as file_handle:
+            file_handle.write(b'not json')
+        self.assertIsNone(PackagingCache(self.cache_path).get(self.file_path))
+
+    def test_client_packaging_matches_uncached(self):
+        """
+        Test that a client packaging suites from the cache produces the same files as one that parses them
+        """
+        resource_dir = os.path.join(os.path.dirname(__file__), 'rf_client_test_resources')
+        suites = TestSuiteBuilder().build(resource_dir).suites
+
+        uncached_client = RemoteFrameworkClient('127.0.0.1')
+        for suite in suites:
+            uncached_client._package_suite_hierarchy(suite)
+
+        caches = []
+        for _ in range(2):
+            packaging_cache = PackagingCache(self.cache_path)
+            client = RemoteFrameworkClient('127.0.0.1', packaging_cache=packaging_cache)
+            for suite in suites:
+                client._package_suite_hierarchy(suite)
+            packaging_cache.save()
+            caches.append(packaging_cache)
+            self.assertEqual(uncached_client._suites, client._suites)
+            self.assertEqual(uncached_client._dependencies, client._dependencies)
+
+        self.assertEqual(0, caches[0].hits)
+        self.assertEqual(0, caches[1].misses)
+        self.assertEqual(caches[0].misses, caches[1].hits)
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from six import StringIO
+from robot import run
+
+from rfremoterunner.results import merge_results, write_results, generate_log_and_report
+
+
+class TestResults(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def run_shard(self, shard_name, suites):
+        """
+        Helper function that executes part of a suite tree in the same way the agent does and returns the path to the
+        output xml
+
+        :param shard_name: Name of the shard, used to keep the shard workspaces separate
+        :type shard_name: str
+        :param suites: Dictionary of suite paths relative to the root of the suite tree to their test case names
+        :type suites: dict
+
+        :return: Path to the output xml
+        :rtype: str
+        """
+        shard_dir = os.path.join(self.workspace, shard_name)
+        for rel_path, test_names in suites.items():
+            suite_path = os.path.join(shard_dir, rel_path)
+            if not os.path.exists(os.path.dirname(suite_path)):
+                os.makedirs(os.path.dirname(suite_path))
+            with open(suite_path, 'wb') as file_handle:
+                file_handle.write(b'*** Test Cases ***\n')
+                for test_name in test_names:
+                    file_handle.write('{0}\n    Log    {0}\n'.format(test_name).encode('utf-8'))
+
+        output_path = os.path.join(shard_dir, 'output.xml')
+        run(shard_dir, name='Root', output=output_path, log='NONE', report='NONE', stdout=StringIO(), stderr=StringIO())
+        return output_path
+
+    def test_merge_results(self):
+        """
+        Test that merge_results() merges suites with the same name and keeps the order robot would execute them in
+        """
+        shard_1 = self.run_shard('shard_1', {'Tests/A/TS2.robot': ['TC2'], 'Tests/TS4.robot': ['TC4']})
+        shard_2 = self.run_shard('shard_2', {'Tests/A/TS1.robot': ['TC1'], 'Tests/A/TS3.robot': ['TC3', 'TC3b']})
+
+        result = merge_results([shard_1, shard_2])
+
+        self.assertEqual('Root', result.suite.name)
+        self.assertListEqual(['Tests'], [suite.name for suite in result.suite.suites])
+        tests_suite = result.suite.suites[0]
+        self.assertListEqual(['A', 'TS4'], [suite.name for suite in tests_suite.suites])
+        self.assertListEqual(['TS1', 'TS2', 'TS3'], [suite.name for suite in tests_suite.suites[0].suites])
+        self.assertEqual(5, result.statistics.total.passed)
+        self.assertEqual(0, result.statistics.total.failed)
+
+    def test_merge_results_no_results(self):
+        """
+        Test that merge_results() raises a ValueError when there is nothing to merge
+        """
+        self.assertRaises(ValueError, merge_results, [])
+
+    def test_write_results(self):
+        """
+        Test that write_results() writes the output xml, log html and report html
+        """
+        result = merge_results([self.run_shard('shard_1', {'Tests/TS1.robot': ['TC1']})])
+        output_dir = os.path.join(self.workspace, 'results')
+        os.makedirs(output_dir)
+        paths = [os.path.join(output_dir, name) for name in ['out.xml', 'log.html', 'report.html']]
+
+        ret_code = write_results(result, *paths)
+
+        self.assertEqual(0, ret_code)
+        for path in paths:
+            self.assertTrue(os.path.exists(path))
+
+    def test_generate_log_and_report(self):
+        """
+        Test that generate_log_and_report() generates the log html and report html from an output xml
+        """
+        output_path = self.run_shard('shard_1', {'Tests/TS1.robot': ['TC1']})
+        log_path = os.path.join(self.workspace, 'log.html')
+        report_path = os.path.join(self.workspace, 'report.html')
+
+        ret_code = generate_log_and_report(output_path, log_path, report_path)
+
+        self.assertEqual(0, ret_code)
+        self.assertTrue(os.path.exists(log_path))
+        self.assertTrue(os.path.exists(report_path))
@@ -1,11 +1,19 @@
 from io import open
+import io
 import os
+import shutil
+import tarfile
+import tempfile
 import unittest
 import six.moves.xmlrpc_client as xmlrpc_client
 from mock import patch, MagicMock
 from robot.api import TestSuiteBuilder
 
-from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.rf_client import RemoteFrameworkClient, RunCancelledError
+from rfremoterunner.utils import calculate_digest, collect_test_suites
+
+# Fault raised by an agent that pre-dates get_capabilities()
+LEGACY_AGENT_FAULT = xmlrpc_client.Fault(1, '<class \'Exception\'>:method "get_capabilities" is not supported')
 
 
 class TestRemoteFrameworkClient(unittest.TestCase):
@@ -83,6 +91,7 @@ class TestRemoteFrameworkClient(unittest.TestCase):
         expected_args = {'include': 'Tag1'}
 
         mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(side_effect=LEGACY_AGENT_FAULT)
         mock_server_proxy.execute_robot_run = MagicMock()
 
         with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
@@ -96,12 +105,557 @@ class TestRemoteFrameworkClient(unittest.TestCase):
                                                                         expected_args,
                                                                         False)
 
+    def test_execute_run_content_addressed_upload(self):
+        """
+        Test that execute_run() sends a manifest of content digests and only uploads the files the agent is missing when
+        the agent supports content addressed uploads
+        """
+        res1_digest = calculate_digest('*** Settings ***\nResource    Res2.robot\nLibrary    Lib3.py\n\n*** Keywords '
+                                       '***\nRes1 Keyword1\n    Log    K1\n')
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(return_value=['content_addressed_upload'])
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=[res1_digest])
+        mock_server_proxy.upload_blobs = MagicMock()
+        mock_server_proxy.execute_manifest_run = MagicMock()
+        mock_server_proxy.execute_robot_run = MagicMock()
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        mock_server_proxy.execute_robot_run.assert_not_called()
+        # Only the missing file is uploaded
+        uploaded = mock_server_proxy.upload_blobs.call_args[0][0]
+        self.assertListEqual([res1_digest], list(uploaded.keys()))
+        # Every file is listed in the manifest by its path relative to the workspace
+        manifest, robot_args, debug = mock_server_proxy.execute_manifest_run.call_args[0]
+        self.assertEqual(res1_digest, manifest['Res1.robot'])
+        self.assertListEqual(sorted(['Lib1.py', 'Lib2.py', 'Lib3.py', 'Res1.robot', 'Res2.robot', 'Res3.resource',
+                                     'Rf Client Test Resources/TS1.robot',
+                                     'Rf Client Test Resources/Secondary Test Suites/S-TS2.robot',
+                                     'Rf Client Test Resources/Secondary Test Suites/S-TS3.txt',
+                                     'Rf Client Test Resources/Secondary Test Suites/S-TS4.robot',
+                                     'Rf Client Test Resources/Secondary Test Suites/Tertiary Test Suites/T-TS5.robot',
+                                     'Rf Client Test Resources/Secondary Test Suites/Tertiary Test Suites/T-TS6.txt']),
+                             sorted(manifest.keys()))
+        self.assertDictEqual({}, robot_args)
+        self.assertFalse(debug)
+
+    def test_execute_run_bundle_upload(self):
+        """
+        Test that execute_run() streams the suites, dependencies and attachments to the agent as a single bundle and
+        submits the run with its ID when the agent supports bundle uploads
+        """
+        attachment_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, attachment_dir)
+        os.makedirs(os.path.join(attachment_dir, 'data', 'sub'))
+        with open(os.path.join(attachment_dir, 'data', 'sub', 'blob.bin'), 'wb') as file_handle:
+            file_handle.write(b'\xff\xfe\x00')
+        with open(os.path.join(attachment_dir, 'raw.dat'), 'wb') as file_handle:
+            file_handle.write(b'\x00\x01')
+
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'binary_transport', 'bundle_upload'])
+        mock_server_proxy.get_missing_blobs = MagicMock()
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(return_value={'ret_code': 0})
+        mock_transport = MagicMock()
+        bundles = []
+
+        def upload_bundle(write_bundle):
+            bundle = io.BytesIO()
+            write_bundle(bundle)
+            bundles.append(bundle.getvalue())
+            return 'bundle1', len(bundles[-1])
+
+        mock_transport.upload_bundle.side_effect = upload_bundle
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.create_transport', return_value=mock_transport):
+            test_obj = RemoteFrameworkClient('127.0.0.1', attachments=[os.path.join(attachment_dir, 'raw.dat'),
+                                                                       os.path.join(attachment_dir, 'data')])
+            test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        mock_server_proxy.get_missing_blobs.assert_not_called()
+        manifest, _, options = mock_server_proxy.submit_run.call_args[0]
+        self.assertDictEqual({}, manifest)
+        self.assertEqual('bundle1', options['bundle'])
+        self.assertEqual(len(bundles[0]), test_obj.timings.byte_counts['upload'])
+        with tarfile.open(fileobj=io.BytesIO(bundles[0])) as tar:
+            names = tar.getnames()
+            self.assertEqual(b'\xff\xfe\x00', tar.extractfile('data/sub/blob.bin').read())
+        self.assertIn('Res1.robot', names)
+        self.assertIn('Rf Client Test Resources/Secondary Test Suites/S-TS2.robot', names)
+        self.assertIn('raw.dat', names)
+
+    def test_build_manifest_attachments(self):
+        """
+        Test that attachments are listed in the manifest and uploaded as they are, and that a missing attachment raises
+        an error
+        """
+        attachment_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, attachment_dir)
+        attachment_path = os.path.join(attachment_dir, 'raw.dat')
+        with open(attachment_path, 'wb') as file_handle:
+            file_handle.write(b'\xff\xfe\x00')
+
+        test_obj = RemoteFrameworkClient('127.0.0.1', attachments=[attachment_path])
+        manifest, blobs = test_obj._build_manifest()
+        self.assertDictEqual({'raw.dat': calculate_digest(b'\xff\xfe\x00')}, manifest)
+        self.assertEqual(b'\xff\xfe\x00', blobs[manifest['raw.dat']])
+
+        test_obj = RemoteFrameworkClient('127.0.0.1', attachments=[os.path.join(attachment_dir, 'missing')])
+        self.assertRaises(IOError, test_obj._build_manifest)
+
+    def test_pack_and_execute_bundle(self):
+        """
+        Test that pack() writes the suites and their dependencies to a bundle file, and that execute_bundle() sends the
+        file as it is to an agent that supports bundle uploads, or its contents to one that only supports digests
+        """
+        bundle_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bundle_dir)
+        bundle_path = os.path.join(bundle_dir, 'bundle.tar.gz')
+        count = RemoteFrameworkClient(None).pack([self.resource_dir], 'txt:robot', None, {}, bundle_path)
+        with tarfile.open(bundle_path, 'r:gz') as tar:
+            names = tar.getnames()
+        self.assertEqual(len(names), count)
+        self.assertIn('Res1.robot', names)
+
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=[])
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(return_value={'ret_code': 0})
+        mock_transport = MagicMock()
+        uploads = []
+
+        def upload_bundle(write_bundle, encoding=None):
+            bundle = io.BytesIO()
+            write_bundle(bundle)
+            uploads.append((bundle.getvalue(), encoding))
+            return 'bundle1', len(uploads[-1][0])
+
+        mock_transport.upload_bundle.side_effect = upload_bundle
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.create_transport', return_value=mock_transport):
+            mock_server_proxy.get_capabilities = MagicMock(
+                return_value=['content_addressed_upload', 'async_jobs', 'binary_transport', 'bundle_upload'])
+            RemoteFrameworkClient('127.0.0.1').execute_bundle(bundle_path, {'include': 'Tag1'})
+            manifest, robot_args, options = mock_server_proxy.submit_run.call_args[0]
+            self.assertDictEqual({}, manifest)
+            self.assertDictEqual({'extension': 'txt:robot', 'include': 'Tag1'}, robot_args)
+            self.assertEqual('bundle1', options['bundle'])
+            with open(bundle_path, 'rb') as file_handle:
+                self.assertListEqual([(file_handle.read(), 'gzip')], uploads)
+
+            mock_server_proxy.get_capabilities = MagicMock(return_value=['content_addressed_upload', 'async_jobs'])
+            RemoteFrameworkClient('127.0.0.1').execute_bundle(bundle_path, {})
+            manifest, robot_args, options = mock_server_proxy.submit_run.call_args[0]
+            self.assertListEqual(sorted(names), sorted(manifest))
+            self.assertNotIn('bundle', options)
+
+            mock_server_proxy.get_capabilities = MagicMock(return_value=[])
+            self.assertRaises(RuntimeError, RemoteFrameworkClient('127.0.0.1').execute_bundle, bundle_path, {})
+
+    def test_execute_run_async_job(self):
+        """
+        Test that execute_run() submits the run as a job and polls until it has finished when the agent supports
+        asynchronous jobs
+        """
+        expected_result = {'ret_code': 0}
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(return_value=['content_addressed_upload', 'async_jobs'])
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=[])
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(side_effect=[{'job_id': 'job1', 'state': 'queued'},
+                                                                  {'job_id': 'job1', 'state': 'running'},
+                                                                  {'job_id': 'job1', 'state': 'finished'}])
+        mock_server_proxy.get_job_result = MagicMock(return_value=expected_result)
+        mock_server_proxy.execute_manifest_run = MagicMock()
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.time.sleep') as patched_sleep:
+            test_obj = RemoteFrameworkClient('127.0.0.1', debug=True)
+            actual_result = test_obj.execute_run([self.resource_dir], 'txt:robot', None, {'include': 'Tag1'})
+
+        self.assertEqual(expected_result, actual_result)
+        mock_server_proxy.execute_manifest_run.assert_not_called()
+        self.assertEqual({'include': 'Tag1'}, mock_server_proxy.submit_run.call_args[0][1])
+        self.assertEqual({'debug': True, 'chunked_artifacts': False}, mock_server_proxy.submit_run.call_args[0][2])
+        mock_server_proxy.get_job_result.assert_called_once_with('job1')
+        # The poll interval backs off
+        self.assertEqual(2, patched_sleep.call_count)
+        self.assertLess(patched_sleep.call_args_list[0][0][0], patched_sleep.call_args_list[1][0][0])
+
+    def test_execute_run_warm_workspace(self):
+        """
+        Test that execute_run() only sends the files that differ from the agent's persistent workspace
+        """
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'warm_workspaces'])
+        mock_server_proxy.get_workspace_state = MagicMock(return_value={'revision': 'r0', 'manifest': {}})
+        mock_server_proxy.get_missing_blobs = MagicMock(side_effect=lambda digests: digests)
+        mock_server_proxy.upload_blobs = MagicMock()
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(return_value={'ret_code': 0})
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            RemoteFrameworkClient('127.0.0.1', workspace='ws1').execute_run([self.resource_dir], 'txt:robot', None, {})
+            manifest, _, options = mock_server_proxy.submit_run.call_args[0]
+            self.assertEqual({'name': 'ws1', 'base_revision': 'r0', 'deleted_paths': []}, options['workspace'])
+            self.assertEqual(len(set(manifest.values())), len(mock_server_proxy.upload_blobs.call_args[0][0]))
+
+            # Nothing has changed since the last run apart from a file that has since been removed
+            held = dict(manifest, **{'Removed.robot': calculate_digest(b'removed')})
+            mock_server_proxy.get_workspace_state = MagicMock(return_value={'revision': 'r1', 'manifest': held})
+            mock_server_proxy.upload_blobs.reset_mock()
+            RemoteFrameworkClient('127.0.0.1', workspace='ws1').execute_run([self.resource_dir], 'txt:robot', None, {})
+
+        manifest, _, options = mock_server_proxy.submit_run.call_args[0]
+        self.assertEqual({}, manifest)
+        self.assertEqual({'name': 'ws1', 'base_revision': 'r1', 'deleted_paths': ['Removed.robot']},
+                         options['workspace'])
+        mock_server_proxy.upload_blobs.assert_not_called()
+
+    def test_submit_run_retries_when_queue_full(self):
+        """
+        Test that the run is queued with its priority, and submitted again after the time the agent gives when it
+        rejects the run because its queue is full
+        """
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'priority_queue'])
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=[])
+        queue_full = xmlrpc_client.Fault(429, 'The agent already has 4 runs queued. Retry after 3 seconds')
+        mock_server_proxy.submit_run = MagicMock(side_effect=[queue_full, queue_full, 'job1'])
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(return_value={'ret_code': 0})
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1', priority='high')
+            test_obj._cancelled = MagicMock()
+            test_obj._cancelled.is_set.return_value = False
+            test_obj._cancelled.wait.return_value = False
+            self.assertEqual(0, test_obj.execute_run([self.resource_dir], 'txt:robot', None, {})['ret_code'])
+            self.assertEqual(3, mock_server_proxy.submit_run.call_count)
+            test_obj._cancelled.wait.assert_called_with(3)
+            self.assertEqual('high', mock_server_proxy.submit_run.call_args[0][2]['priority'])
+
+            # Cancelling while waiting to retry stops the run, and other faults aren't retried
+            mock_server_proxy.submit_run = MagicMock(side_effect=queue_full)
+            test_obj._cancelled.wait.return_value = True
+            self.assertRaises(RunCancelledError, test_obj._submit_run, {}, {}, {})
+            mock_server_proxy.submit_run = MagicMock(side_effect=xmlrpc_client.Fault(1, 'Unknown priority'))
+            self.assertRaises(xmlrpc_client.Fault, test_obj._submit_run, {}, {}, {})
+            self.assertEqual(1, mock_server_proxy.submit_run.call_count)
+
+    def test_wait_for_job_streams_output(self):
+        """
+        Test that _wait_for_job() passes the robot output to the callback as it arrives, including multi-byte characters
+        split across chunks
+        """
+        encoded_output = u'Line 1 ß\nLine 2\n'.encode('utf-8')
+        split_at = encoded_output.index(u'ß'.encode('utf-8')) + 1
+        output_chunks = {
+            0: {'data': xmlrpc_client.Binary(encoded_output[:split_at]), 'offset': split_at},
+            split_at: {'data': xmlrpc_client.Binary(encoded_output[split_at:]), 'offset': len(encoded_output)},
+            len(encoded_output): {'data': xmlrpc_client.Binary(b''), 'offset': len(encoded_output)}
+        }
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'streaming_output'])
+        mock_server_proxy.get_job_status = MagicMock(side_effect=[{'job_id': 'job1', 'state': 'running'},
+                                                                  {'job_id': 'job1', 'state': 'finished'}])
+        mock_server_proxy.get_job_output = MagicMock(side_effect=lambda job_id, offset: output_chunks[offset])
+        mock_server_proxy.get_job_result = MagicMock(return_value={'ret_code': 0})
+        received_output = []
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.time.sleep'):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            test_obj._wait_for_job('job1', received_output.append)
+
+        self.assertEqual(u'Line 1 ß\nLine 2\n', ''.join(received_output))
+        self.assertListEqual([u'Line 1 ', u'ß\nLine 2\n'], received_output)
+
+    def test_wait_for_job_cancelled(self):
+        """
+        Test that _wait_for_job() asks the agent to cancel the job and raises once cancel() has been called
+        """
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'cancel_jobs'])
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'running'})
+        mock_server_proxy.cancel_job = MagicMock(return_value={'job_id': 'job1', 'state': 'cancelled'})
+        mock_server_proxy.get_job_result = MagicMock()
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.time.sleep') as patched_sleep:
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            patched_sleep.side_effect = lambda interval: test_obj.cancel()
+            self.assertRaises(RunCancelledError, test_obj._wait_for_job, 'job1')
+
+        mock_server_proxy.cancel_job.assert_called_once_with('job1')
+        mock_server_proxy.get_job_result.assert_not_called()
+
+    def test_execute_run_chunked_artifacts(self):
+        """
+        Test that execute_run() downloads the artifacts straight to disk and releases the job when artifact paths are
+        given and the agent supports chunked artifacts
+        """
+        output_xml = b'<robot>' + b'x' * 20 + b'</robot>'
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'chunked_artifacts'])
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=[])
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(
+            return_value={'ret_code': 0, 'artifact_sizes': {'output_xml': len(output_xml)}})
+        mock_server_proxy.read_artifact = MagicMock(
+            side_effect=lambda job_id, name, offset: {'data': xmlrpc_client.Binary(output_xml[offset:offset + 8]),
+                                                      'offset': min(offset + 8, len(output_xml))})
+        mock_server_proxy.release_job = MagicMock(return_value=True)
+        workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workspace)
+        artifact_paths = {'output_xml': os.path.join(workspace, 'output.xml'),
+                          'log_html': os.path.join(workspace, 'log.html')}
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            result = test_obj.execute_run([self.resource_dir], 'txt:robot', None, {}, artifact_paths=artifact_paths)
+
+        self.assertTrue(mock_server_proxy.submit_run.call_args[0][2]['chunked_artifacts'])
+        self.assertDictEqual({'ret_code': 0, 'artifact_paths': {'output_xml': artifact_paths['output_xml']}}, result)
+        with open(artifact_paths['output_xml'], 'rb') as file_handle:
+            self.assertEqual(output_xml, file_handle.read())
+        self.assertFalse(os.path.exists(artifact_paths['log_html']))
+        mock_server_proxy.release_job.assert_called_once_with('job1')
+
+    def test_execute_run_records_timings(self):
+        """
+        Test that execute_run() records the duration of each phase of the run and the bytes uploaded and downloaded,
+        and keeps the timings reported by the agent out of the result
+        """
+        output_xml = b'<robot/>'
+        agent_timings = {'durations': {'queue': 0.5, 'robot': 2.0}, 'bytes': {'artifacts': len(output_xml)}}
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(
+            return_value=['content_addressed_upload', 'async_jobs', 'chunked_artifacts'])
+        mock_server_proxy.get_missing_blobs = MagicMock(side_effect=lambda digests: digests)
+        mock_server_proxy.upload_blobs = MagicMock()
+        mock_server_proxy.submit_run = MagicMock(return_value='job1')
+        mock_server_proxy.get_job_status = MagicMock(return_value={'job_id': 'job1', 'state': 'finished'})
+        mock_server_proxy.get_job_result = MagicMock(return_value={
+            'ret_code': 0, 'artifact_sizes': {'output_xml': len(output_xml)}, 'timings': agent_timings})
+        mock_server_proxy.read_artifact = MagicMock(
+            side_effect=lambda job_id, name, offset: {'data': xmlrpc_client.Binary(output_xml[offset:]),
+                                                      'offset': len(output_xml)})
+        mock_server_proxy.release_job = MagicMock(return_value=True)
+        workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workspace)
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            result = test_obj.execute_run([self.resource_dir], 'txt:robot', None, {},
+                                          artifact_paths={'output_xml': os.path.join(workspace, 'output.xml')})
+
+        self.assertNotIn('timings', result)
+        self.assertEqual(agent_timings, test_obj.agent_timings)
+        self.assertListEqual(['build', 'package', 'upload', 'execute', 'download'],
+                             list(test_obj.timings.durations.keys()))
+        uploaded = sum(len(data.data) for call in mock_server_proxy.upload_blobs.call_args_list
+                       for data in call[0][0].values())
+        self.assertEqual({'upload': uploaded, 'download': len(output_xml)}, dict(test_obj.timings.byte_counts))
+
+    def test_execute_run_legacy_agent_saves_artifacts(self):
+        """
+        Test that execute_run() saves the artifacts returned in the result when artifact paths are given and the agent
+        doesn't support chunked artifacts
+        """
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(side_effect=LEGACY_AGENT_FAULT)
+        mock_server_proxy.execute_robot_run = MagicMock(return_value={
+            'ret_code': 0, 'std_out_err': xmlrpc_client.Binary(b'Output'),
+            'output_xml': xmlrpc_client.Binary(b'<robot/>'), 'log_html': xmlrpc_client.Binary(b'<html/>'),
+            'report_html': xmlrpc_client.Binary(b'')})
+        workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workspace)
+        artifact_paths = dict((name, os.path.join(workspace, name)) for name in ['output_xml', 'log_html',
+                                                                                 'report_html'])
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            result = test_obj.execute_run([self.resource_dir], 'txt:robot', None, {}, artifact_paths=artifact_paths)
+
+        self.assertEqual(0, result['ret_code'])
+        self.assertEqual(b'Output', result['std_out_err'].data)
+        self.assertListEqual(['log_html', 'output_xml'], sorted(result['artifact_paths'].keys()))
+        self.assertNotIn('output_xml', result)
+        with open(artifact_paths['output_xml'], 'rb') as file_handle:
+            self.assertEqual(b'<robot/>', file_handle.read())
+        self.assertFalse(os.path.exists(artifact_paths['report_html']))
+
+    def test_prefetch_robot_files(self):
+        """
+        Test that _prefetch_robot_files() reads every file the suites need, and that packaging from the prefetched
+        files gives the same result as packaging them one at a time
+        """
+        root_suite = TestSuiteBuilder().build(self.resource_dir)
+        sequential_client = RemoteFrameworkClient('127.0.0.1')
+        sequential_client._package_suite_hierarchy(root_suite)
+
+        self.test_obj._prefetch_robot_files(collect_test_suites(root_suite))
+        with patch('rfremoterunner.rf_client.read_file_from_disk', side_effect=AssertionError('File read again')):
+            self.test_obj._package_suite_hierarchy(root_suite)
+
+        self.assertEqual(sequential_client._suites, self.test_obj._suites)
+        self.assertEqual(sequential_client._dependencies, self.test_obj._dependencies)
+
+    def test_prefetch_robot_files_missing_import(self):
+        """
+        Test that a file that can't be scanned ahead of time still raises its error when it is packaged
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        suite_path = os.path.join(temp_dir, 'suite.robot')
+        with open(suite_path, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(u'*** Settings ***\nResource    missing.robot\n\n'
+                              u'*** Test Cases ***\nTC1\n    No Operation\n')
+        suite = TestSuiteBuilder().build(suite_path)
+
+        self.test_obj._prefetch_robot_files([suite])
+        self.assertRaises(Exception, self.test_obj._package_suite_hierarchy, suite)
+
+    def test_package_duplicate_filename_missing_import(self):
+        """
+        Test that an import of a filename that has already been packaged isn't looked up, so it doesn't fail when it
+        can't be found
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        os.makedirs(os.path.join(temp_dir, 'common'))
+        with open(os.path.join(temp_dir, 'common', 'shared.resource'), 'w', encoding='utf-8') as file_handle:
+            file_handle.write(u'*** Keywords ***\nShared Keyword\n    No Operation\n')
+        suite_path = os.path.join(temp_dir, 'suite.robot')
+        with open(suite_path, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(u'*** Settings ***\nResource    common/shared.resource\n'
+                              u'Resource    gone/shared.resource\n\n'
+                              u'*** Test Cases ***\nTC1\n    Shared Keyword\n')
+        suite = TestSuiteBuilder().build(suite_path)
+
+        self.test_obj._prefetch_robot_files([suite])
+        self.test_obj._package_suite_hierarchy(suite)
+
+        self.assertListEqual(['shared.resource'], list(self.test_obj._dependencies))
+
+    def test_process_robot_file_uses_parsed_imports(self):
+        """
+        Test that the imports of a test suite are taken from robot's parsed model, so that library arguments are kept
+        and lines that only mention a library or resource aren't rewritten
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        os.makedirs(os.path.join(temp_dir, 'libs'))
+        with open(os.path.join(temp_dir, 'libs', 'MyLib.py'), 'w', encoding='utf-8') as file_handle:
+            file_handle.write(u'def my_keyword(arg):\n    pass\n')
+        suite_path = os.path.join(temp_dir, 'suite.robot')
+        with open(suite_path, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(u'*** Settings ***\n'
+                              u'Library    libs/MyLib.py    arg1\n\n'
+                              u'*** Test Cases ***\n'
+                              u'TC1\n'
+                              u'    Log    Library    libs/other.py\n')
+        suite = TestSuiteBuilder().build(suite_path)
+
+        suite_data = self.test_obj._process_robot_file(suite)
+
+        self.assertEqual(u'*** Settings ***\n'
+                         u'Library    MyLib.py    arg1\n\n'
+                         u'*** Test Cases ***\n'
+                         u'TC1\n'
+                         u'    Log    Library    libs/other.py\n', suite_data)
+        self.assertListEqual(['MyLib.py'], list(self.test_obj._dependencies))
+
+    def test_prune_test_suite(self):
+        """
+        Test that prune_test_suite() removes the suites without any selected test cases, matching long names as the
+        agent sees them
+        """
+        for robot_args in ({'test': 'TS1.1'}, {'test': 'Root.Rf Client Test Resources.TS1.TS1.1'},
+                           {'test': 'TS1.*', 'exclude': 'NoSuchTag'}):
+            suite = TestSuiteBuilder().build(self.resource_dir)
+            RemoteFrameworkClient.prune_test_suite(suite, robot_args)
+            self.assertListEqual(['TS1'], [child.name for child in collect_test_suites(suite)])
+            self.assertEqual('Rf Client Test Resources', suite.name)
+
+        # The agent's long names include the local root suite, so a name without it selects nothing
+        suite = TestSuiteBuilder().build(self.resource_dir)
+        RemoteFrameworkClient.prune_test_suite(suite, {'test': 'Root.TS1.TS1.1'})
+        self.assertEqual(4, suite.test_count)
+
+    def test_prune_test_suite_nothing_selected(self):
+        """
+        Test that prune_test_suite() leaves the suite tree as it was when no test cases are selected
+        """
+        suite = TestSuiteBuilder().build(self.resource_dir)
+        expected_suites = [child.longname for child in collect_test_suites(suite)]
+
+        RemoteFrameworkClient.prune_test_suite(suite, {'include': 'NoSuchTag'})
+
+        self.assertListEqual(expected_suites, [child.longname for child in collect_test_suites(suite)])
+        self.assertEqual(4, suite.test_count)
+
+    def test_execute_run_prunes_unselected_suites(self):
+        """
+        Test that execute_run() only packages the suites, and their dependencies, that contain selected test cases
+        """
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(side_effect=LEGACY_AGENT_FAULT)
+        mock_server_proxy.execute_robot_run = MagicMock(return_value={'ret_code': 0})
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            test_obj.execute_run([self.resource_dir], 'robot', None, {'test': 'S_TS2.1'})
+
+        suites, dependencies, robot_args, _ = mock_server_proxy.execute_robot_run.call_args[0]
+        self.assertListEqual(['S-TS2.robot'], list(suites))
+        self.assertListEqual(['Lib1.py'], list(dependencies))
+        self.assertEqual({'test': 'S_TS2.1'}, robot_args)
+
+    def test_upload_missing_blobs_batches(self):
+        """
+        Test that _upload_missing_blobs() splits the upload into multiple requests when it exceeds the batch size
+        """
+        blobs = dict((calculate_digest(data), data) for data in [b'a' * 10, b'b' * 10, b'c' * 10])
+        mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
+        mock_server_proxy.get_capabilities = MagicMock(return_value=['content_addressed_upload'])
+        mock_server_proxy.get_missing_blobs = MagicMock(return_value=sorted(blobs.keys()))
+        mock_server_proxy.upload_blobs = MagicMock()
+
+        with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy), \
+                patch('rfremoterunner.rf_client.MAX_UPLOAD_BATCH_BYTES', 20):
+            test_obj = RemoteFrameworkClient('127.0.0.1')
+            test_obj._upload_missing_blobs(blobs)
+
+        self.assertEqual(2, mock_server_proxy.upload_blobs.call_count)
+        uploaded = {}
+        for call in mock_server_proxy.upload_blobs.call_args_list:
+            uploaded.update(dict((digest, data.data) for digest, data in call[0][0].items()))
+        self.assertDictEqual(blobs, uploaded)
+
     def test_execute_run_correct_suite_filtering(self):
         """
         Test that execute_run() correctly collects the test suites and resources when given a suite filter
         """
         mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
-        mock_server_proxy.execute_robot_run = lambda suites, deps, robot_args, debug: None
+        mock_server_proxy.get_capabilities = MagicMock(side_effect=LEGACY_AGENT_FAULT)
+        mock_server_proxy.execute_robot_run = lambda suites, deps, robot_args, debug: {}
 
         with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
             # In order to mock the server we need to initialize this here, so the one created in the setup cannot be
@@ -117,7 +671,8 @@ class TestRemoteFrameworkClient(unittest.TestCase):
         Test that execute_run() correctly collects the test suites and resources when given a suite extension filter.
         """
         mock_server_proxy = MagicMock(spec=xmlrpc_client.ServerProxy)
-        mock_server_proxy.execute_robot_run = lambda suites, deps, robot_args, debug: None
+        mock_server_proxy.get_capabilities = MagicMock(side_effect=LEGACY_AGENT_FAULT)
+        mock_server_proxy.execute_robot_run = lambda suites, deps, robot_args, debug: {}
 
         with patch('rfremoterunner.rf_client.xmlrpc_client.ServerProxy', return_value=mock_server_proxy):
             # In order to mock the server we need to initialize this here, so the one created in the setup cannot be
@@ -1,20 +1,50 @@
+from contextlib import closing
 from io import open
+import io
 import os
+import re
 import shutil
+import sys
+import tempfile
+import threading
 import unittest
-from mock import patch
+import six.moves.xmlrpc_client as xmlrpc_client
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+from mock import patch, MagicMock
 
-from rfremoterunner.rf_server import RobotFrameworkServer
+from rfremoterunner.bundles import write_bundle
+from rfremoterunner.rf_client import RemoteFrameworkClient
+from rfremoterunner.rf_server import RobotFrameworkServer, BUNDLE_RETENTION_SECONDS
+from rfremoterunner.utils import calculate_digest
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not available in Py2
+    tracemalloc = None
+
+
+def _exit_worker(workspace_dir, robot_args, console_path, output_dir, conn):  # pylint: disable=unused-argument
+    """
+    Stand-in worker entrypoint that exits without sending a result
+    """
+    os._exit(1)  # pylint: disable=protected-access
 
 
 class TestRemoteFrameworkServer(unittest.TestCase):
 
     def setUp(self):
-        self.test_obj = RobotFrameworkServer()
+        self.blob_store_dir = tempfile.mkdtemp()
+        self.workspace_store_dir = tempfile.mkdtemp()
+        self.test_obj = RobotFrameworkServer(blob_store_dir=self.blob_store_dir,
+                                             workspace_store_dir=self.workspace_store_dir)
         self.to_delete = None
 
     def tearDown(self):
-        self.test_obj._server.server_close()
+        self.test_obj.close()
+        shutil.rmtree(self.blob_store_dir)
+        shutil.rmtree(self.workspace_store_dir)
         if self.to_delete:
             shutil.rmtree(self.to_delete)
 
@@ -69,18 +99,60 @@ class TestRemoteFrameworkServer(unittest.TestCase):
         self.file_contents_is_equal(os.path.join(workspace_dir, 'dep2.robot'), dependencies['dep2.robot'])
         self.file_contents_is_equal(os.path.join(workspace_dir, 'dep3.py'), dependencies['dep3.py'])
 
+    def test_upload_blobs_and_get_missing_blobs(self):
+        """
+        Test that get_missing_blobs() no longer reports a file once it has been uploaded with upload_blobs()
+        """
+        data = u'ß file contents'.encode('utf-8')
+        digest = calculate_digest(data)
+        other_digest = calculate_digest(b'another file')
+
+        self.assertListEqual([digest, other_digest], self.test_obj.get_missing_blobs([digest, other_digest]))
+        self.test_obj.upload_blobs({digest: xmlrpc_client.Binary(data)})
+        self.assertListEqual([other_digest], self.test_obj.get_missing_blobs([digest, other_digest]))
+
+    def test_create_workspace_from_manifest(self):
+        """
+        Test that _create_workspace_from_manifest() copies the blobs into the correct directory structure
+        """
+        suite_data = u'suite data ß'
+        dep_data = u'dependency data'
+        self.test_obj.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8')),
+                                    calculate_digest(dep_data): xmlrpc_client.Binary(dep_data.encode('utf-8'))})
+        manifest = {
+            'A/B/Test Suite1.robot': calculate_digest(suite_data),
+            'Test Suite2.robot': calculate_digest(suite_data),
+            'dep1.robot': calculate_digest(dep_data)
+        }
+
+        workspace_dir = self.test_obj._create_workspace_from_manifest(manifest)
+        self.to_delete = workspace_dir
+
+        self.file_contents_is_equal(os.path.join(workspace_dir, 'A', 'B', 'Test Suite1.robot'), suite_data)
+        self.file_contents_is_equal(os.path.join(workspace_dir, 'Test Suite2.robot'), suite_data)
+        self.file_contents_is_equal(os.path.join(workspace_dir, 'dep1.robot'), dep_data)
+
+    def test_create_workspace_from_manifest_missing_blob(self):
+        """
+        Test that _create_workspace_from_manifest() raises and removes the workspace when a blob has not been uploaded
+        """
+        with patch('rfremoterunner.rf_server.tempfile.mkdtemp', return_value=tempfile.mkdtemp()) as patched_mkdtemp:
+            self.assertRaises(KeyError, self.test_obj._create_workspace_from_manifest,
+                              {'TS1.robot': calculate_digest(b'not uploaded')})
+            self.assertFalse(os.path.exists(patched_mkdtemp.return_value))
+
     def test_execute_robot_run_correct_case(self):
         """
         Test the correct case for execute_robot_run(), namely the artifacts are processed correctly.
         """
-        expected_dict_keys = ['std_out_err', 'output_xml', 'log_html', 'report_html', 'ret_code']
+        expected_dict_keys = ['std_out_err', 'output_xml', 'log_html', 'report_html', 'ret_code', 'timings']
         expected_output_bytes = 'output.xml bytes'
         expected_log_bytes = 'log.html bytes'
         expected_report_bytes = 'report.html bytes'
         robot_artifacts = (expected_output_bytes, expected_log_bytes, expected_report_bytes)
         expected_rc = 123
         with patch('rfremoterunner.rf_server.RobotFrameworkServer._create_workspace', return_value='directory'), \
-                patch('rfremoterunner.rf_server.run', return_value=expected_rc), \
+                patch('rfremoterunner.workers.run', return_value=expected_rc), \
                 patch('rfremoterunner.rf_server.RobotFrameworkServer._read_robot_artifacts_from_disk',
                       return_value=robot_artifacts), \
                 patch('rfremoterunner.rf_server.shutil.rmtree') as patched_rmtree, \
@@ -94,6 +166,502 @@ class TestRemoteFrameworkServer(unittest.TestCase):
 
             patched_rmtree.assert_called_once_with('directory')
 
+    def test_execute_robot_run_restores_interpreter_state(self):
+        """
+        Test that in-process runs leave sys.path and sys.modules as they found them, so that a test library imported
+        from one run's workspace isn't reused by the next run
+        """
+        expected_sys_path = list(sys.path)
+        suite_data = '*** Settings ***\nLibrary    RunLib\n*** Test Cases ***\nTC1\n    ${run}=    Get Run\n' \
+                     '    Should Be Equal    ${run}    {}\n'
+        for run in ['first', 'second']:
+            suites = {'Suite1.robot': {'path': '', 'suite_data': suite_data.replace('{}', run)}}
+            dependencies = {'RunLib.py': 'def get_run():\n    return "{}"\n'.format(run)}
+            result = self.test_obj.execute_robot_run(suites, dependencies, {})
+            self.assertEqual(0, result['ret_code'], result['std_out_err'].data.decode('utf-8'))
+            self.assertListEqual(expected_sys_path, sys.path)
+            self.assertNotIn('RunLib', sys.modules)
+
+    def test_execute_robot_run_in_workers(self):
+        """
+        Test that runs execute concurrently in worker processes without changing the CWD or PYTHONPATH of the agent
+        """
+        worker_server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, workers=2)
+        expected_cwd = os.getcwd()
+        expected_sys_path = list(sys.path)
+        results = {}
+
+        def execute(name):
+            suites = {name + '.robot': {'path': '', 'suite_data': '*** Test Cases ***\nTC1\n    Log    ' + name + '\n'}}
+            results[name] = worker_server.execute_robot_run(suites, {}, {})
+
+        try:
+            threads = [threading.Thread(target=execute, args=(name,)) for name in ['Suite1', 'Suite2']]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            worker_server.close()
+
+        self.assertListEqual(['Suite1', 'Suite2'], sorted(results.keys()))
+        for name, result in results.items():
+            self.assertEqual(0, result['ret_code'])
+            self.assertIn(name, result['output_xml'].data.decode('utf-8'))
+        self.assertEqual(expected_cwd, os.getcwd())
+        self.assertListEqual(expected_sys_path, sys.path)
+
+    def test_run_robot_in_worker_process_dies(self):
+        """
+        Test that _run_robot_in_worker() raises when the worker process exits without returning a result
+        """
+        worker_server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, workers=1)
+        try:
+            with patch('rfremoterunner.rf_server.robot_worker_main', _exit_worker):
+                self.assertRaises(RuntimeError, worker_server._run_robot_in_worker, 'workspace', {},
+                                  MagicMock(console_path='console.log'))
+        finally:
+            worker_server.close()
+
+    def test_preload_modules(self):
+        """
+        Test that the worker processes start with the preload modules already imported, and that modules that can't be
+        imported are reported
+        """
+        worker_server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, workers=1,
+                                             preload_modules=['rfremoterunner.workers', 'rfremoterunner_missing'])
+        try:
+            self.assertListEqual(['rfremoterunner_missing'], worker_server._start_worker_context())
+        finally:
+            worker_server.close()
+
+        with patch('rfremoterunner.rf_server.logger') as mock_logger:
+            in_process_server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir,
+                                                     preload_modules=['json', 'rfremoterunner_missing'])
+            in_process_server.close()
+        mock_logger.warning.assert_called_once_with('Failed to preload modules: %s', 'rfremoterunner_missing')
+
+    def test_submit_run_and_get_job_result(self):
+        """
+        Test that a run queued with submit_run() can be polled with get_job_status() and collected with
+        get_job_result(), after which the job is forgotten
+        """
+        suite_data = u'*** Test Cases ***\nTC1\n    Log    Hello\n'
+        self.test_obj.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8'))})
+
+        job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+        self.assertIn(self.test_obj.get_job_status(job_id)['state'], ['queued', 'running', 'finished'])
+        self.test_obj._jobs.get(job_id).wait()
+        self.assertEqual('finished', self.test_obj.get_job_status(job_id)['state'])
+
+        # The console output is streamed rather than returned in the result
+        console_output = self.test_obj.get_job_output(job_id, 0)
+        self.assertIn('TC1', console_output['data'].data.decode('utf-8'))
+        self.assertEqual(len(console_output['data'].data), console_output['offset'])
+
+        result = self.test_obj.get_job_result(job_id)
+        self.assertEqual(0, result['ret_code'])
+        self.assertIn('TC1', result['output_xml'].data.decode('utf-8'))
+        self.assertNotIn('std_out_err', result)
+        self.assertListEqual(['artifacts', 'queue', 'robot', 'workspace'], sorted(result['timings']['durations']))
+        self.assertEqual(sum(len(result[name].data) for name in ['output_xml', 'log_html', 'report_html']),
+                         result['timings']['bytes']['artifacts'])
+        self.assertRaises(KeyError, self.test_obj.get_job_status, job_id)
+
+    def test_submit_run_queue_full(self):
+        """
+        Test that a run submitted while the queue is full is rejected straight away with a fault that gives the retry
+        time, and that a queued run reports how many runs are ahead of it
+        """
+        release = threading.Event()
+        server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, max_queued=1)
+        self.addCleanup(server.close)
+        self.addCleanup(release.set)
+        with patch.object(server, '_execute_run', side_effect=lambda *args, **kwargs: release.wait(5) and {}):
+            running_job_id = server.submit_run({}, {}, {})
+            running_job = server._jobs.get(running_job_id)
+            while running_job.state == 'queued':
+                running_job.wait(0.01)
+            queued_job_id = server.submit_run({}, {}, {'priority': 'high'})
+
+            with self.assertRaises(xmlrpc_client.Fault) as context:
+                server.submit_run({}, {}, {'priority': 'low'})
+            self.assertEqual(429, context.exception.faultCode)
+            self.assertIn('Retry after', context.exception.faultString)
+            self.assertEqual(1, server._metrics.runs_rejected.get())
+            self.assertNotIn('queue_position', server.get_job_status(running_job_id))
+            self.assertEqual(0, server.get_job_status(queued_job_id)['queue_position'])
+            release.set()
+            self.assertTrue(server._jobs.get(queued_job_id).wait(5))
+
+    def test_metrics_endpoint(self):
+        """
+        Test that the agent serves its run counts, durations and bytes transferred to a GET of /metrics
+        """
+        server = RobotFrameworkServer('127.0.0.1', 0, blob_store_dir=self.blob_store_dir,
+                                      workspace_store_dir=self.workspace_store_dir)
+        server_thread = threading.Thread(target=server._server.serve_forever)
+        server_thread.start()
+        self.addCleanup(server.close)
+        self.addCleanup(server_thread.join)
+        self.addCleanup(server.shutdown)
+        address = 'http://127.0.0.1:{}'.format(server._server.server_address[1])
+
+        suite_data = b'*** Test Cases ***\nTC1\n    Log    Hello\n'
+        proxy = xmlrpc_client.ServerProxy(address)
+        proxy.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data)})
+        job_id = proxy.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+        server._jobs.get(job_id).wait()
+        proxy.get_job_result(job_id)
+
+        with closing(urlopen(address + '/metrics')) as response:
+            metrics = response.read().decode('utf-8')
+        self.assertIn('rfremoterunner_runs_total{state="finished"} 1\n', metrics)
+        self.assertIn('rfremoterunner_queue_wait_seconds_count 1\n', metrics)
+        self.assertIn('rfremoterunner_run_duration_seconds_bucket{le="+Inf"} 1\n', metrics)
+        received = int(re.search('rfremoterunner_received_bytes_total ([0-9]+)', metrics).group(1))
+        sent = int(re.search('rfremoterunner_sent_bytes_total ([0-9]+)', metrics).group(1))
+        self.assertGreater(received, len(suite_data))
+        self.assertGreater(sent, 0)
+        self.assertRaises(HTTPError, urlopen, address + '/other')
+
+    def test_get_job_output_chunked(self):
+        """
+        Test that get_job_output() returns the console output in chunks of at most MAX_OUTPUT_CHUNK_BYTES
+        """
+        console_output = b'0123456789' * 3
+
+        def target(job):
+            with open(job.console_path, 'wb') as file_handle:
+                file_handle.write(console_output)
+
+        job = self.test_obj._jobs.submit(target)
+        job.wait()
+        received = []
+        offset = 0
+        with patch('rfremoterunner.rf_server.MAX_OUTPUT_CHUNK_BYTES', 8):
+            while True:
+                chunk = self.test_obj.get_job_output(job.job_id, offset)
+                if chunk['offset'] == offset:
+                    break
+                self.assertLessEqual(len(chunk['data'].data), 8)
+                received.append(chunk['data'].data)
+                offset = chunk['offset']
+        self.assertEqual(console_output, b''.join(received))
+
+    def test_get_job_result_failed_job(self):
+        """
+        Test that get_job_result() raises the error of a job that failed
+        """
+        job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(b'not uploaded')}, {}, {})
+        self.test_obj._jobs.get(job_id).wait()
+        status = self.test_obj.get_job_status(job_id)
+        self.assertEqual('failed', status['state'])
+        self.assertIn('not held in the store', status['error'])
+        self.assertRaises(KeyError, self.test_obj.get_job_result, job_id)
+
+    def test_submit_run_bundle(self):
+        """
+        Test that a run submitted with a bundle executes in the workspace the bundle was extracted into, and that a
+        bundle can only be used once
+        """
+        bundle = io.BytesIO()
+        write_bundle(bundle, {'Suites/Suite1.robot': b'*** Test Cases ***\nTC1\n    Log    Hello\n'})
+        bundle.seek(0)
+        bundle_id = self.test_obj.store_bundle(bundle)
+
+        job_id = self.test_obj.submit_run({}, {}, {'bundle': bundle_id})
+        self.test_obj._jobs.get(job_id).wait()
+        result = self.test_obj.get_job_result(job_id)
+        self.assertEqual(0, result['ret_code'])
+        self.assertIn('TC1', result['output_xml'].data.decode('utf-8'))
+
+        job_id = self.test_obj.submit_run({}, {}, {'bundle': bundle_id})
+        self.test_obj._jobs.get(job_id).wait()
+        status = self.test_obj.get_job_status(job_id)
+        self.assertEqual('failed', status['state'])
+        self.assertIn('Unknown bundle', status['error'])
+
+    def store_bundle(self, server=None):
+        """
+        Helper function to upload a bundle containing a single test suite
+
+        :param server: Agent to upload the bundle to. Defaults to the agent under test
+        :type server: RobotFrameworkServer
+
+        :return: ID of the bundle and the workspace it was extracted into
+        :rtype: tuple
+        """
+        server = server or self.test_obj
+        bundle = io.BytesIO()
+        write_bundle(bundle, {'Suite1.robot': b'*** Test Cases ***\nTC1\n    Log    Hello\n'})
+        bundle.seek(0)
+        bundle_id = server.store_bundle(bundle)
+        return bundle_id, server._bundles[bundle_id][0]
+
+    def test_cancel_job_queued_frees_place(self):
+        """
+        Test that cancelling a queued run makes room in a full queue for another run
+        """
+        release = threading.Event()
+        server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, max_queued=1)
+        self.addCleanup(server.close)
+        self.addCleanup(release.set)
+        with patch.object(server, '_execute_run', side_effect=lambda *args, **kwargs: release.wait(5) and {}):
+            running_job = server._jobs.get(server.submit_run({}, {}, {}))
+            while running_job.state == 'queued':
+                running_job.wait(0.01)
+            queued_job_id = server.submit_run({}, {}, {})
+            self.assertRaises(xmlrpc_client.Fault, server.submit_run, {}, {}, {})
+
+            self.assertEqual('cancelled', server.cancel_job(queued_job_id)['state'])
+            accepted_job_id = server.submit_run({}, {}, {})
+            self.assertEqual(0, server.get_job_status(accepted_job_id)['queue_position'])
+            release.set()
+            self.assertTrue(server._jobs.get(accepted_job_id).wait(5))
+
+    def test_submit_run_bundle_cancelled_while_queued(self):
+        """
+        Test that the workspace of a bundle is deleted when the run submitted with it is cancelled before it starts
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        running_job = self.test_obj._jobs.submit(lambda job: release.wait(5))
+        while running_job.state == 'queued':
+            running_job.wait(0.01)
+        bundle_id, workspace_dir = self.store_bundle()
+
+        job_id = self.test_obj.submit_run({}, {}, {'bundle': bundle_id})
+        self.assertEqual('cancelled', self.test_obj.cancel_job(job_id)['state'])
+        self.assertFalse(os.path.exists(workspace_dir))
+        self.assertNotIn(bundle_id, self.test_obj._bundles)
+
+    def test_submit_run_bundle_rejected(self):
+        """
+        Test that the workspace of a bundle is deleted when the run submitted with it is rejected
+        """
+        server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, max_queued=0)
+        self.addCleanup(server.close)
+        bundle_id, workspace_dir = self.store_bundle(server)
+
+        with self.assertRaises(xmlrpc_client.Fault):
+            server.submit_run({}, {}, {'bundle': bundle_id})
+        self.assertFalse(os.path.exists(workspace_dir))
+        self.assertNotIn(bundle_id, server._bundles)
+
+    def test_store_bundle_prunes_unclaimed_bundles(self):
+        """
+        Test that bundles no run is submitted with within the retention period are deleted
+        """
+        bundle_id, workspace_dir = self.store_bundle()
+        stored_time = self.test_obj._bundles[bundle_id][1]
+
+        with patch('rfremoterunner.rf_server.time.time', return_value=stored_time + BUNDLE_RETENTION_SECONDS + 1):
+            self.store_bundle()
+        self.assertFalse(os.path.exists(workspace_dir))
+        self.assertNotIn(bundle_id, self.test_obj._bundles)
+
+    def test_cancel_job(self):
+        """
+        Test that cancel_job() kills a run executing in a worker process, cleans up its workspace and forgets the job
+        """
+        worker_server = RobotFrameworkServer(port=0, blob_store_dir=self.blob_store_dir, workers=1)
+        self.addCleanup(worker_server.close)
+        suite_data = u'*** Test Cases ***\nTC1\n    Sleep    30\n'
+        worker_server.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8'))})
+        workspaces = []
+        create_workspace = worker_server._create_workspace_from_manifest
+
+        def record_workspace(manifest):
+            workspaces.append(create_workspace(manifest))
+            return workspaces[-1]
+
+        with patch.object(worker_server, '_create_workspace_from_manifest', side_effect=record_workspace):
+            job_id = worker_server.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+            job = worker_server._jobs.get(job_id)
+            # Wait for the test case to start
+            while b'TC1' not in worker_server.get_job_output(job_id, 0)['data'].data and not job.is_done():
+                job.wait(0.1)
+            status = worker_server.cancel_job(job_id)
+
+        self.assertEqual('cancelled', status['state'])
+        self.assertLess(job.finished_time - job.started_time, 30)
+        self.assertFalse(os.path.exists(workspaces[0]))
+        self.assertRaises(KeyError, worker_server.get_job_status, job_id)
+
+    def test_cancel_job_in_process(self):
+        """
+        Test that cancel_job() stops a run executing inside the agent process before its next keyword, and that the
+        next run is unaffected
+        """
+        suite_data = u'*** Test Cases ***\nTC1\n    Sleep    0.5\nTC2\n    Sleep    30\n'
+        self.test_obj.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8'))})
+
+        job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+        job = self.test_obj._jobs.get(job_id)
+        while job.state == 'queued':
+            job.wait(0.01)
+        status = self.test_obj.cancel_job(job_id)
+
+        self.assertEqual('cancelled', status['state'])
+        self.assertLess(job.finished_time - job.started_time, 30)
+        result = self.test_obj.execute_robot_run(
+            {'Suite2.robot': {'path': '', 'suite_data': '*** Test Cases ***\nTC1\n    Log    Hello\n'}}, {}, {})
+        self.assertEqual(0, result['ret_code'])
+
+    def test_cancel_job_queued(self):
+        """
+        Test that cancel_job() returns straight away for a job that is still queued, and that the job is never executed
+        """
+        suite_data = u'*** Test Cases ***\nTC1\n    Sleep    30\n'
+        self.test_obj.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8'))})
+        running_job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+        running_job = self.test_obj._jobs.get(running_job_id)
+        while running_job.state == 'queued':
+            running_job.wait(0.01)
+        queued_job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {}, {})
+        queued_job = self.test_obj._jobs.get(queued_job_id)
+
+        with patch('rfremoterunner.rf_server.CANCEL_TIMEOUT_SECONDS', 5):
+            status = self.test_obj.cancel_job(queued_job_id)
+        self.assertEqual('cancelled', status['state'])
+        self.assertIsNone(queued_job.started_time)
+        self.assertRaises(KeyError, self.test_obj.get_job_status, queued_job_id)
+
+        self.test_obj.cancel_job(running_job_id)
+        self.assertIsNone(queued_job.started_time)
+
+    def test_get_job_result_cancelled_after_run(self):
+        """
+        Test that get_job_result() reports a job cancelled after its run returned as cancelled and forgets it
+        """
+        def target(job):
+            job.cancel()
+            return {'ret_code': 0, 'artifact_sizes': {}}
+
+        job = self.test_obj._jobs.submit(target)
+        self.assertTrue(job.wait(5))
+        with self.assertRaises(RuntimeError) as context:
+            self.test_obj.get_job_result(job.job_id)
+        self.assertIn('was cancelled', str(context.exception))
+        self.assertRaises(KeyError, self.test_obj.get_job_status, job.job_id)
+
+    def test_submit_run_chunked_artifacts(self):
+        """
+        Test that the artifacts of a run submitted with chunked_artifacts are kept after get_job_result(), can be read
+        in chunks with read_artifact() and are deleted by release_job()
+        """
+        suite_data = u'*** Test Cases ***\nTC1\n    Log    Hello\n'
+        self.test_obj.upload_blobs({calculate_digest(suite_data): xmlrpc_client.Binary(suite_data.encode('utf-8'))})
+        job_id = self.test_obj.submit_run({'Suite1.robot': calculate_digest(suite_data)}, {'report': 'NONE'},
+                                          {'chunked_artifacts': True})
+        job = self.test_obj._jobs.get(job_id)
+        job.wait()
+
+        result = self.test_obj.get_job_result(job_id)
+        self.assertEqual(0, result['ret_code'])
+        self.assertListEqual(['log_html', 'output_xml'], sorted(result['artifact_sizes'].keys()))
+
+        received = []
+        offset = 0
+        with patch('rfremoterunner.rf_server.MAX_ARTIFACT_CHUNK_BYTES', 1024):
+            while True:
+                chunk = self.test_obj.read_artifact(job_id, 'output_xml', offset)
+                if chunk['offset'] == offset:
+                    break
+                self.assertLessEqual(len(chunk['data'].data), 1024)
+                received.append(chunk['data'].data)
+                offset = chunk['offset']
+        output_xml = b''.join(received)
+        self.assertEqual(result['artifact_sizes']['output_xml'], len(output_xml))
+        self.assertIn(b'TC1', output_xml)
+        self.assertRaises(ValueError, self.test_obj.read_artifact, job_id, 'console', 0)
+
+        self.assertTrue(self.test_obj.release_job(job_id))
+        self.assertFalse(os.path.exists(job.artifact_dir))
+        self.assertRaises(KeyError, self.test_obj.read_artifact, job_id, 'output_xml', 0)
+
+    @unittest.skipIf(tracemalloc is None, "tracemalloc is not available in Py2")
+    def test_download_artifact_bounded_memory(self):
+        """
+        Test that downloading a large artifact through the agent and client keeps the peak memory use of both to a
+        small multiple of the chunk size rather than the size of the artifact
+        """
+        artifact_size = 8 * 1024 * 1024
+        chunk_size = 256 * 1024
+        server = RobotFrameworkServer('127.0.0.1', 0, blob_store_dir=self.blob_store_dir)
+        server_thread = threading.Thread(target=server._server.serve_forever)
+        server_thread.start()
+        self.addCleanup(server.close)
+        self.addCleanup(server_thread.join)
+        self.addCleanup(server._server.shutdown)
+
+        def target(job):
+            os.makedirs(job.artifact_dir)
+            with open(os.path.join(job.artifact_dir, 'output.xml'), 'wb') as file_handle:
+                for _ in range(artifact_size // chunk_size):
+                    file_handle.write(os.urandom(chunk_size))
+            return {'ret_code': 0, 'artifact_sizes': {'output_xml': artifact_size}}
+
+        job = server._jobs.submit(target)
+        job.wait()
+        download_path = os.path.join(self.blob_store_dir, 'downloaded.xml')
+        client = RemoteFrameworkClient('127.0.0.1:{}'.format(server._server.server_address[1]))
+
+        tracemalloc.start()
+        try:
+            with patch('rfremoterunner.rf_server.MAX_ARTIFACT_CHUNK_BYTES', chunk_size), \
+                    patch('rfremoterunner.request_handler.ARTIFACT_CHUNK_BYTES', chunk_size):
+                client._download_artifacts(job.job_id, job.result, {'output_xml': download_path})
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(artifact_size, os.path.getsize(download_path))
+        self.assertLess(peak, 16 * chunk_size)
+        self.assertRaises(KeyError, server._jobs.get, job.job_id)
+
+    def test_submit_run_warm_workspace(self):
+        """
+        Test that a run in a persistent workspace only needs the changed files, and that the workspace is kept without
+        any test artifacts for the next run
+        """
+        suite_1 = u'*** Test Cases ***\nTC1\n    Log    Hello\n'
+        suite_2 = u'*** Test Cases ***\nTC2\n    Log    Hello\n'
+        self.test_obj.upload_blobs({calculate_digest(suite_1): xmlrpc_client.Binary(suite_1.encode('utf-8')),
+                                    calculate_digest(suite_2): xmlrpc_client.Binary(suite_2.encode('utf-8'))})
+
+        def run(changes, deleted_paths):
+            state = self.test_obj.get_workspace_state('ws1')
+            job_id = self.test_obj.submit_run(changes, {}, {'workspace': {'name': 'ws1',
+                                                                          'base_revision': state['revision'],
+                                                                          'deleted_paths': deleted_paths}})
+            self.test_obj._jobs.get(job_id).wait()
+            return self.test_obj.get_job_result(job_id)
+
+        self.assertEqual({}, self.test_obj.get_workspace_state('ws1')['manifest'])
+        result = run({'A/Suite1.robot': calculate_digest(suite_1)}, [])
+        self.assertIn('TC1', result['output_xml'].data.decode('utf-8'))
+
+        result = run({'Suite2.robot': calculate_digest(suite_2)}, [])
+        output_xml = result['output_xml'].data.decode('utf-8')
+        self.assertIn('TC1', output_xml)
+        self.assertIn('TC2', output_xml)
+
+        result = run({}, ['A/Suite1.robot'])
+        self.assertNotIn('TC1', result['output_xml'].data.decode('utf-8'))
+        self.assertEqual({'Suite2.robot': calculate_digest(suite_2)},
+                         self.test_obj.get_workspace_state('ws1')['manifest'])
+        self.assertListEqual(['Suite2.robot'], os.listdir(os.path.join(self.workspace_store_dir, 'ws1')))
+
+    def test_submit_run_warm_workspace_stale_revision(self):
+        """
+        Test that a run fails if the persistent workspace has changed since the client retrieved its state
+        """
+        job_id = self.test_obj.submit_run({}, {}, {'workspace': {'name': 'ws1', 'base_revision': 'stale'}})
+        self.test_obj._jobs.get(job_id).wait()
+        self.assertIn('has changed', self.test_obj.get_job_status(job_id)['error'])
+
     def test_read_robot_artifacts_from_disk_files_exist(self):
         """
         Test that _read_robot_artifacts_from_disk() calls through to read_file_from_disk() in order to read the test
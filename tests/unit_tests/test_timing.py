@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+from six import StringIO
+from robot import run
+
+from rfremoterunner.timing import TimingHistory, DEFAULT_TEST_DURATION
+
+
+class TestTimingHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.history_path = os.path.join(self.workspace, 'timings.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    @staticmethod
+    def create_suite(longname, test_count):
+        """
+        Helper function to create a mock suite with a number of test cases
+        """
+        suite = MagicMock()
+        suite.longname = longname
+        suite.tests = [MagicMock() for _ in range(test_count)]
+        return suite
+
+    def write_history(self, timings):
+        """
+        Helper function to write a timing history file
+        """
+        with open(self.history_path, 'wb') as file_handle:
+            file_handle.write(json.dumps(timings).encode('utf-8'))
+
+    def test_estimate_no_history(self):
+        """
+        Test that suites are weighted by their number of test cases when there is no history
+        """
+        test_obj = TimingHistory(self.history_path)
+        self.assertEqual(3 * DEFAULT_TEST_DURATION, test_obj.estimate(self.create_suite('Tests.TS1', 3)))
+
+    def test_estimate(self):
+        """
+        Test that the recorded duration is used for known suites and the average test case duration for unknown suites
+        """
+        self.write_history({'Tests.TS1': {'elapsed': 12.0, 'tests': 2}, 'Tests.TS2': {'elapsed': 4.0, 'tests': 2}})
+        test_obj = TimingHistory(self.history_path)
+
+        self.assertEqual(12.0, test_obj.estimate(self.create_suite('Tests.TS1', 2)))
+        self.assertEqual(12.0, test_obj.estimate(self.create_suite('Tests.TS3', 3)))
+
+    def test_invalid_history(self):
+        """
+        Test that an invalid history file is ignored
+        """
+        with open(self.history_path, 'wb') as file_handle:
+            file_handle.write(b'{not json')
+        test_obj = TimingHistory(self.history_path)
+        self.assertEqual(DEFAULT_TEST_DURATION, test_obj.estimate(self.create_suite('Tests.TS1', 1)))
+
+    def test_record_output_xml(self):
+        """
+        Test that the suite timings are harvested from an output xml written by the agent, keyed by their local name,
+        and saved to disk
+        """
+        suite_dir = os.path.join(self.workspace, 'Tests')
+        os.makedirs(suite_dir)
+        with open(os.path.join(suite_dir, 'TS1.robot'), 'wb') as file_handle:
+            file_handle.write(b'*** Test Cases ***\nTC1\n    Sleep    0.1\nTC2\n    No Operation\n')
+        output_path = os.path.join(self.workspace, 'output.xml')
+        run(self.workspace, name='Root', output=output_path, log='NONE', report='NONE', stdout=StringIO(),
+            stderr=StringIO())
+
+        test_obj = TimingHistory(self.history_path)
+        test_obj.record_output_xml(output_path)
+        test_obj.save()
+
+        with open(self.history_path, 'rb') as file_handle:
+            saved = json.loads(file_handle.read().decode('utf-8'))
+        self.assertListEqual(['Tests.TS1'], list(saved.keys()))
+        self.assertEqual(2, saved['Tests.TS1']['tests'])
+        self.assertGreaterEqual(saved['Tests.TS1']['elapsed'], 0.1)
+        self.assertEqual(saved['Tests.TS1']['elapsed'],
+                         TimingHistory(self.history_path).estimate(self.create_suite('Tests.TS1', 2)))
+
+    def test_record_output_xml_invalid(self):
+        """
+        Test that an output xml that can't be read is ignored
+        """
+        output_path = os.path.join(self.workspace, 'output.xml')
+        with open(output_path, 'wb') as file_handle:
+            file_handle.write(b'not xml')
+        test_obj = TimingHistory(self.history_path)
+        test_obj.record_output_xml(output_path)
+        self.assertEqual(DEFAULT_TEST_DURATION, test_obj.estimate(self.create_suite('Tests.TS1', 1)))
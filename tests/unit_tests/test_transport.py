@@ -0,0 +1,278 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import six.moves.http_client as http_client
+from mock import patch, MagicMock
+
+from rfremoterunner.bundles import write_bundle, write_bundle_file
+from rfremoterunner.compression import get_codec
+from rfremoterunner.request_handler import AgentRequestHandler
+from rfremoterunner.rf_server import RobotFrameworkServer
+from rfremoterunner.transport import BinaryTransport, XmlRpcTransport, TransportError, create_transport, \
+    write_frames, read_frames, calculate_frames_size, ChunkedWriter, ChunkedReader, LimitedReader, BLOBS_PATH, \
+    BUNDLES_PATH
+from rfremoterunner.utils import calculate_digest
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.blobs = dict((calculate_digest(data), data) for data in [b'*** Test Cases ***\n', b'', b'\x00\xff' * 100])
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def start_server(self):
+        """
+        Start an agent on a free port in a background thread
+
+        :return: The agent and the address to connect to it on
+        :rtype: tuple
+        """
+        server = RobotFrameworkServer('127.0.0.1', 0, blob_store_dir=os.path.join(self.workspace, 'blobs'),
+                                      workspace_store_dir=os.path.join(self.workspace, 'workspaces'))
+        server_thread = threading.Thread(target=server._server.serve_forever)
+        server_thread.start()
+        self.addCleanup(server.close)
+        self.addCleanup(server_thread.join)
+        self.addCleanup(server.shutdown)
+        return server, 'http://127.0.0.1:{}'.format(server._server.server_address[1])
+
+    def test_frames_round_trip(self):
+        """
+        Test that files written with write_frames() are read back by read_frames(), whether or not the length of the
+        body is known
+        """
+        body = io.BytesIO()
+        write_frames(self.blobs, body.write)
+        self.assertEqual(calculate_frames_size(self.blobs), len(body.getvalue()))
+        body.seek(0)
+        self.assertDictEqual(self.blobs, dict(read_frames(body, len(body.getvalue()))))
+        body.seek(0)
+        self.assertDictEqual(self.blobs, dict(read_frames(LimitedReader(body, len(body.getvalue())))))
+
+    def test_read_frames_truncated(self):
+        """
+        Test that read_frames() raises a ValueError when the body ends part way through a frame or a frame claims to
+        be longer than the body
+        """
+        body = io.BytesIO()
+        write_frames(self.blobs, body.write)
+        data = body.getvalue()
+        self.assertRaises(ValueError, list, read_frames(io.BytesIO(data[:-1]), len(data)))
+        self.assertRaises(ValueError, list, read_frames(io.BytesIO(data), len(data) - 1))
+        self.assertRaises(ValueError, list, read_frames(io.BytesIO(data[:-1])))
+        self.assertRaises(ValueError, list, read_frames(io.BytesIO(data[:10])))
+
+    def test_create_transport(self):
+        """
+        Test that the binary transport is only used when the agent supports it, compressed with a codec the agent
+        supports
+        """
+        proxy = MagicMock()
+        transport = create_transport('http://127.0.0.1:1471', proxy, ['binary_transport'])
+        self.assertIsInstance(transport, BinaryTransport)
+        self.assertIsNone(transport._codec)
+        transport = create_transport('http://127.0.0.1:1471', proxy, ['binary_transport', 'compression_gzip'])
+        self.assertEqual('gzip', transport._codec)
+        self.assertIsInstance(create_transport('http://127.0.0.1:1471', proxy, ['compression_gzip']), XmlRpcTransport)
+
+    def test_binary_upload_and_download(self):
+        """
+        Test that files uploaded over the binary transport are stored in the agent's blob store, and that a test
+        artifact is downloaded intact
+        """
+        server, address = self.start_server()
+        test_obj = BinaryTransport(address)
+        self.assertEqual(calculate_frames_size(self.blobs), test_obj.upload_blobs(self.blobs))
+        self.assertListEqual([], server.get_missing_blobs(list(self.blobs.keys())))
+
+        artifact = os.urandom(3 * 1024)
+
+        def target(job):
+            os.makedirs(job.artifact_dir)
+            with open(os.path.join(job.artifact_dir, 'output.xml'), 'wb') as file_handle:
+                file_handle.write(artifact)
+            return {'ret_code': 0, 'artifact_sizes': {'output_xml': len(artifact)}}
+
+        job = server._jobs.submit(target)
+        job.wait()
+        download = io.BytesIO()
+        self.assertEqual(len(artifact), test_obj.download_artifact(job.job_id, 'output_xml', download))
+        self.assertEqual(artifact, download.getvalue())
+
+    def test_binary_transport_compressed(self):
+        """
+        Test that uploads and downloads over the binary transport are compressed with the codec given, and the bytes
+        sent and received are the compressed sizes
+        """
+        server, address = self.start_server()
+        test_obj = BinaryTransport(address, 'gzip')
+        blobs = dict((calculate_digest(data), data) for data in [b'Log    Hello\n' * 1000, b'Log    World\n' * 1000])
+        self.assertLess(test_obj.upload_blobs(blobs), calculate_frames_size(blobs) // 10)
+        self.assertListEqual([], server.get_missing_blobs(list(blobs.keys())))
+
+        artifact = b'<robot>' + b'<msg>Hello</msg>' * 10000 + b'</robot>'
+
+        def target(job):
+            os.makedirs(job.artifact_dir)
+            with open(os.path.join(job.artifact_dir, 'output.xml'), 'wb') as file_handle:
+                file_handle.write(artifact)
+            return {'ret_code': 0, 'artifact_sizes': {'output_xml': len(artifact)}}
+
+        job = server._jobs.submit(target)
+        job.wait()
+        download = io.BytesIO()
+        self.assertLess(test_obj.download_artifact(job.job_id, 'output_xml', download), len(artifact) // 10)
+        self.assertEqual(artifact, download.getvalue())
+
+    def test_binary_transport_errors(self):
+        """
+        Test that a TransportError is raised when the agent rejects an upload that doesn't match its digest, or a
+        download of an artifact it doesn't hold
+        """
+        server, address = self.start_server()
+        test_obj = BinaryTransport(address)
+        self.assertRaises(TransportError, test_obj.upload_blobs, {calculate_digest(b'a'): b'b'})
+        self.assertListEqual([calculate_digest(b'b')], server.get_missing_blobs([calculate_digest(b'b')]))
+        self.assertRaises(TransportError, test_obj.download_artifact, 'unknown', 'output_xml', io.BytesIO())
+        job = server._jobs.submit(lambda job: {'ret_code': 0, 'artifact_sizes': {}})
+        job.wait()
+        self.assertRaises(TransportError, test_obj.download_artifact, job.job_id, '..', io.BytesIO())
+
+    def test_chunked_round_trip(self):
+        """
+        Test that a body written a piece at a time as chunks is read back intact, whatever size the reads are
+        """
+        pieces = [os.urandom(size) for size in (0, 10, 100 * 1024, 1, 70 * 1024)]
+        for compressor in (None, get_codec('gzip').compressor()):
+            conn = MagicMock()
+            writer = ChunkedWriter(conn, compressor)
+            for piece in pieces:
+                writer.write(piece)
+            writer.close()
+            body = b''.join(call[0][0] for call in conn.send.call_args_list)
+
+            reader = ChunkedReader(io.BytesIO(body + b'next request'))
+            data = []
+            while True:
+                chunk = reader.read(7000)
+                if not chunk:
+                    break
+                data.append(chunk)
+            data = b''.join(data)
+            self.assertEqual(writer.sent, len(data))
+            if compressor:
+                data = get_codec('gzip').decompressor().decompress(data)
+            self.assertEqual(b''.join(pieces), data)
+            self.assertEqual(b'', reader.read())
+
+        self.assertRaises(ValueError, ChunkedReader(io.BytesIO(b'xyz\r\n')).read)
+        self.assertRaises(ValueError, ChunkedReader(io.BytesIO(b'10\r\nshort')).read)
+
+    def test_binary_upload_bundle(self):
+        """
+        Test that a bundle uploaded over the binary transport is extracted into a workspace on the agent, whether it is
+        uncompressed, compressed as it is sent, or a bundle file that is already compressed
+        """
+        server, address = self.start_server()
+        files = {'Suites/Suite1.robot': b'*** Test Cases ***\nTC1\n    Log    Hello\n' * 100}
+        bundle_path = os.path.join(self.workspace, 'bundle.tar.gz')
+        write_bundle_file(bundle_path, files)
+        with open(bundle_path, 'rb') as file_handle:
+            bundle_file_data = file_handle.read()
+        uploads = [(None, lambda fileobj: write_bundle(fileobj, files), None),
+                   ('gzip', lambda fileobj: write_bundle(fileobj, files), None),
+                   (None, lambda fileobj: fileobj.write(bundle_file_data), 'gzip')]
+        for codec, write, encoding in uploads:
+            test_obj = BinaryTransport(address, codec)
+            bundle_id, sent = test_obj.upload_bundle(write, encoding)
+            if codec or encoding:
+                self.assertLess(sent, len(files['Suites/Suite1.robot']))
+            workspace_dir = server._claim_bundle(bundle_id)
+            self.addCleanup(shutil.rmtree, workspace_dir)
+            with open(os.path.join(workspace_dir, 'Suites', 'Suite1.robot'), 'rb') as file_handle:
+                self.assertEqual(files['Suites/Suite1.robot'], file_handle.read())
+        self.assertRaises(KeyError, server._claim_bundle, bundle_id)
+
+    def test_receive_bundle_reads_whole_body(self):
+        """
+        Test that the agent reads the whole body of a bundle upload before replying, including the padding after the
+        end of the archive, whether or not it is compressed
+        """
+        server, _ = self.start_server()
+        archive = io.BytesIO()
+        write_bundle(archive, {'Suites/Suite1.robot': b'*** Test Cases ***\nTC1\n    Log    Hello\n'})
+        data = archive.getvalue()
+        # The archive is padded out to a whole tar record, which is many chunks past the end of archive marker
+        self.assertGreater(len(data) - len(data.rstrip(b'\x00')), 8 * 1024)
+        compressor = get_codec('gzip').compressor()
+        for encoding, payload in ((None, data), ('gzip', compressor.compress(data) + compressor.flush())):
+            body = b''.join('{:x}\r\n'.format(len(payload[index:index + 512])).encode('ascii') +
+                            payload[index:index + 512] + b'\r\n' for index in range(0, len(payload), 512))
+            handler = AgentRequestHandler.__new__(AgentRequestHandler)
+            handler.headers = {'transfer-encoding': 'chunked', 'content-encoding': encoding}
+            handler.rfile = io.BytesIO(body + b'0\r\n\r\nnext request')
+            handler.server = MagicMock(agent=server)
+            handler._send_text = MagicMock()
+
+            handler._receive_bundle()
+
+            status, bundle_id = handler._send_text.call_args[0]
+            self.assertEqual(200, status)
+            self.addCleanup(shutil.rmtree, server._claim_bundle(bundle_id))
+            self.assertEqual(b'next request', handler.rfile.read())
+
+    def test_binary_upload_bundle_rejected(self):
+        """
+        Test that the agent rejects a bundle that isn't a valid archive, or isn't sent with chunked transfer encoding
+        """
+        server, address = self.start_server()
+        test_obj = BinaryTransport(address)
+        self.assertRaises(TransportError, test_obj.upload_bundle, lambda fileobj: fileobj.write(b'not a tar' * 1000))
+        self.assertDictEqual({}, server._bundles)
+
+        conn = http_client.HTTPConnection('127.0.0.1', server._server.server_address[1])
+        self.addCleanup(conn.close)
+        conn.request('POST', BUNDLES_PATH, b'data')
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(411, response.status)
+
+    def test_binary_upload_invalid_compressed_body(self):
+        """
+        Test that the agent rejects an upload whose body isn't valid for the codec it is labelled with
+        """
+        server, _ = self.start_server()
+        conn = http_client.HTTPConnection('127.0.0.1', server._server.server_address[1])
+        self.addCleanup(conn.close)
+        conn.request('POST', BLOBS_PATH, b'not gzip', {'Content-Encoding': 'gzip'})
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(400, response.status)
+
+    @patch('rfremoterunner.request_handler.MAX_DECOMPRESSED_UPLOAD_BYTES', 1024 * 1024)
+    def test_binary_upload_compressed_over_limit(self):
+        """
+        Test that the agent rejects a compressed upload that decompresses to more than the limit, without storing any
+        of it
+        """
+        server, _ = self.start_server()
+        data = b'\x00' * (4 * 1024 * 1024)
+        body = io.BytesIO()
+        write_frames({calculate_digest(data): data}, body.write)
+        compressor = get_codec('gzip').compressor()
+        compressed = compressor.compress(body.getvalue()) + compressor.flush()
+        self.assertLess(len(compressed), 64 * 1024)
+
+        conn = http_client.HTTPConnection('127.0.0.1', server._server.server_address[1])
+        self.addCleanup(conn.close)
+        conn.request('POST', BLOBS_PATH, compressed, {'Content-Encoding': 'gzip'})
+        response = conn.getresponse()
+        self.assertIn(b'more than 1048576 bytes', response.read())
+        self.assertEqual(400, response.status)
+        self.assertListEqual([calculate_digest(data)], server.get_missing_blobs([calculate_digest(data)]))
@@ -8,7 +8,7 @@ import six
 from robot.running.model import TestSuite
 
 from rfremoterunner.utils import normalize_xmlrpc_address, calculate_ts_parent_path, read_file_from_disk, \
-    write_file_to_disk
+    write_file_to_disk, calculate_digest, resolve_workspace_path
 
 
 class TestUtils(unittest.TestCase):
@@ -118,3 +118,26 @@ class TestUtils(unittest.TestCase):
         test_suite = TestSuite()
         actual_value = calculate_ts_parent_path(test_suite)
         self.assertEqual(expected_value, actual_value)
+
+    def test_calculate_digest(self):
+        """
+        Test that calculate_digest() gives the same digest for unicode data and its UTF-8 encoding
+        """
+        expected_value = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+        self.assertEqual(expected_value, calculate_digest(b''))
+        self.assertEqual(calculate_digest(u'ß'.encode('utf-8')), calculate_digest(u'ß'))
+
+    def test_resolve_workspace_path(self):
+        """
+        Test that resolve_workspace_path() joins a relative path onto the workspace directory
+        """
+        actual_value = resolve_workspace_path(self.workspace, 'A/B/TS1.robot')
+        self.assertEqual(os.path.join(os.path.abspath(self.workspace), 'A', 'B', 'TS1.robot'), actual_value)
+
+    def test_resolve_workspace_path_outside_workspace(self):
+        """
+        Test that resolve_workspace_path() rejects paths that would escape the workspace directory
+        """
+        self.assertRaises(ValueError, resolve_workspace_path, self.workspace, '../TS1.robot')
+        self.assertRaises(ValueError, resolve_workspace_path, self.workspace, 'A/../../TS1.robot')
+        self.assertRaises(ValueError, resolve_workspace_path, self.workspace, os.path.abspath('/TS1.robot'))
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rfremoterunner.blob_store import BlobStore
+from rfremoterunner.utils import calculate_digest
+from rfremoterunner.workspaces import WorkspaceStore, calculate_revision
+
+
+class TestWorkspaceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.blob_store = BlobStore(os.path.join(self.workspace, 'blobs'))
+        self.test_obj = WorkspaceStore(os.path.join(self.workspace, 'workspaces'))
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def put(self, data):
+        """
+        Helper function to add a blob to the blob store
+
+        :param data: Blob contents
+        :type data: bytes
+
+        :return: Digest of the blob
+        :rtype: str
+        """
+        digest = calculate_digest(data)
+        self.blob_store.put(digest, data)
+        return digest
+
+    def test_apply(self):
+        """
+        Test that apply() adds, changes and deletes files and records the new state of the workspace
+        """
+        digest_1 = self.put(b'file 1')
+        digest_2 = self.put(b'file 2')
+        workspace_dir = self.test_obj.apply('ws', calculate_revision({}), {'A/B/f1.robot': digest_1, 'f2.py': digest_2},
+                                            [], self.blob_store)
+        self.assertEqual({'A/B/f1.robot': digest_1, 'f2.py': digest_2}, self.test_obj.get_manifest('ws'))
+
+        digest_3 = self.put(b'file 2 changed')
+        revision = calculate_revision(self.test_obj.get_manifest('ws'))
+        self.test_obj.apply('ws', revision, {'f2.py': digest_3}, ['A/B/f1.robot'], self.blob_store)
+        self.assertEqual({'f2.py': digest_3}, self.test_obj.get_manifest('ws'))
+        self.assertListEqual(['f2.py'], os.listdir(workspace_dir))
+        with open(os.path.join(workspace_dir, 'f2.py'), 'rb') as file_handle:
+            self.assertEqual(b'file 2 changed', file_handle.read())
+
+    def test_apply_stale_revision(self):
+        """
+        Test that apply() rejects changes calculated against a different state of the workspace
+        """
+        self.test_obj.apply('ws', calculate_revision({}), {'f1.robot': self.put(b'file 1')}, [], self.blob_store)
+        self.assertRaises(ValueError, self.test_obj.apply, 'ws', calculate_revision({}), {}, [], self.blob_store)
+
+    def test_apply_missing_blob(self):
+        """
+        Test that the workspace is reset to empty if apply() fails part way through
+        """
+        self.test_obj.apply('ws', calculate_revision({}), {'f1.robot': self.put(b'file 1')}, [], self.blob_store)
+        revision = calculate_revision(self.test_obj.get_manifest('ws'))
+        self.assertRaises(KeyError, self.test_obj.apply, 'ws', revision, {'f2.robot': calculate_digest(b'missing')},
+                          [], self.blob_store)
+        self.assertEqual({}, self.test_obj.get_manifest('ws'))
+
+    def test_relative_root_dir(self):
+        """
+        Test that a relative root directory still refers to the same place after the CWD changes
+        """
+        old_cwd = os.getcwd()
+        os.chdir(self.workspace)
+        try:
+            test_obj = WorkspaceStore('relative_workspaces')
+            os.chdir(old_cwd)
+            workspace_dir = test_obj.apply('ws', calculate_revision({}), {'f1.robot': self.put(b'file 1')}, [],
+                                           self.blob_store)
+        finally:
+            os.chdir(old_cwd)
+        self.assertEqual(os.path.join(self.workspace, 'relative_workspaces', 'ws'), workspace_dir)
+        self.assertTrue(os.path.exists(os.path.join(workspace_dir, 'f1.robot')))
+
+    def test_invalid_name(self):
+        """
+        Test that a name that could be used to address a directory outside of the store is rejected
+        """
+        self.assertRaises(ValueError, self.test_obj.get_manifest, '../ws')
+        self.assertRaises(ValueError, self.test_obj.lock, '')